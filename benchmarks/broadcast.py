@@ -0,0 +1,80 @@
+"""Measure the CPU cost of broadcasting a stream to many WebSocket clients.
+
+The benchmark compares encoding the WebSocket frame separately for each
+client, as done by ``ws.send()``, with encoding the frame once and reusing it
+for all clients, as done by ``Turbo.push()``. The same comparison is made for
+connections that use the permessage-deflate extension, which is what browsers
+negotiate. The "deflate once" column is the path taken by ``Turbo.push()``
+with the default ``TURBO_WEBSOCKET_COMPRESSION`` setting.
+
+Usage: python benchmarks/broadcast.py [payload_size]
+"""
+import sys
+import time
+
+from wsproto import ConnectionType, WSConnection
+from wsproto.events import AcceptConnection, Request, TextMessage
+from wsproto.extensions import PerMessageDeflate
+
+from turbo_flask.connection import Message
+
+CLIENT_COUNTS = [1, 10, 100, 1000]
+
+
+def open_connection(deflate=False):
+    client = WSConnection(ConnectionType.CLIENT)
+    server = WSConnection(ConnectionType.SERVER)
+    extensions = [PerMessageDeflate()] if deflate else []
+    server.receive_data(client.send(Request(
+        host='localhost', target='/', extensions=extensions)))
+    next(server.events())
+    client.receive_data(server.send(AcceptConnection(extensions=extensions)))
+    return server
+
+
+def per_client(connections, stream):
+    for ws in connections:
+        ws.send(TextMessage(data=stream))
+
+
+def encode_once(connections, stream):
+    message = Message(stream)
+    for ws in connections:
+        message.frame
+
+
+def compress_once(connections, stream):
+    message = Message(stream)
+    for ws in connections:
+        message.compressed_frame()
+
+
+def measure(func, connections, stream, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        func(connections, stream)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    stream = ('<turbo-stream action="replace" target="load"><template>' +
+              'x' * size + '</template></turbo-stream>')
+    print(f'payload: {len(stream)} bytes')
+    print(f'{"clients":>8} {"per-client (ms)":>16} {"encode-once (ms)":>17} '
+          f'{"deflate per-client (ms)":>24} {"deflate once (ms)":>18}')
+    for count in CLIENT_COUNTS:
+        connections = [open_connection() for _ in range(count)]
+        a = measure(per_client, connections, stream) * 1000
+        b = measure(encode_once, connections, stream) * 1000
+        connections = [open_connection(deflate=True) for _ in range(count)]
+        c = measure(per_client, connections, stream, repeat=1) * 1000
+        d = measure(compress_once, connections, stream) * 1000
+        print(f'{count:>8} {a:>16.3f} {b:>17.3f} {c:>24.3f} {d:>18.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""Measure the CPU cost of generating a response with many turbo streams.
+
+The benchmark compares calling the ``Turbo.replace()`` method once per stream
+and joining the results, as done by applications that pass a list of streams
+to ``Turbo.stream()``, with adding the streams to a ``StreamBuilder`` object.
+Both variants end with the encoded bytes of the response body.
+
+Usage: python benchmarks/stream_builder.py [content_size]
+"""
+import sys
+import time
+
+from turbo_flask import StreamBuilder, Turbo
+
+STREAM_COUNTS = [1, 10, 100, 1000]
+
+
+def turbo_methods(turbo, content, count):
+    streams = [turbo.replace(content, f'todo-{i}') for i in range(count)]
+    return ''.join(streams).encode()
+
+
+def stream_builder(turbo, content, count):
+    builder = StreamBuilder()
+    for i in range(count):
+        builder.replace(content, f'todo-{i}')
+    return bytes(builder)
+
+
+def measure(func, turbo, content, count, repeat=5):
+    number = max(1, 10000 // count)
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        for _ in range(number):
+            func(turbo, content, count)
+        elapsed = (time.process_time() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    content = '<li>' + 'x' * size + '</li>'
+    turbo = Turbo()
+    print(f'content: {len(content)} bytes')
+    print(f'{"streams":>8} {"turbo methods (us)":>19} '
+          f'{"stream builder (us)":>20}')
+    for count in STREAM_COUNTS:
+        a = measure(turbo_methods, turbo, content, count) * 1e6
+        b = measure(stream_builder, turbo, content, count) * 1e6
+        print(f'{count:>8} {a:>19.1f} {b:>20.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""Benchmark the WebSocket server, the push path and the stream builders.
+
+The suite starts a Flask application with Turbo-Flask in a separate process,
+connects a number of WebSocket clients to it, and measures:
+
+- the rate at which clients can connect
+- the memory used by the server for each connection
+- the latency from the start of a broadcast push until each client receives
+  the update, as percentiles
+- the throughput of broadcast pushes, in messages and bytes per second
+- the CPU time used by the server for each delivered message
+
+The clients do not offer the permessage-deflate extension, so updates are
+sent uncompressed. Browsers always offer it, and then updates larger than
+``TURBO_COMPRESSION_MIN_SIZE`` are compressed once per push, which adds to
+the CPU time of each push but not of each delivered message.
+
+It also runs micro-benchmarks of the stream helpers, ``turbo.stream()`` and
+the ``StreamBuilder`` class.
+
+The results are written as JSON. When a baseline file from a previous run is
+given, the results are compared against it, and the script exits with an
+error status if any result is worse than the baseline by more than the given
+tolerance.
+
+Usage: python benchmarks/suite.py [--clients N] [--pushes N] [--size BYTES]
+                                  [--queue-size N] [--output FILE]
+                                  [--baseline FILE] [--tolerance FRACTION]
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import re
+import socket
+import sys
+import threading
+import time
+import timeit
+from urllib.request import urlopen
+
+from flask import Flask, request
+import simple_websocket
+from werkzeug.serving import make_server
+
+from turbo_flask import Turbo
+
+_TIMESTAMP_RE = re.compile(r'data-t="([0-9.]+)"')
+
+
+def create_app(queue_size=0):
+    app = Flask(__name__)
+    app.config['TURBO_PUSH_QUEUE_SIZE'] = queue_size
+    turbo = Turbo(app)
+
+    @app.route('/bench/stats')
+    def stats():
+        return {'rss': rss(), 'cpu': time.process_time(),
+                'connections': len(turbo.clients.connections())}
+
+    @app.route('/bench/push', methods=['POST'])
+    def push():
+        size = int(request.args.get('size', 0))
+        turbo.push(turbo.replace(
+            f'<div data-t="{time.time()!r}">{"x" * size}</div>', 'bench'))
+        return '', 204
+
+    return app
+
+
+def rss():
+    """Return the resident memory of the current process in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:  # pragma: no cover
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+
+def serve(port, queue_size):
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    make_server('127.0.0.1', port, create_app(queue_size),
+                threaded=True).serve_forever()
+
+
+def get_stats(base_url):
+    with urlopen(f'{base_url}/bench/stats') as response:
+        return json.loads(response.read())
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class BenchClient:
+    def __init__(self, url):
+        self.ws = simple_websocket.Client.connect(url)
+        self.latencies = []
+        self.bytes_received = 0
+        self.thread = None
+
+    def receive(self, count, timeout):
+        def run():
+            for _ in range(count):
+                data = self.ws.receive(timeout=timeout)
+                if data is None:
+                    break
+                received = time.time()
+                self.bytes_received += len(data.encode())
+                match = _TIMESTAMP_RE.search(data)
+                if match:
+                    self.latencies.append(received - float(match.group(1)))
+
+        self.thread = threading.Thread(target=run)
+        self.thread.start()
+
+    def join(self):
+        self.thread.join()
+
+    def close(self):
+        self.ws.close()
+
+
+def load_benchmark(clients, pushes, size, queue_size):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    base_url = f'http://127.0.0.1:{port}'
+    server = multiprocessing.Process(target=serve, args=(port, queue_size))
+    server.daemon = True
+    server.start()
+    try:
+        for _ in range(100):
+            try:
+                before = get_stats(base_url)
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError('The benchmark server did not start')
+
+        start = time.perf_counter()
+        connections = [BenchClient(f'ws://127.0.0.1:{port}/turbo-stream')
+                       for _ in range(clients)]
+        connect_time = time.perf_counter() - start
+        while get_stats(base_url)['connections'] < clients:
+            time.sleep(0.01)
+        connected = get_stats(base_url)
+
+        for client in connections:
+            client.receive(pushes, timeout=30)
+        start = time.perf_counter()
+        for _ in range(pushes):
+            with urlopen(f'{base_url}/bench/push?size={size}', data=b''):
+                pass
+        for client in connections:
+            client.join()
+        push_time = time.perf_counter() - start
+        after = get_stats(base_url)
+        for client in connections:
+            client.close()
+    finally:
+        server.terminate()
+        server.join()
+
+    latencies = [latency for client in connections
+                 for latency in client.latencies]
+    messages = len(latencies)
+    results = {
+        'connect_rate': (clients / connect_time, 'connections/s', 'higher'),
+        'messages_lost': (clients * pushes - messages, 'messages', 'lower'),
+        'push_throughput': (messages / push_time, 'messages/s', 'higher'),
+        'push_bytes_throughput': (
+            sum(client.bytes_received for client in connections) /
+            push_time, 'bytes/s', 'higher'),
+        'server_cpu_per_message': (
+            (after['cpu'] - connected['cpu']) / max(messages, 1) * 1e6,
+            'us', 'lower'),
+    }
+    if before['rss'] is not None:
+        results['server_memory_per_connection'] = (
+            (connected['rss'] - before['rss']) / clients, 'bytes', 'lower')
+    for name, fraction in [('p50', 0.5), ('p90', 0.9), ('p99', 0.99),
+                           ('max', 1)]:
+        value = percentile(latencies, fraction)
+        if value is not None:
+            results[f'push_latency_{name}'] = (value * 1000, 'ms', 'lower')
+    return results
+
+
+def micro_benchmarks():
+    app = Flask(__name__)
+    turbo = Turbo(app)
+    content = '<li class="todo">' + 'x' * 200 + '</li>'
+    streams = [turbo.replace(content, f'todo-{i}') for i in range(100)]
+
+    def stream_helpers():
+        for i in range(100):
+            turbo.replace(content, f'todo-{i}')
+
+    def stream_builder():
+        builder = turbo.builder()
+        for i in range(100):
+            builder.replace(content, f'todo-{i}')
+        bytes(builder)
+
+    def stream_response():
+        turbo.stream(streams).get_data()
+
+    results = {}
+    with app.test_request_context('/'):
+        for name, func in [('make_stream_x100', stream_helpers),
+                           ('stream_builder_x100', stream_builder),
+                           ('stream_response_x100', stream_response)]:
+            timer = timeit.Timer(func)
+            number, _ = timer.autorange()
+            best = min(timer.repeat(repeat=5, number=number)) / number
+            results[name] = (best * 1e6, 'us', 'lower')
+    return results
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]['value']
+        new = result['value']
+        if not old:
+            # there is no relative change from zero, so any change in the
+            # wrong direction is a regression, such as messages being lost
+            if (new < old if result['better'] == 'higher' else new > old):
+                regressions.append(f'{name}: {old:.3f} -> {new:.3f} '
+                                   f'{result["unit"]} (was zero)')
+            continue
+        change = (new - old) / abs(old)
+        if result['better'] == 'higher':
+            change = -change
+        if change > tolerance:
+            regressions.append(f'{name}: {old:.3f} -> {new:.3f} '
+                               f'{result["unit"]} ({change:.0%} worse)')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--pushes', type=int, default=100)
+    parser.add_argument('--size', type=int, default=1000)
+    parser.add_argument('--queue-size', type=int, default=0)
+    parser.add_argument('--output', help='file to write the results to')
+    parser.add_argument('--baseline', help='results of a previous run')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = load_benchmark(args.clients, args.pushes, args.size,
+                             args.queue_size)
+    results.update(micro_benchmarks())
+    output = {
+        'parameters': {'clients': args.clients, 'pushes': args.pushes,
+                       'size': args.size, 'queue_size': args.queue_size,
+                       'python': sys.version.split()[0]},
+        'results': {name: {'value': value, 'unit': unit, 'better': better}
+                    for name, (value, unit, better) in results.items()},
+    }
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(output['results'], baseline, args.tolerance)
+        for regression in regressions:
+            print(f'regression: {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
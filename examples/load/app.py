@@ -1,8 +1,6 @@
 import random
 import re
 import sys
-import threading
-import time
 from flask import Flask, render_template
 from turbo_flask import Turbo
 
@@ -30,13 +28,6 @@ def page2():
     return render_template('page2.html')
 
 
+@turbo.every(5, dedup=True)
 def update_load():
-    with app.app_context():
-        while True:
-            time.sleep(5)
-            turbo.push(turbo.replace(render_template('loadavg.html'), 'load'))
-
-
-th = threading.Thread(target=update_load)
-th.daemon = True
-th.start()
+    return turbo.replace(render_template('loadavg.html'), 'load')
@@ -1 +1,5 @@
 from turbo_flask.turbo import Turbo  # noqa: F401
+from turbo_flask.broker import (  # noqa: F401
+    Broker, LocalBroker, UnixSocketBroker)
+from turbo_flask.builder import StreamBuilder  # noqa: F401
+from turbo_flask.aio import AsyncTurbo  # noqa: F401
@@ -0,0 +1,251 @@
+import asyncio
+import io
+import sys
+from flask import request
+from .connection import Connection, Message
+from .report import DeliveryReport
+from .turbo import Turbo
+
+
+class AsyncConnection(Connection):
+    """A client connection served by an asyncio WebSocket endpoint.
+
+    Updates are added to a bounded queue, which is drained by a task running
+    in the event loop. The ``send()`` method can be called from the event
+    loop or from any other thread.
+
+    :param send: the ASGI ``send`` function of the connection.
+    :param loop: the event loop that runs the connection.
+    :param queue_size: the maximum number of pending updates.
+    :param overflow: the policy to apply when the queue is full.
+    :param on_drop: a function that is invoked with the policy and the number
+                    of updates discarded each time the overflow policy is
+                    applied.
+    :param user_id: the id of the user that owns the connection.
+    :param dedup_size: the maximum number of targets for which the hash of
+                       the last update is remembered.
+    """
+    pingable = False
+
+    def __init__(self, send, loop, queue_size=100, overflow='drop_oldest',
+                 on_drop=None, user_id=None, dedup_size=256):
+        super().__init__(None, queue_size=queue_size or 100,
+                         overflow=overflow, on_drop=on_drop, user_id=user_id,
+                         dedup_size=dedup_size)
+        self.asgi_send = send
+        self.loop = loop
+        self.ready = asyncio.Event()
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    def send(self, data, timeout=None):
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            self._send(data)
+        else:
+            self.loop.call_soon_threadsafe(self._send, data)
+        return 'queued'
+
+    def _send(self, data):
+        dropped = self._enqueue(data)
+        if self.queue:
+            self.idle.clear()
+        self.ready.set()
+        self._report_dropped(dropped)
+
+    def close(self):
+        super().close()
+        self.ready.set()
+
+    def replay(self, messages):
+        super().replay(messages)
+        self.idle.clear()
+        self.ready.set()
+
+    def evict(self, code=1001):
+        self.close_code = code
+        if self.loop.is_closed():  # pragma: no cover
+            return
+        self.loop.call_soon_threadsafe(self.close)
+
+    async def run(self):
+        """Write pending updates to the WebSocket until the connection is
+        closed, or until an update cannot be written."""
+        try:
+            while not self.closed:
+                await self.ready.wait()
+                self.ready.clear()
+                while self.queue and not self.closed:
+                    data = self.queue.popleft()
+                    if isinstance(data, Message):
+                        data = data.tagged
+                    await self.asgi_send({'type': 'websocket.send',
+                                          'text': str(data)})
+                self.idle.set()
+            if self.close_code:
+                await self.asgi_send({'type': 'websocket.close',
+                                      'code': self.close_code})
+        except Exception:
+            # the client went away
+            self.close()
+        finally:
+            # pushes that are waiting for this connection must not hang
+            self.idle.set()
+
+    async def join(self):
+        """Wait until all the pending updates are written."""
+        await self.idle.wait()
+
+
+class AsyncTurbo(Turbo):
+    """Create the Turbo-Flask extension for asyncio deployments.
+
+    This class works like :class:`Turbo`, but implements the WebSocket
+    endpoint with coroutines, so that idle connections do not each need a
+    thread. The application must be served by an ASGI web server, using the
+    application returned by the :func:`asgi` method.
+
+    :param app: the Flask application instance. If not provided, it must be
+                initialized later by calling the :func:`AsyncTurbo.init_app`
+                method.
+    :param broker: the broker used to distribute pushed updates to all the
+                   server processes.
+    """
+    def _init_websocket(self, app, ws_route):
+        pass
+
+    def asgi(self, app, http_app=None):
+        """Return an ASGI application that serves the WebSocket endpoint.
+
+        :param app: the Flask application instance.
+        :param http_app: the ASGI application that handles all other
+                         requests. If not given, the Flask application is
+                         wrapped with the ``WsgiToAsgi`` adapter from the
+                         ``asgiref`` package.
+
+        Example::
+
+            app = Flask(__name__)
+            turbo = AsyncTurbo(app)
+            asgi_app = turbo.asgi(app)
+
+            # run with: uvicorn module:asgi_app
+        """
+        if http_app is None:
+            try:
+                from asgiref.wsgi import WsgiToAsgi
+            except ImportError:  # pragma: no cover
+                raise RuntimeError('The asgiref package is required to serve '
+                                   'the Flask application under ASGI')
+            http_app = WsgiToAsgi(app)
+        ws_route = app.config['TURBO_WEBSOCKET_ROUTE']
+
+        async def asgi_app(scope, receive, send):
+            if scope['type'] == 'websocket' and ws_route and \
+                    scope['path'] == ws_route:
+                await self._websocket(app, scope, receive, send)
+            else:
+                await http_app(scope, receive, send)
+
+        return asgi_app
+
+    async def _websocket(self, app, scope, receive, send):
+        message = await receive()
+        if message['type'] != 'websocket.connect':  # pragma: no cover
+            return
+        with app.request_context(self._environ(scope)):
+            user_id = self.user_id_callback()
+            conn = AsyncConnection(
+                send, asyncio.get_running_loop(),
+                queue_size=app.config['TURBO_PUSH_QUEUE_SIZE'],
+                overflow=app.config['TURBO_PUSH_QUEUE_OVERFLOW'],
+                on_drop=self._count_dropped, user_id=user_id,
+                dedup_size=self.dedup_size)
+            close_code = self._admit(user_id)
+            if close_code:
+                await send({'type': 'websocket.close', 'code': close_code})
+                return
+            try:
+                # updates pushed before the connection is accepted wait in
+                # its queue
+                self._register(user_id, conn, request.args.getlist('channel'),
+                               reserved=True)
+                await send({'type': 'websocket.accept'})
+                last_event_id = request.args.get('last_event_id')
+                if last_event_id and self.replay is not None:
+                    self._resume(conn, last_event_id)
+            except BaseException:
+                conn.close()
+                self._unregister(user_id, conn)
+                raise
+        writer = asyncio.ensure_future(conn.run())
+        # a connection that cannot be written to is removed right away,
+        # without waiting for the client to disconnect
+        writer.add_done_callback(lambda task: self._unregister(user_id, conn))
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                conn.touch()
+        finally:
+            conn.close()
+            self._unregister(user_id, conn)
+            await asyncio.gather(writer, return_exceptions=True)
+
+    @staticmethod
+    def _environ(scope):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'SCRIPT_NAME': scope.get('root_path', ''),
+            'PATH_INFO': scope['path'],
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': client[0],
+            'wsgi.url_scheme': 'https' if scope.get('scheme') == 'wss'
+            else 'http',
+            'wsgi.input': io.BytesIO(),
+            'wsgi.errors': sys.stderr,
+        }
+        for name, value in scope.get('headers', []):
+            key = 'HTTP_' + name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if key in environ:
+                separator = '; ' if key == 'HTTP_COOKIE' else ','
+                value = environ[key] + separator + value
+            environ[key] = value
+        return environ
+
+    def push_nowait(self, stream, to=None, channel=None, coalesce=True,
+                    dedup=False, timeout=None, report=False):
+        """Push a turbo stream update to one or more clients without waiting.
+
+        This method takes the same arguments as :func:`Turbo.push`, and can
+        be called from the event loop or from any thread.
+        """
+        return super().push(stream, to, channel, coalesce=coalesce,
+                            dedup=dedup, timeout=timeout, report=report)
+
+    async def push(self, stream, to=None, channel=None, coalesce=True,
+                   dedup=False, timeout=None, report=False):
+        """Push a turbo stream update to one or more clients.
+
+        This method takes the same arguments as :func:`Turbo.push`. The
+        coroutine completes when the update has been written to all the
+        targeted connections of the current process.
+        """
+        delivery_report = DeliveryReport() if report else None
+        to, channel = self._publish(stream, to, channel, coalesce=coalesce,
+                                    dedup=dedup, timeout=timeout,
+                                    report=delivery_report)
+        await asyncio.gather(*[
+            conn.join() for conn in self._connections(to, channel)
+            if isinstance(conn, AsyncConnection)])
+        return delivery_report
@@ -0,0 +1,73 @@
+import gzip
+import hashlib
+import os
+
+from flask import current_app, request
+
+#: The ``Cache-Control`` header for content-hashed URLs, which never change.
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class ScriptAsset:
+    """A JavaScript file served by the application.
+
+    The file is read once, and is served with a content-hashed name, so that
+    browsers can cache it forever. Precompressed ``.gz`` and ``.br`` files
+    stored next to the file are served to clients that accept them. If there
+    is no ``.gz`` file, a gzip variant is generated when the file is loaded.
+
+    :param path: the path of the JavaScript file.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = f.read()
+        self.etag = hashlib.sha256(self.data).hexdigest()[:16]
+        name, ext = os.path.splitext(os.path.basename(path))
+        self.name = name + ext
+        self.hashed_name = f'{name}.{self.etag}{ext}'
+        self.variants = {'br': self._read(path + '.br'),
+                         'gzip': self._read(path + '.gz')}
+        if self.variants['gzip'] is None:
+            self.variants['gzip'] = gzip.compress(self.data, 9, mtime=0)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def response(self, filename):
+        """Return the response for a request of the file.
+
+        :param filename: the requested file name, which can be the
+                         content-hashed name or the original name of the
+                         file. Requests for the original name must be
+                         revalidated by the browser on each use.
+        """
+        if filename == self.hashed_name:
+            cache_control = IMMUTABLE
+        elif filename == self.name:
+            cache_control = 'no-cache'
+        else:
+            return None
+        headers = {'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+        data = self.data
+        etag = self.etag
+        for encoding in ('br', 'gzip'):
+            if self.variants[encoding] is not None and \
+                    request.accept_encodings[encoding]:
+                data = self.variants[encoding]
+                headers['Content-Encoding'] = encoding
+                # each encoding is a different representation of the file,
+                # so it needs its own entity tag
+                etag = f'{self.etag}-{encoding}'
+                break
+        headers['ETag'] = f'"{etag}"'
+        # proxies can make entity tags weak, so they are compared weakly
+        if request.if_none_match.contains_weak(etag):
+            return current_app.response_class(status=304, headers=headers)
+        return current_app.response_class(
+            data, mimetype='text/javascript', headers=headers)
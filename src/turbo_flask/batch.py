@@ -0,0 +1,81 @@
+def stream_size(stream):
+    """Return the size of a stream in bytes, once encoded to UTF-8."""
+    return len(stream) if stream.isascii() else len(stream.encode())
+
+
+def chunk_streams(streams, max_size=0):
+    """Combine a list of streams into as few messages as possible, without
+    exceeding a size budget.
+
+    :param streams: a list of turbo streams.
+    :param max_size: the maximum size of each message in bytes, or 0 for no
+                     limit. A stream that is larger than this size is
+                     returned in a message of its own.
+
+    Returns a list of strings, each to be sent as a WebSocket message.
+    """
+    if not max_size:
+        return [''.join(streams)] if streams else []
+    chunks = []
+    chunk = []
+    chunk_size = 0
+    for stream in streams:
+        size = stream_size(stream)
+        if chunk and chunk_size + size > max_size:
+            chunks.append(''.join(chunk))
+            chunk = []
+            chunk_size = 0
+        chunk.append(stream)
+        chunk_size += size
+    if chunk:
+        chunks.append(''.join(chunk))
+    return chunks
+
+
+class Batch:
+    """Collect turbo streams to push them together.
+
+    Instances of this class are created with the :func:`Turbo.batch` method.
+    Streams added to the batch are pushed when the :func:`flush` method is
+    called, when the ``with`` block in which the batch is used ends, or when
+    the request in which the batch was created ends.
+
+    :param turbo: the :class:`Turbo` instance.
+    :param to: the recipients of the streams, as accepted by
+               :func:`Turbo.push`.
+    :param channel: the channel or channels for the streams, as accepted by
+                    :func:`Turbo.push`.
+    """
+    def __init__(self, turbo, to=None, channel=None):
+        self.turbo = turbo
+        self.to = to
+        self.channel = channel
+        self.streams = []
+
+    def add(self, stream):
+        """Add one or a list of streams to the batch.
+
+        :param stream: one or a list of streams generated by the
+                       ``append()``, ``prepend()``, ``replace()``,
+                       ``update()`` and ``remove()`` methods.
+        """
+        if isinstance(stream, str):
+            self.streams.append(stream)
+        else:
+            self.streams.extend(stream)
+
+    def flush(self):
+        """Push the streams collected in the batch."""
+        streams = self.streams
+        self.streams = []
+        if streams:
+            self.turbo._publish(streams, self.to, self.channel)
+
+    def __len__(self):
+        return len(self.streams)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
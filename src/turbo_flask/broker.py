@@ -0,0 +1,263 @@
+import errno
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+_MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+
+
+class Broker:
+    """Base class for the message brokers that distribute pushed updates.
+
+    A broker receives the updates given to ``Turbo.push()`` and delivers them
+    to all the processes that have WebSocket clients. Each process subscribes
+    once, and then delivers the updates it receives to its own clients.
+    """
+    def __init__(self):
+        self.callback = None
+
+    def subscribe(self, callback):
+        """Register the function that delivers updates to local clients.
+
+        :param callback: a function that takes the stream, the list of
+                         recipients and the list of channels, plus the
+                         delivery options of the update as keyword arguments.
+                         Both lists are ``None`` when the update is for all
+                         clients.
+        """
+        self.callback = callback
+
+    def publish(self, stream, to=None, channel=None,
+                **options):  # pragma: no cover
+        """Publish an update to all the subscribed processes.
+
+        :param stream: the turbo stream update, as a string.
+        :param to: a list of recipient ids, or ``None``.
+        :param channel: a list of channel names, or ``None``.
+        :param options: delivery options, which must be given to the
+                        subscribed callback along with the update.
+
+        When ``to`` and ``channel`` are both ``None`` the update is sent to
+        all clients.
+        """
+        raise NotImplementedError()
+
+    def connected(self, user_id):
+        """Notify the broker that a user has local clients."""
+        pass
+
+    def disconnected(self, user_id):
+        """Notify the broker that a user does not have local clients."""
+        pass
+
+    def subscribed(self, channel):
+        """Notify the broker that a channel has local subscribers."""
+        pass
+
+    def unsubscribed(self, channel):
+        """Notify the broker that a channel does not have local
+        subscribers."""
+        pass
+
+    def can_push(self, to=None, channel=None):
+        """Returns ``True`` if a remote process has clients for the given
+        user or channel, or for any user if both are ``None``."""
+        return False
+
+    def close(self):
+        """Release the resources used by the broker."""
+        pass
+
+
+class LocalBroker(Broker):
+    """A broker that delivers updates only within the current process.
+
+    This is the default broker, appropriate when the application runs in a
+    single process.
+    """
+    def publish(self, stream, to=None, channel=None, **options):
+        self.callback(stream, to, channel, **options)
+
+
+class UnixSocketBroker(Broker):
+    """A broker that distributes updates among processes on the same host
+    through Unix datagram sockets.
+
+    Each process binds a socket in the given directory, and published
+    updates are sent to all the sockets found in it. This allows updates to
+    reach clients connected to any of the worker processes of a server such
+    as Gunicorn.
+
+    :param path: the directory in which the sockets are created. All the
+                 processes of the application must use the same directory.
+
+    User ids must be serializable to JSON. The size of each update is limited
+    by the maximum datagram size allowed by the operating system. Updates
+    that are too large, or that are sent to a process that is not keeping up
+    with its socket, are only delivered to the clients of the current process
+    and the error is logged.
+    """
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.pid = None
+        self.sock = None
+        self.name = None
+        self.local_presence = set()
+        self.remote_presence = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, callback):
+        super().subscribe(callback)
+        self._start()
+
+    def publish(self, stream, to=None, channel=None, **options):
+        self._start()
+        try:
+            self.callback(stream, to, channel, **options)
+        finally:
+            self._broadcast({'type': 'push', 'stream': stream, 'to': to,
+                             'channel': channel, 'options': options})
+
+    def connected(self, user_id):
+        self._add_presence(('user', user_id))
+
+    def disconnected(self, user_id):
+        self._remove_presence(('user', user_id))
+
+    def subscribed(self, channel):
+        self._add_presence(('channel', channel))
+
+    def unsubscribed(self, channel):
+        self._remove_presence(('channel', channel))
+
+    def can_push(self, to=None, channel=None):
+        if channel is not None:
+            key = ('channel', channel)
+        elif to is not None:
+            key = ('user', to)
+        else:
+            key = None
+        with self.lock:
+            if key is None:
+                return any(key[0] == 'user'
+                           for keys in self.remote_presence.values()
+                           for key in keys)
+            return any(key in keys for keys in self.remote_presence.values())
+
+    def close(self):
+        if self.sock is not None and self.pid == os.getpid():
+            self._broadcast({'type': 'bye'})
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:  # pragma: no cover
+                pass
+            self.sock.close()
+            try:
+                os.unlink(os.path.join(self.path, self.name))
+            except FileNotFoundError:  # pragma: no cover
+                pass
+        self.sock = None
+
+    def _start(self):
+        # the socket is (re)created in each process, so that a broker that is
+        # created before the server forks its workers works as expected
+        if self.pid == os.getpid():
+            return
+        os.makedirs(self.path, exist_ok=True)
+        self.pid = os.getpid()
+        self.name = f'{self.pid}-{uuid.uuid4().hex[:8]}.sock'
+        self.local_presence = set()
+        self.remote_presence = {}
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(os.path.join(self.path, self.name))
+        thread = threading.Thread(target=self._listen, args=(self.sock,))
+        thread.daemon = True
+        thread.start()
+        self._broadcast({'type': 'hello'})
+
+    def _add_presence(self, key):
+        self._start()
+        with self.lock:
+            self.local_presence.add(key)
+        self._broadcast({'type': 'presence', 'add': [key]})
+
+    def _remove_presence(self, key):
+        self._start()
+        with self.lock:
+            self.local_presence.discard(key)
+        self._broadcast({'type': 'presence', 'remove': [key]})
+
+    def _peers(self):
+        return [name for name in os.listdir(self.path)
+                if name.endswith('.sock') and name != self.name]
+
+    def _send(self, peer, message):
+        try:
+            self.sock.sendto(message, _MSG_DONTWAIT,
+                             os.path.join(self.path, peer))
+        except BlockingIOError:
+            # the socket of the peer is full, so the message is dropped
+            # instead of blocking the caller
+            logger.warning('Dropped a message to %s, its socket is full',
+                           peer)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # the process that owned this socket is gone
+            with self.lock:
+                self.remote_presence.pop(peer, None)
+            try:
+                os.unlink(os.path.join(self.path, peer))
+            except FileNotFoundError:  # pragma: no cover
+                pass
+
+    def _broadcast(self, message):
+        message['from'] = self.name
+        data = json.dumps(message).encode()
+        try:
+            for peer in self._peers():
+                self._send(peer, data)
+        except OSError as exc:
+            if exc.errno != errno.EMSGSIZE:
+                raise
+            logger.error('Cannot send a message of %d bytes to other '
+                         'processes', len(data))
+
+    def _listen(self, sock):
+        while True:
+            try:
+                data = sock.recv(1 << 20)
+            except OSError:  # pragma: no cover
+                break
+            if not data:
+                break
+            try:
+                self._handle(json.loads(data))
+            except Exception:
+                # a bad message or a failed delivery must not stop the
+                # listener
+                logger.exception('Error handling a broker message')
+
+    def _handle(self, message):
+        peer = message['from']
+        if message['type'] == 'push':
+            self.callback(message['stream'], message['to'],
+                          message['channel'], **message.get('options', {}))
+        elif message['type'] == 'hello':
+            with self.lock:
+                keys = list(self.local_presence)
+            self._send(peer, json.dumps({
+                'type': 'presence', 'from': self.name,
+                'add': keys}).encode())
+        elif message['type'] == 'bye':
+            with self.lock:
+                self.remote_presence.pop(peer, None)
+        elif message['type'] == 'presence':
+            with self.lock:
+                keys = self.remote_presence.setdefault(peer, set())
+                keys.update(tuple(key) for key in message.get('add', []))
+                keys.difference_update(
+                    tuple(key) for key in message.get('remove', []))
@@ -0,0 +1,185 @@
+from markupsafe import Markup
+
+_SPECIAL_CHARS = frozenset('&<>"\'')
+
+
+def escape_attribute(value):
+    """Escape a value for use in a double-quoted HTML attribute.
+
+    :param value: the value to escape. Values marked as safe with
+                  ``Markup`` are returned unchanged.
+    """
+    if isinstance(value, Markup):
+        return str(value)
+    value = str(value)
+    if _SPECIAL_CHARS.isdisjoint(value):
+        return value
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace(
+        '>', '&gt;').replace('"', '&#34;').replace("'", '&#39;')
+
+
+def make_stream(action, content=None, target=None, multiple=False,
+                **attributes):
+    """Return a turbo stream with the given action.
+
+    :param action: the stream action.
+    :param content: the HTML content of the stream, or ``None`` to generate a
+                    stream without a ``<template>`` element.
+    :param target: the target ID or CSS query selector for this change, or
+                   ``None`` for actions that do not have a target.
+    :param multiple: set to ``True`` when ``target`` references multiple
+                     elements.
+    :param attributes: additional attributes for the ``<turbo-stream>``
+                       element. Underscores in names are replaced with
+                       dashes, and attributes set to ``None`` are omitted.
+    """
+    html = f'<turbo-stream action="{escape_attribute(action)}"'
+    if target is not None:
+        html += (f' {"targets" if multiple else "target"}='
+                 f'"{escape_attribute(target)}"')
+    for name, value in attributes.items():
+        if value is not None:
+            html += f' {name.replace("_", "-")}="{escape_attribute(value)}"'
+    if content is None:
+        return html + '></turbo-stream>'
+    return f'{html}><template>{content}</template></turbo-stream>'
+
+
+def _make_target_stream(action, content, target, multiple, method=None):
+    # fast path for the standard actions, which always have a target
+    method = f' method="{escape_attribute(method)}"' if method else ''
+    return (f'<turbo-stream action="{action}" '
+            f'{"targets" if multiple else "target"}='
+            f'"{escape_attribute(target)}"{method}>'
+            f'<template>{content}</template></turbo-stream>')
+
+
+class StreamBuilder:
+    """Build a sequence of turbo streams.
+
+    Instances of this class are created with the :func:`Turbo.builder`
+    method. Each method adds a stream to the builder and returns the builder,
+    so that calls can be chained. The streams are joined and encoded only
+    once, when the builder is converted to a string or to bytes.
+
+    A builder can be given to :func:`Turbo.stream`, :func:`Turbo.push` and
+    ``Batch.add()`` in place of a list of streams.
+
+    Example::
+
+        streams = turbo.builder()
+        for todo in todos:
+            streams.replace(render_template('_todo.html', todo=todo),
+                            f'todo-{todo.id}')
+        return turbo.stream(streams)
+    """
+    def __init__(self):
+        self.streams = []
+        self._text = None
+        self._data = None
+
+    def action(self, action, content=None, target=None, multiple=False,
+               **attributes):
+        """Add a stream with a custom action.
+
+        The arguments are the same as in :func:`make_stream`.
+        """
+        self.streams.append(make_stream(action, content, target, multiple,
+                                        **attributes))
+        self._text = self._data = None
+        return self
+
+    def append(self, content, target, multiple=False):
+        """Add an append stream.
+
+        :param content: the HTML content to include in the stream.
+        :param target: the target ID or CSS query selector for this change.
+        :param multiple: set to ``True`` when ``target`` references multiple
+                         elements.
+        """
+        return self._add('append', content, target, multiple)
+
+    def prepend(self, content, target, multiple=False):
+        """Add a prepend stream.
+
+        The arguments are the same as in :func:`append`.
+        """
+        return self._add('prepend', content, target, multiple)
+
+    def replace(self, content, target, multiple=False, method=None):
+        """Add a replace stream.
+
+        :param content: the HTML content to include in the stream.
+        :param target: the target ID or CSS query selector for this change.
+        :param multiple: set to ``True`` when ``target`` references multiple
+                         elements.
+        :param method: set to ``'morph'`` to ask turbo.js 8 to morph the
+                       target instead of replacing it.
+        """
+        return self._add('replace', content, target, multiple, method)
+
+    def update(self, content, target, multiple=False, method=None):
+        """Add an update stream.
+
+        The arguments are the same as in :func:`replace`.
+        """
+        return self._add('update', content, target, multiple, method)
+
+    def remove(self, target, multiple=False):
+        """Add a remove stream.
+
+        :param target: the target ID or CSS query selector for this change.
+        :param multiple: set to ``True`` when ``target`` references multiple
+                         elements.
+        """
+        return self._add('remove', '', target, multiple)
+
+    def after(self, content, target, multiple=False):
+        """Add an after stream.
+
+        The arguments are the same as in :func:`append`.
+        """
+        return self._add('after', content, target, multiple)
+
+    def before(self, content, target, multiple=False):
+        """Add a before stream.
+
+        The arguments are the same as in :func:`append`.
+        """
+        return self._add('before', content, target, multiple)
+
+    def refresh(self, request_id=None):
+        """Add a refresh stream, which asks turbo.js 8 to reload the page.
+
+        :param request_id: the id of the request that caused the refresh.
+                           Clients ignore refreshes that carry the id of a
+                           request they made.
+        """
+        return self.action('refresh', request_id=request_id)
+
+    def _add(self, action, content, target, multiple, method=None):
+        self.streams.append(_make_target_stream(action, content, target,
+                                                multiple, method))
+        self._text = self._data = None
+        return self
+
+    def clear(self):
+        """Remove all the streams from the builder."""
+        self.streams = []
+        self._text = self._data = None
+
+    def __str__(self):
+        if self._text is None:
+            self._text = ''.join(self.streams)
+        return self._text
+
+    def __bytes__(self):
+        if self._data is None:
+            self._data = str(self).encode()
+        return self._data
+
+    def __iter__(self):
+        return iter(self.streams)
+
+    def __len__(self):
+        return len(self.streams)
@@ -0,0 +1,125 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class FragmentCache:
+    """A least-recently-used cache of rendered template fragments.
+
+    Each entry is stored under the name of its template and a cache key
+    chosen by the application, and can optionally be labeled with one or
+    more tags, which can be used to invalidate related entries together.
+
+    :param max_size: the maximum number of entries in the cache. When the
+                     cache is full, the least recently used entry is evicted.
+    :param ttl: the time, in seconds, after which an entry expires, or
+                ``None`` to keep entries until they are evicted or
+                invalidated.
+    """
+    def __init__(self, max_size=256, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.index = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, template_name, key):
+        """Return a cached fragment, or ``None`` if it is not in the cache.
+
+        :param template_name: the name of the template.
+        :param key: the cache key of the fragment.
+        """
+        with self.lock:
+            entry = self.entries.get((template_name, key))
+            if entry is not None and self.ttl is not None and \
+                    time.monotonic() > entry[1]:
+                self._remove((template_name, key))
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end((template_name, key))
+            self.hits += 1
+            return entry[0]
+
+    def set(self, template_name, key, fragment, tags=None):
+        """Store a fragment in the cache.
+
+        :param template_name: the name of the template.
+        :param key: the cache key of the fragment.
+        :param fragment: the rendered fragment.
+        :param tags: a tag or list of tags for the fragment.
+        """
+        if isinstance(tags, str):
+            tags = [tags]
+        entry_key = (template_name, key)
+        expires = time.monotonic() + self.ttl if self.ttl is not None \
+            else None
+        with self.lock:
+            if entry_key in self.entries:
+                self._remove(entry_key)
+            self.entries[entry_key] = (fragment, expires, tuple(tags or ()))
+            for label in [('key', key)] + [('tag', tag) for tag in tags or ()]:
+                self.index.setdefault(label, set()).add(entry_key)
+            while len(self.entries) > self.max_size:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def render(self, template_name, key, render, tags=None):
+        """Return a fragment from the cache, rendering and storing it if
+        necessary.
+
+        :param template_name: the name of the template.
+        :param key: the cache key of the fragment.
+        :param render: a function that renders the fragment.
+        :param tags: a tag or list of tags for the fragment.
+        """
+        fragment = self.get(template_name, key)
+        if fragment is None:
+            fragment = render()
+            self.set(template_name, key, fragment, tags=tags)
+        return fragment
+
+    def invalidate(self, key=None, tag=None):
+        """Remove fragments from the cache.
+
+        :param key: remove the fragments stored with this cache key.
+        :param tag: remove the fragments labeled with this tag.
+
+        Returns the number of fragments that were removed.
+        """
+        with self.lock:
+            entry_keys = set()
+            if key is not None:
+                entry_keys |= self.index.get(('key', key), set())
+            if tag is not None:
+                entry_keys |= self.index.get(('tag', tag), set())
+            for entry_key in entry_keys:
+                self._remove(entry_key)
+            return len(entry_keys)
+
+    def clear(self):
+        """Remove all the fragments from the cache."""
+        with self.lock:
+            self.entries.clear()
+            self.index.clear()
+
+    def stats(self):
+        """Return a dictionary with the number of hits, misses and evictions,
+        and the current size of the cache."""
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'size': len(self.entries)}
+
+    def _remove(self, entry_key):
+        _, _, tags = self.entries.pop(entry_key)
+        labels = [('key', entry_key[1])] + [('tag', tag) for tag in tags]
+        for label in labels:
+            entry_keys = self.index.get(label)
+            if entry_keys is not None:
+                entry_keys.discard(entry_key)
+                if not entry_keys:
+                    del self.index[label]
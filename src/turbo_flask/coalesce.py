@@ -0,0 +1,91 @@
+import re
+import threading
+
+_STREAM_RE = re.compile(r'<turbo-stream\s+action="([^"]*)"\s+'
+                        r'(targets?)="([^"]*)"')
+
+#: Actions for which only the last stream sent to a target matters.
+COALESCED_ACTIONS = ('replace', 'update')
+
+#: Actions that leave the target in the same state when repeated.
+IDEMPOTENT_ACTIONS = ('replace', 'update', 'remove')
+
+
+def stream_key(stream):
+    """Return the ``(action, target)`` tuple of a stream that contains a
+    single action, or ``None`` if the stream cannot be identified.
+
+    The target is given as a tuple with the name of the attribute, which is
+    ``'target'`` for an element id or ``'targets'`` for a CSS selector, and
+    its value, so that an id and a selector with the same text are
+    different targets.
+
+    :param stream: a turbo stream, as a string.
+    """
+    match = _STREAM_RE.match(stream)
+    if match is None or stream.count('<turbo-stream', 1) > 0:
+        return None
+    return match.group(1), (match.group(2), match.group(3))
+
+
+class Coalescer:
+    """Collect pushed updates during a time window and send them together.
+
+    Updates are grouped by recipients. Within a group, ``replace`` and
+    ``update`` streams for a target replace any previous stream with the same
+    action and target, and all the streams of the group are sent together
+    when the window expires.
+
+    :param window: the duration of the window, in seconds.
+    :param callback: the function that sends the updates, which is invoked
+                     with the list of streams, the list of recipients, the
+                     list of channels and the delivery options given to
+                     :func:`add` as keyword arguments.
+    """
+    def __init__(self, window, callback):
+        self.window = window
+        self.callback = callback
+        self.pending = {}
+        self.timer = None
+        self.lock = threading.Lock()
+
+    def add(self, streams, to=None, channel=None, **options):
+        """Add updates for the given recipients.
+
+        :param streams: a list of turbo streams.
+        :param to: a list of recipient ids, or ``None``.
+        :param channel: a list of channel names, or ``None``.
+        :param options: delivery options for the updates. Updates with
+                        different options are sent separately.
+        """
+        group = (tuple(to) if to is not None else None,
+                 tuple(channel) if channel is not None else None,
+                 tuple(sorted(options.items())))
+        with self.lock:
+            pending = self.pending.setdefault(group, {})
+            for stream in streams:
+                key = stream_key(stream)
+                if key is None or key[0] not in COALESCED_ACTIONS:
+                    key = object()
+                # a repeated key is moved to the end, so that the update is
+                # applied after any other updates received in between
+                pending.pop(key, None)
+                pending[key] = stream
+            if self.timer is None:
+                self.timer = threading.Timer(self.window, self.flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        """Send all the pending updates immediately."""
+        with self.lock:
+            pending = self.pending
+            self.pending = {}
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        for (to, channel, options), streams in pending.items():
+            self.callback(list(streams.values()),
+                          list(to) if to is not None else None,
+                          list(channel) if channel is not None else None,
+                          **dict(options))
@@ -0,0 +1,539 @@
+from collections import OrderedDict, deque
+import hashlib
+import re
+import select
+import socket
+import ssl
+import struct
+import threading
+import time
+import zlib
+from simple_websocket import ConnectionClosed
+from simple_websocket.ws import Base as WebSocket
+from wsproto.events import Ping, TextMessage
+from wsproto.extensions import PerMessageDeflate
+from .coalesce import stream_key
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+DISCONNECT = 'disconnect'
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, DISCONNECT)
+
+_LINE_BREAK_RE = re.compile(r'\r\n|\r|\n')
+_MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+_TLS_RECORD_SIZE = 16384
+
+
+class Message(str):
+    """A text message that is sent to many connections.
+
+    The message behaves as a string, but also caches the bytes of its
+    WebSocket frames, so that each frame is encoded and compressed only once
+    regardless of how many connections the message is sent to.
+    """
+    _payload = None
+    _frame = None
+    _compressed_frames = None
+    _digest = None
+    _event = None
+    _tagged = None
+
+    #: The sequence number of the message in the replay buffer.
+    seq = None
+
+    #: The id of the message in the replay buffer.
+    event_id = None
+
+    @property
+    def payload(self):
+        """The UTF-8 encoded message."""
+        if self._payload is None:
+            self._payload = self.encode()
+        return self._payload
+
+    @property
+    def digest(self):
+        """A compact hash of the message."""
+        if self._digest is None:
+            self._digest = hashlib.blake2b(self.payload,
+                                           digest_size=8).digest()
+        return self._digest
+
+    @property
+    def frame(self):
+        """The encoded WebSocket frame for this message."""
+        if self._frame is None:
+            self._frame = encode_frame(self.payload)
+        return self._frame
+
+    @property
+    def tagged(self):
+        """The message prefixed with an HTML comment that contains its id, or
+        the message itself if it does not have an id."""
+        if self.event_id is None:
+            return self
+        if self._tagged is None:
+            self._tagged = Message(f'<!--turbo-id:{self.event_id}-->{self}')
+        return self._tagged
+
+    @property
+    def event(self):
+        """The message encoded as a Server-Sent Event."""
+        if self._event is None:
+            lines = ''.join(f'data: {line}\n'
+                            for line in _LINE_BREAK_RE.split(self))
+            if self.event_id is not None:
+                lines = f'id: {self.event_id}\n' + lines
+            self._event = lines + '\n'
+        return self._event
+
+    def compressed_frame(self, level=-1, wbits=15):
+        """The encoded WebSocket frame for this message, compressed with the
+        permessage-deflate extension.
+
+        :param level: the compression level, from 0 to 9, or -1 to use the
+                      zlib default.
+        :param wbits: the size of the compression window, in bits.
+
+        The message is compressed without references to previous messages,
+        so the frame is valid for any connection that negotiated the
+        extension with the given window size or a larger one.
+        """
+        if self._compressed_frames is None:
+            self._compressed_frames = {}
+        frame = self._compressed_frames.get((level, wbits))
+        if frame is None:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -wbits)
+            data = compressor.compress(self.payload) + \
+                compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data.endswith(b'\x00\x00\xff\xff'):
+                data = data[:-4]
+            frame = encode_frame(data, rsv1=True)
+            self._compressed_frames[(level, wbits)] = frame
+        return frame
+
+
+def encode_frame(payload, opcode=0x1, rsv1=False):
+    """Encode an unmasked WebSocket frame, as sent by a server.
+
+    :param payload: the payload, as bytes.
+    :param opcode: the frame opcode. The default is a text frame.
+    :param rsv1: set to ``True`` to flag the payload as compressed.
+    """
+    first = 0x80 | opcode | (0x40 if rsv1 else 0)
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', first, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', first, 126, length)
+    else:
+        header = struct.pack('!BBQ', first, 127, length)
+    return header + payload
+
+
+def negotiated_deflate(ws):
+    """Return the permessage-deflate extension negotiated by a WebSocket
+    connection, or ``None`` if the connection is not compressed.
+
+    ``AttributeError`` is raised when the extensions cannot be found in the
+    internals of the simple-websocket object.
+    """
+    for extension in ws.ws.connection._proto.extensions:
+        if isinstance(extension, PerMessageDeflate) and extension.enabled():
+            return extension
+
+
+class Connection:
+    """A client connection that receives pushed turbo stream updates.
+
+    When a queue size is given, updates passed to ``send()`` are stored in a
+    bounded queue and written to the WebSocket later by the thread that
+    handles the connection, so that a slow client does not block the caller.
+    Without a queue, updates are written to the WebSocket immediately.
+
+    :param ws: the WebSocket object.
+    :param queue_size: the maximum number of pending updates, or 0 to send
+                       updates synchronously.
+    :param overflow: the policy to apply when the queue is full. Use
+                     ``'drop_oldest'`` to discard the oldest pending update,
+                     ``'drop_newest'`` to discard the incoming update, or
+                     ``'disconnect'`` to close the connection.
+    :param on_drop: a function that is invoked with the policy and the number
+                    of updates discarded each time the overflow policy is
+                    applied.
+    :param compression: set to ``True`` to compress updates with the
+                        permessage-deflate extension when the client supports
+                        it, or to ``False`` to never compress them. The
+                        default of ``None`` leaves compression to the
+                        WebSocket library.
+    :param compression_min_size: the minimum size in bytes of an update for
+                                 it to be compressed.
+    :param compression_level: the zlib compression level.
+    :param user_id: the id of the user that owns the connection.
+    :param dedup_size: the maximum number of targets for which the hash of
+                       the last update is remembered, to skip repeated
+                       updates.
+    """
+    #: Whether the client can send data or answer pings on this connection,
+    #: which is needed to detect idle clients.
+    pingable = True
+
+    def __init__(self, ws, queue_size=0, overflow=DROP_OLDEST, on_drop=None,
+                 compression=None, compression_min_size=0,
+                 compression_level=-1, user_id=None, dedup_size=256):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f'Invalid overflow policy: {overflow}')
+        self.ws = ws
+        self.user_id = user_id
+        self.created = self.last_seen = self.last_ping = time.monotonic()
+        self.registered = False
+        self.ping_sent = None
+        self.close_code = None
+        self.digests = OrderedDict()
+        self.dedup_size = dedup_size
+        self.replayed = set()
+        self.holding = None
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.on_drop = on_drop
+        self.queue = deque() if queue_size else None
+        self.compression_min_size = compression_min_size
+        self.compression_level = compression_level
+        self.sock = None
+        self.raw_sock = None
+        self.deflate_bits = None
+        if isinstance(ws, WebSocket):
+            try:
+                deflate = negotiated_deflate(ws)
+                self.raw_sock = ws.sock
+            except AttributeError:
+                # the internals of this version of simple-websocket are not
+                # known, so it is only used through its public interface
+                deflate = None
+            if self.raw_sock is not None and (
+                    deflate is None or compression is not None):
+                # pre-encoded frames can be written directly to the socket
+                self.sock = self.raw_sock
+                if deflate is not None and compression:
+                    self.deflate_bits = deflate.server_max_window_bits
+        self.dropped = 0
+        self.closed = False
+        self.cv = threading.Condition()
+        # frames are written by the threads that push updates and by the
+        # thread that sends pings, and must not be interleaved
+        self.write_lock = threading.Lock()
+
+    def send(self, data, timeout=None):
+        """Send or enqueue an update for this connection.
+
+        :param data: the update to send.
+        :param timeout: the maximum time to wait for the update to be
+                        written, in seconds, or ``None`` to wait as long as
+                        necessary. This only applies to connections without
+                        a queue, which are written to by the caller.
+
+        Returns ``'sent'`` if the update was written, ``'queued'`` if it
+        was added to the queue, ``'dropped'`` if it was discarded, or
+        ``'suppressed'`` if it was already replayed to the client.
+        """
+        if self.queue is None:
+            if self.holding is not None or self.replayed:
+                with self.cv:
+                    if not self._is_new(data):
+                        return 'suppressed'
+                    if self.holding is not None:
+                        self.holding.append(data)
+                        return 'queued'
+            self.write(data, timeout=timeout)
+            return 'sent'
+        with self.cv:
+            if not self._is_new(data):
+                return 'suppressed'
+            queued = not self.closed and (
+                len(self.queue) < self.queue_size or
+                self.overflow == DROP_OLDEST)
+            dropped = self._enqueue(data)
+            self.cv.notify()
+        self._report_dropped(dropped)
+        return 'queued' if queued else 'dropped'
+
+    def _enqueue(self, data):
+        # returns the list of updates that were discarded
+        if self.closed or not self._is_new(data):
+            return []
+        dropped = []
+        if len(self.queue) >= self.queue_size:
+            if self.overflow == DROP_OLDEST:
+                dropped.append(self.queue.popleft())
+                self.queue.append(data)
+            elif self.overflow == DROP_NEWEST:
+                dropped.append(data)
+            else:
+                dropped.extend(self.queue)
+                dropped.append(data)
+                self.queue.clear()
+                self.closed = True
+                self.close_code = 1008
+        else:
+            self.queue.append(data)
+        return dropped
+
+    def _report_dropped(self, dropped):
+        if dropped:
+            self.dropped += len(dropped)
+            if self.digests and not self.closed:
+                # the client did not get these updates, so their targets
+                # must not be skipped when they are pushed again
+                for data in dropped:
+                    key = stream_key(data)
+                    self.is_duplicate(key[1] if key else None, None)
+            if self.on_drop:
+                self.on_drop(self.overflow, len(dropped))
+
+    def flush(self, timeout=None):
+        """Write all the pending updates to the WebSocket.
+
+        :param timeout: the time to wait for updates to arrive when the queue
+                        is empty, in seconds.
+
+        Returns ``False`` if the connection was closed due to an overflow, or
+        ``True`` otherwise.
+        """
+        with self.cv:
+            if not self.queue and not self.closed:
+                self.cv.wait(timeout)
+            pending = list(self.queue)
+            self.queue.clear()
+            closed = self.closed
+        if closed:
+            return False
+        for data in pending:
+            self.write(data)
+        return True
+
+    def hold(self):
+        """Hold updates sent to this connection until :func:`replay` is
+        called."""
+        with self.cv:
+            if self.queue is None:
+                self.holding = []
+
+    def replay(self, messages):
+        """Send updates that the client missed, ahead of any updates that
+        are pending or held.
+
+        :param messages: a list of :class:`Message` instances, in the order
+                         in which they were pushed.
+
+        Updates that are pending or held and were also replayed are only
+        sent once.
+        """
+        seqs = {data.seq for data in messages
+                if getattr(data, 'seq', None) is not None}
+        with self.cv:
+            pending = self.queue if self.queue is not None else self.holding
+            if pending and seqs:
+                kept = []
+                for data in pending:
+                    seq = getattr(data, 'seq', None)
+                    if seq in seqs:
+                        seqs.discard(seq)
+                    else:
+                        kept.append(data)
+                pending.clear()
+                pending.extend(kept)
+            # the updates that were not pending may still be delivered by
+            # pushes that are in progress
+            self.replayed.update(seqs)
+            if self.queue is not None:
+                self.queue.extendleft(reversed(messages))
+                self.cv.notify()
+                return
+        pending = messages
+        while pending:
+            for data in pending:
+                self.write(data)
+            with self.cv:
+                pending = self.holding
+                self.holding = [] if pending else None
+
+    def _is_new(self, data):
+        # updates that were replayed are skipped when they are also pushed to
+        # the connection, which must be checked with the lock held. The
+        # sequence numbers are not used to order updates, because concurrent
+        # pushes can reach a connection in any order
+        if self.replayed:
+            seq = getattr(data, 'seq', None)
+            if seq in self.replayed:
+                self.replayed.discard(seq)
+                return False
+        return True
+
+    def write(self, data, timeout=None):
+        """Write an update to the WebSocket.
+
+        When the WebSocket allows it, updates are written as pre-encoded
+        frames, which are cached when the update is a :class:`Message`
+        instance. Updates that have an id are prefixed with it.
+
+        :param data: the update to write.
+        :param timeout: the maximum time to wait for the socket to accept the
+                        frame, in seconds. ``TimeoutError`` is raised when
+                        the frame is not written in time.
+        """
+        if isinstance(data, Message):
+            data = data.tagged
+        if self.sock is None:
+            if timeout is None or self.raw_sock is None:
+                with self.write_lock:
+                    self.ws.send(data)
+                return
+            # the frame is encoded by the WebSocket library, which keeps the
+            # compression state of the connection, and then written here so
+            # that the timeout can be enforced
+            if not self.ws.connected:
+                raise ConnectionClosed(self.ws.close_reason,
+                                       self.ws.close_message)
+            with self.write_lock:
+                self._sendall(self.raw_sock,
+                              self.ws.ws.send(TextMessage(data=str(data))),
+                              timeout)
+            return
+        if not isinstance(data, Message):
+            data = Message(data)
+        if not self.ws.connected:
+            raise ConnectionClosed(self.ws.close_reason,
+                                   self.ws.close_message)
+        if self.deflate_bits and \
+                len(data.payload) >= self.compression_min_size:
+            frame = data.compressed_frame(self.compression_level,
+                                          self.deflate_bits)
+        else:
+            frame = data.frame
+        with self.write_lock:
+            if timeout is None:
+                self.sock.sendall(frame)
+            else:
+                self._sendall(self.sock, frame, timeout)
+
+    @staticmethod
+    def _sendall(sock, frame, timeout):
+        # write without blocking for longer than the timeout, without
+        # changing the timeout of the socket, which is shared with the
+        # thread that reads from the WebSocket. The caller must hold the
+        # write lock of the connection
+        deadline = time.monotonic() + timeout
+        view = memoryview(frame)
+        while view:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or \
+                    not select.select((), (sock,), (), remaining)[1]:
+                raise TimeoutError('Timed out writing to the WebSocket')
+            try:
+                if isinstance(sock, ssl.SSLSocket):
+                    # TLS sockets do not accept flags, so the frame is
+                    # written one TLS record at a time, each after the
+                    # socket is ready to accept more data
+                    sent = sock.send(view[:_TLS_RECORD_SIZE])
+                else:
+                    sent = sock.send(view, _MSG_DONTWAIT)
+            except BlockingIOError:
+                continue
+            view = view[sent:]
+
+    def close(self):
+        """Mark this connection as closed and wake up its handler."""
+        with self.cv:
+            self.closed = True
+            if self.queue is not None:
+                self.queue.clear()
+            self.cv.notify()
+
+    def abort(self):
+        """Close this connection and shut down its socket without a closing
+        handshake, for sockets that are broken or that do not accept data.
+        """
+        self.close()
+        sock = self.sock or getattr(self.ws, 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def evict(self, code=1001):
+        """Close this connection and its WebSocket.
+
+        :param code: the WebSocket close code.
+        """
+        self.close_code = code
+        self.close()
+        try:
+            self.ws.close(reason=code)
+        except Exception:
+            pass
+
+    def is_duplicate(self, target, digest):
+        """Record the hash of the last update sent for a target.
+
+        :param target: the target of the update, or ``None`` to forget the
+                       hashes recorded for all targets.
+        :param digest: the hash of the update, or ``None`` to forget the
+                       previous hash of the target.
+
+        Returns ``True`` if the hash is the same as the one recorded for the
+        previous update sent for the target.
+        """
+        with self.cv:
+            if target is None:
+                self.digests.clear()
+                return False
+            if digest is None:
+                self.digests.pop(target, None)
+                return False
+            if self.digests.get(target) == digest:
+                self.digests.move_to_end(target)
+                return True
+            self.digests[target] = digest
+            self.digests.move_to_end(target)
+            if len(self.digests) > self.dedup_size:
+                self.digests.popitem(last=False)
+            return False
+
+    def touch(self):
+        """Record activity from the client on this connection."""
+        self.last_seen = time.monotonic()
+
+    def is_alive(self):
+        """Returns ``True`` if the connection has not been closed."""
+        return not self.closed and getattr(self.ws, 'connected', True)
+
+    def heartbeat(self, interval, timeout, now=None):
+        """Send a ping to the client when it is due, and check that the
+        previous ping was answered.
+
+        :param interval: the interval between pings, in seconds.
+        :param timeout: the time the client has to answer a ping, in seconds.
+        :param now: the current monotonic time.
+
+        Returns ``False`` if the client did not answer a ping in time.
+        Connections that are not served by a supported version of
+        simple-websocket are not pinged.
+        """
+        if self.raw_sock is None:
+            return True
+        now = time.monotonic() if now is None else now
+        if self.ping_sent is not None:
+            if not self.ws.pong_received:
+                return now - self.ping_sent <= timeout
+            self.last_seen = now
+            self.ping_sent = None
+        if now - self.last_ping >= interval:
+            self.ws.pong_received = False
+            self.ping_sent = self.last_ping = now
+            try:
+                with self.write_lock:
+                    self.raw_sock.sendall(self.ws.ws.send(Ping()))
+            except OSError:
+                return False
+        return True
@@ -0,0 +1,36 @@
+_STREAM_MIMETYPE = 'text/vnd.turbo-stream.html'
+_PURPOSE_HEADERS = ('X-Sec-Purpose', 'Sec-Purpose', 'Purpose')
+
+
+class TurboRequest:
+    """The Turbo related information of a request.
+
+    An instance of this class is created the first time it is needed in each
+    request, and is available as ``turbo.current_request`` in Python code and
+    as ``turbo_request`` in templates. The headers are read when the object
+    is created, and content negotiation is done on first use.
+
+    :param request: the Flask request object.
+    """
+    def __init__(self, request):
+        self.request = request
+        headers = request.headers
+        #: The id of the frame the client expects, or ``None``.
+        self.frame = headers.get('Turbo-Frame')
+        #: The id that turbo.js assigned to the request, or ``None``.
+        self.request_id = headers.get('X-Turbo-Request-Id')
+        #: ``True`` if the request is a prefetch made by turbo.js or the
+        #: browser when the user hovers over a link.
+        self.is_prefetch = any(
+            'prefetch' in headers.get(name, '').lower()
+            for name in _PURPOSE_HEADERS)
+        self._can_stream = None
+
+    @property
+    def can_stream(self):
+        """``True`` if the client accepts turbo stream responses."""
+        if self._can_stream is None:
+            best = self.request.accept_mimetypes.best_match([
+                _STREAM_MIMETYPE, 'text/html'])
+            self._can_stream = best == _STREAM_MIMETYPE
+        return self._can_stream
@@ -0,0 +1,153 @@
+from bisect import bisect_left
+import threading
+
+#: The default histogram buckets, in seconds.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800, 3600)
+
+_HELP = {
+    'turbo_connections': 'Number of open connections.',
+    'turbo_users': 'Number of users with open connections.',
+    'turbo_connections_total': 'Number of connections accepted.',
+    'turbo_disconnections_total': 'Number of connections closed.',
+    'turbo_connection_duration_seconds': 'Lifetime of closed connections.',
+    'turbo_pushes_total': 'Number of pushed updates delivered by this '
+                          'process.',
+    'turbo_push_duration_seconds': 'Time to send or queue a pushed update '
+                                   'for all its local connections.',
+    'turbo_messages_sent_total': 'Number of updates sent or queued to '
+                                 'connections.',
+    'turbo_bytes_sent_total': 'Number of bytes sent or queued to '
+                              'connections, before compression.',
+    'turbo_send_errors_total': 'Number of updates that could not be sent.',
+    'turbo_dropped_total': 'Number of updates discarded by overflow '
+                           'policies.',
+    'turbo_suppressed_total': 'Number of unchanged updates skipped.',
+    'turbo_reaped_total': 'Number of dead or idle connections evicted.',
+    'turbo_resume_failures_total': 'Number of reconnections that could not '
+                                   'recover missed updates.',
+    'turbo_rejected_total': 'Number of connections rejected by connection '
+                            'limits or by the connection rate limit.',
+}
+
+
+class Histogram:
+    """A histogram with fixed buckets.
+
+    :param buckets: the upper bounds of the buckets, in increasing order.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        """Add a value to the histogram."""
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Return a list of ``(upper_bound, count)`` tuples, with the number
+        of values that are lower or equal than each bound."""
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class Metrics:
+    """Collect counters, gauges and histograms.
+
+    Metric names follow the Prometheus conventions, and may include labels,
+    as in ``'turbo_dropped_total{policy="disconnect"}'``.
+    """
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def inc(self, name, value=1):
+        """Increment a counter.
+
+        :param name: the name of the counter.
+        :param value: the amount to add to the counter.
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS):
+        """Add a value to a histogram.
+
+        :param name: the name of the histogram.
+        :param value: the value to add.
+        :param buckets: the buckets to use if the histogram does not exist.
+        """
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def collect(self, name, kind, func):
+        """Register a metric whose value is obtained when it is read.
+
+        :param name: the name of the metric.
+        :param kind: ``'counter'`` or ``'gauge'``.
+        :param func: a function that returns the value of the metric.
+        """
+        self.collectors.append((name, kind, func))
+
+    def snapshot(self):
+        """Return a dictionary with the current values of all the metrics.
+
+        Histograms are returned as dictionaries with ``count``, ``sum`` and
+        ``buckets`` keys.
+        """
+        with self.lock:
+            values = dict(self.counters)
+            for name, histogram in self.histograms.items():
+                values[name] = {'count': histogram.count,
+                                'sum': histogram.sum,
+                                'buckets': histogram.cumulative()}
+        for name, _, func in self.collectors:
+            values[name] = func()
+        return values
+
+    def render(self):
+        """Return all the metrics in the Prometheus text exposition
+        format."""
+        with self.lock:
+            metrics = [(name, 'counter', value)
+                       for name, value in self.counters.items()]
+        metrics += [(name, kind, func())
+                    for name, kind, func in self.collectors]
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            base = name.partition('{')[0]
+            if base not in described:
+                described.add(base)
+                if base in _HELP:
+                    lines.append(f'# HELP {base} {_HELP[base]}')
+                lines.append(f'# TYPE {base} {kind}')
+            return base
+
+        for name, kind, value in sorted(metrics):
+            describe(name, kind)
+            lines.append(f'{name} {value}')
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            for name, histogram in histograms:
+                describe(name, 'histogram')
+                for bound, count in histogram.cumulative():
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{name}_bucket{{le="{le}"}} {count}')
+                lines.append(f'{name}_sum {histogram.sum}')
+                lines.append(f'{name}_count {histogram.count}')
+        return '\n'.join(lines) + '\n'
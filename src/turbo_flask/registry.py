@@ -0,0 +1,161 @@
+import threading
+
+
+class ClientRegistry:
+    """A thread-safe registry of client connections, indexed by user id.
+
+    The registry is divided in stripes, each with its own lock, so that
+    connections and disconnections for different users rarely contend. The
+    connections of each user are stored in a tuple that is replaced on every
+    change, which allows readers to iterate over the registry without taking
+    any locks.
+
+    The registry also maintains an index of the connections subscribed to
+    each channel, so that the subscribers of a channel can be found without
+    scanning all the connections.
+
+    :param clients: an optional dictionary with initial user ids and lists of
+                    connections.
+    :param stripes: the number of stripes.
+    """
+    def __init__(self, clients=None, stripes=16):
+        self.stripes = [({}, threading.Lock()) for _ in range(stripes)]
+        self.channel_stripes = [({}, threading.Lock())
+                                for _ in range(stripes)]
+        self.subscription_stripes = [({}, threading.Lock())
+                                     for _ in range(stripes)]
+        for user_id, connections in (clients or {}).items():
+            for conn in connections:
+                self.add(user_id, conn)
+
+    def _stripe(self, user_id):
+        return self.stripes[hash(user_id) % len(self.stripes)]
+
+    def _channel_stripe(self, channel):
+        return self.channel_stripes[hash(channel) % len(self.channel_stripes)]
+
+    def _subscription_stripe(self, conn):
+        return self.subscription_stripes[
+            id(conn) % len(self.subscription_stripes)]
+
+    def add(self, user_id, conn):
+        """Add a connection for a user.
+
+        Returns ``True`` if this is the first connection for the user.
+        """
+        clients, lock = self._stripe(user_id)
+        with lock:
+            connections = clients.get(user_id, ())
+            clients[user_id] = connections + (conn,)
+        return connections == ()
+
+    def remove(self, user_id, conn):
+        """Remove a connection for a user.
+
+        Returns ``True`` if the user does not have any connections left.
+        """
+        clients, lock = self._stripe(user_id)
+        with lock:
+            connections = clients.get(user_id, ())
+            if conn not in connections:
+                return False
+            connections = tuple(c for c in connections if c is not conn)
+            if connections:
+                clients[user_id] = connections
+            else:
+                del clients[user_id]
+        return connections == ()
+
+    def subscribe(self, channel, conn):
+        """Subscribe a connection to a channel.
+
+        Returns ``True`` if this is the first subscriber of the channel.
+        """
+        subscriptions, lock = self._subscription_stripe(conn)
+        with lock:
+            subscriptions.setdefault(conn, set()).add(channel)
+        channels, lock = self._channel_stripe(channel)
+        with lock:
+            subscribers = channels.get(channel)
+            first = not subscribers
+            if subscribers is None:
+                subscribers = channels[channel] = {}
+            subscribers[conn] = None
+        return first
+
+    def unsubscribe(self, channel, conn):
+        """Unsubscribe a connection from a channel.
+
+        Returns ``True`` if the channel does not have any subscribers left.
+        """
+        subscriptions, lock = self._subscription_stripe(conn)
+        with lock:
+            conn_channels = subscriptions.get(conn, set())
+            conn_channels.discard(channel)
+            if not conn_channels:
+                subscriptions.pop(conn, None)
+        channels, lock = self._channel_stripe(channel)
+        with lock:
+            subscribers = channels.get(channel)
+            if subscribers is None or conn not in subscribers:
+                return False
+            del subscribers[conn]
+            if subscribers:
+                return False
+            del channels[channel]
+        return True
+
+    def subscriptions(self, conn):
+        """Return the channels a connection is subscribed to."""
+        subscriptions, lock = self._subscription_stripe(conn)
+        with lock:
+            return set(subscriptions.get(conn, ()))
+
+    def subscribers(self, channel):
+        """Return a snapshot of the connections subscribed to a channel."""
+        subscribers = self._channel_stripe(channel)[0].get(channel)
+        if not subscribers:
+            return []
+        return list(subscribers.copy())
+
+    def has_subscribers(self, channel):
+        """Returns ``True`` if the channel has at least one subscriber."""
+        return bool(self._channel_stripe(channel)[0].get(channel))
+
+    def get(self, user_id, default=()):
+        """Return the connections for a user, as a tuple."""
+        return self._stripe(user_id)[0].get(user_id, default)
+
+    def keys(self):
+        """Return a snapshot of the connected user ids."""
+        return [user_id for clients, _ in self.stripes
+                for user_id in clients.copy()]
+
+    def items(self):
+        """Return a snapshot of the user ids and their connections."""
+        return [item for clients, _ in self.stripes
+                for item in clients.copy().items()]
+
+    def connections(self):
+        """Return a snapshot of all the connections."""
+        return [conn for clients, _ in self.stripes
+                for connections in clients.copy().values()
+                for conn in connections]
+
+    def __getitem__(self, user_id):
+        connections = self.get(user_id, None)
+        if connections is None:
+            raise KeyError(user_id)
+        return connections
+
+    def __contains__(self, user_id):
+        return user_id in self._stripe(user_id)[0]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return sum(len(clients) for clients, _ in self.stripes)
+
+    def __bool__(self):
+        return any(clients for clients, _ in self.stripes)
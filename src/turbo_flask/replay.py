@@ -0,0 +1,82 @@
+from collections import deque
+import threading
+import time
+import uuid
+
+
+class ReplayBuffer:
+    """Keep the most recent pushed updates, so that clients that reconnect
+    can receive the updates they missed.
+
+    Each update is assigned an id that combines a random epoch, which is
+    different for each buffer, with a sequence number. Clients report the id
+    of the last update they received when they reconnect.
+
+    :param max_size: the maximum number of updates kept in the buffer.
+    :param max_age: the time, in seconds, after which updates are removed from
+                    the buffer, or ``None`` to only limit the buffer by size.
+    """
+    def __init__(self, max_size=100, max_age=None):
+        self.max_size = max_size
+        self.max_age = max_age
+        self.epoch = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self.entries = deque()
+        self.lock = threading.Lock()
+
+    def add(self, message, to=None, channel=None):
+        """Add an update to the buffer.
+
+        :param message: the update, as a :class:`Message` instance. Its
+                        ``seq`` and ``event_id`` attributes are set by this
+                        method.
+        :param to: the list of recipients of the update, or ``None``.
+        :param channel: the list of channels of the update, or ``None``.
+        """
+        with self.lock:
+            self.seq += 1
+            message.seq = self.seq
+            message.event_id = f'{self.epoch}-{self.seq}'
+            self.entries.append((message, to, channel, time.monotonic()))
+            while len(self.entries) > self.max_size:
+                self.entries.popleft()
+            self._expire()
+        return message.event_id
+
+    def since(self, event_id, user_id=None, channels=()):
+        """Return the updates for a client that were added after the given
+        id.
+
+        :param event_id: the id of the last update received by the client.
+        :param user_id: the id of the user of the client.
+        :param channels: the channels the client is subscribed to.
+
+        Returns a list of :class:`Message` instances, or ``None`` if the id
+        does not belong to this buffer or some of the updates after it are
+        no longer available.
+        """
+        epoch, _, seq = (event_id or '').partition('-')
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        seq = int(seq)
+        with self.lock:
+            self._expire()
+            first = self.entries[0][0].seq if self.entries else self.seq + 1
+            if seq > self.seq or first > seq + 1:
+                return None
+            return [message for message, to, channel, _ in self.entries
+                    if message.seq > seq and
+                    self._matches(to, channel, user_id, channels)]
+
+    def _expire(self):
+        if self.max_age is None:
+            return
+        limit = time.monotonic() - self.max_age
+        while self.entries and self.entries[0][3] < limit:
+            self.entries.popleft()
+
+    @staticmethod
+    def _matches(to, channel, user_id, channels):
+        if channel is not None:
+            return any(name in channels for name in channel)
+        return to is None or user_id in to
@@ -0,0 +1,65 @@
+from collections import namedtuple
+
+#: The result of sending an update to one connection. The ``status`` is
+#: ``'sent'``, ``'queued'``, ``'dropped'``, ``'suppressed'`` or ``'failed'``,
+#: ``elapsed`` is the time it took to send or queue the update, in seconds,
+#: and ``error`` is the exception raised by failed sends.
+Delivery = namedtuple('Delivery', ['user_id', 'conn', 'status', 'elapsed',
+                                   'error'])
+
+
+class DeliveryReport:
+    """The results of pushing an update to the connections of the current
+    process.
+
+    Instances of this class are returned by :func:`Turbo.push` when its
+    ``report`` argument is set to ``True``. The ``results`` attribute is a
+    list with a :data:`Delivery` entry for each message sent to each
+    connection, and ``elapsed`` is the total time of the push, in seconds.
+    Connections in other processes are not included in the report.
+    """
+    def __init__(self):
+        self.results = []
+        self.elapsed = 0
+
+    def add(self, conn, status, elapsed=0, error=None):
+        """Record the result of sending an update to a connection."""
+        self.results.append(Delivery(getattr(conn, 'user_id', None), conn,
+                                     status, elapsed, error))
+
+    def count(self, status):
+        """Return the number of results with the given status."""
+        return sum(1 for result in self.results if result.status == status)
+
+    @property
+    def sent(self):
+        """The number of updates written to a connection."""
+        return self.count('sent')
+
+    @property
+    def queued(self):
+        """The number of updates added to the queue of a connection."""
+        return self.count('queued')
+
+    @property
+    def dropped(self):
+        """The number of updates discarded by an overflow policy."""
+        return self.count('dropped')
+
+    @property
+    def suppressed(self):
+        """The number of updates skipped because they were unchanged."""
+        return self.count('suppressed')
+
+    @property
+    def failed(self):
+        """The number of updates that could not be sent."""
+        return self.count('failed')
+
+    def __len__(self):
+        return len(self.results)
+
+    def __repr__(self):
+        return (f'<DeliveryReport sent={self.sent} queued={self.queued} '
+                f'dropped={self.dropped} suppressed={self.suppressed} '
+                f'failed={self.failed} elapsed={self.elapsed:.6f}>')
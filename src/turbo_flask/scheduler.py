@@ -0,0 +1,149 @@
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+
+
+class Job:
+    """A function scheduled to run once or periodically.
+
+    Instances of this class are returned by the :class:`Scheduler` methods.
+
+    :param func: the function to run.
+    :param interval: the interval between runs, in seconds, or ``None`` for a
+                     function that runs only once.
+    :param jitter: the fraction of the interval by which each run can be
+                   randomly advanced or delayed.
+    """
+    def __init__(self, func, interval=None, jitter=0):
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.cancelled = False
+
+    def cancel(self):
+        """Cancel all future runs of the job."""
+        self.cancelled = True
+
+    def next_delay(self):
+        """Return the time until the next run of a periodic job."""
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+
+class Scheduler:
+    """Run functions at given times, from a single background thread.
+
+    The jobs are kept in a heap ordered by the time of their next run. The
+    thread is started when the first job is added, once the application is
+    known, and each job runs in an application context.
+
+    :param app: the Flask application instance.
+    """
+    def __init__(self, app=None):
+        self.app = app
+        self.heap = []
+        self.counter = itertools.count()
+        self.cv = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.pid = None
+
+    def call_later(self, delay, func):
+        """Run a function once, after the given delay in seconds.
+
+        Returns the :class:`Job` object.
+        """
+        job = Job(func)
+        self._add(job, delay)
+        return job
+
+    def every(self, interval, func, jitter=0.1):
+        """Run a function periodically.
+
+        :param interval: the interval between runs, in seconds.
+        :param func: the function to run.
+        :param jitter: the fraction of the interval by which each run can be
+                       randomly advanced or delayed. When this is not zero,
+                       the first run also happens at a random time within the
+                       first interval, so that jobs created together do not
+                       run together.
+
+        Returns the :class:`Job` object.
+        """
+        job = Job(func, interval, jitter)
+        self._add(job, random.uniform(0, interval) if jitter else interval)
+        return job
+
+    def _add(self, job, delay):
+        with self.cv:
+            heapq.heappush(self.heap, (time.monotonic() + delay,
+                                       next(self.counter), job))
+            self.cv.notify()
+        if self.app is not None:
+            self.start()
+
+    def start(self):
+        """Start the scheduler thread, if it is not running yet in the
+        current process."""
+        pid = os.getpid()
+        if self.thread is not None and self.pid == pid:
+            return
+        if self.pid != pid:
+            if self.pid is not None:
+                # threads do not survive a fork, so a scheduler that was
+                # started before the server forked its workers needs a new
+                # thread, and a new lock, which could have been held during
+                # the fork
+                self.cv = threading.Condition()
+                self.thread = None
+            self.pid = pid
+        with self.cv:
+            if self.thread is not None:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop(self):
+        """Stop the scheduler thread. Jobs that are not due yet are kept, and
+        run if the scheduler is started again."""
+        with self.cv:
+            thread = self.thread
+            self.running = False
+            self.thread = None
+            self.cv.notify()
+        if thread is not None and self.pid == os.getpid() and \
+                thread is not threading.current_thread():
+            thread.join()
+
+    def _run(self):
+        while True:
+            with self.cv:
+                while self.running:
+                    now = time.monotonic()
+                    if self.heap and self.heap[0][0] <= now:
+                        break
+                    self.cv.wait(self.heap[0][0] - now if self.heap else None)
+                if not self.running:
+                    return
+                when, _, job = heapq.heappop(self.heap)
+                if job.cancelled:
+                    continue
+                if job.interval:
+                    when = max(when + job.next_delay(), now)
+                    heapq.heappush(self.heap, (when, next(self.counter), job))
+            self._call(job)
+
+    def _call(self, job):
+        try:
+            if self.app is None:
+                job.func()
+            else:
+                with self.app.app_context():
+                    job.func()
+        except Exception:
+            if self.app is not None:
+                self.app.logger.exception('Scheduled job failed')
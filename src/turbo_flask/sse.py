@@ -0,0 +1,49 @@
+from .connection import Connection, DROP_OLDEST, Message
+
+
+class SSEConnection(Connection):
+    """A client connection served by the Server-Sent Events endpoint.
+
+    Updates are added to a queue, which is drained by the generator of the
+    streaming response of the client.
+
+    :param queue_size: the maximum number of pending updates.
+    :param overflow: the policy to apply when the queue is full.
+    :param on_drop: a function that is invoked with the policy and the number
+                    of updates discarded each time the overflow policy is
+                    applied.
+    :param user_id: the id of the user that owns the connection.
+    :param dedup_size: the maximum number of targets for which the hash of
+                       the last update is remembered.
+    """
+    pingable = False
+
+    def __init__(self, queue_size=100, overflow=DROP_OLDEST, on_drop=None,
+                 user_id=None, dedup_size=256):
+        super().__init__(None, queue_size=queue_size or 100,
+                         overflow=overflow, on_drop=on_drop, user_id=user_id,
+                         dedup_size=dedup_size)
+        self.pending = []
+
+    def write(self, data):
+        self.pending.append(data)
+
+    def events(self, timeout=None):
+        """Return the pending updates, encoded as Server-Sent Events.
+
+        :param timeout: the time to wait for updates to arrive when the queue
+                        is empty, in seconds.
+
+        Returns an empty string if no updates arrived in time, or ``None`` if
+        the connection was closed.
+        """
+        if not self.flush(timeout=timeout):
+            return None
+        pending = self.pending
+        self.pending = []
+        events = []
+        for data in pending:
+            if not isinstance(data, Message):
+                data = Message(data)
+            events.append(data.event)
+        return ''.join(events)
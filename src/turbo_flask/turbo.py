@@ -1,46 +1,502 @@
+from functools import wraps
+import os
+import random
+import threading
+import time
+from urllib.parse import urlencode
 import uuid
-from flask import request, current_app
+from flask import request, current_app, g, has_request_context, \
+    render_template, session, url_for, abort
 from flask_sock import Sock, ConnectionClosed
 from markupsafe import Markup
+from .assets import ScriptAsset
+from .batch import Batch, chunk_streams
+from .broker import LocalBroker
+from .builder import StreamBuilder, make_stream, _make_target_stream
+from .cache import FragmentCache
+from .coalesce import Coalescer, IDEMPOTENT_ACTIONS, stream_key
+from .context import TurboRequest
+from .connection import Connection, Message, OVERFLOW_POLICIES
+from .metrics import Metrics
+from .registry import ClientRegistry
+from .replay import ReplayBuffer
+from .report import DeliveryReport
+from .scheduler import Scheduler
+from .sse import SSEConnection
 
 
 _CDN = 'https://cdn.jsdelivr.net'
 _PKG = '@hotwired/turbo'
 _VER = '8.0.11'
 
+# the initial and maximum delays, in milliseconds, before a client reconnects
+_RECONNECT_DELAY = 500
+_RECONNECT_MAX_DELAY = 30000
+
+#: The policies that can be applied when a connection limit is reached.
+CONNECTION_LIMIT_POLICIES = ('reject', 'evict_oldest')
+
 
 class Turbo:
-    def __init__(self, app=None):
+    """Create the Turbo-Flask extension.
+
+    :param app: the Flask application instance. If not provided, it must be
+                initialized later by calling the :func:`Turbo.init_app`
+                method.
+    :param broker: the broker used to distribute pushed updates to all the
+                   server processes. The default is a
+                   :class:`~turbo_flask.broker.LocalBroker`, which only
+                   delivers updates to clients connected to the current
+                   process.
+    """
+    def __init__(self, app=None, broker=None):
         self.user_id_callback = self.default_user_id
+        self.authorize_channel_callback = None
         self.sock = None
-        self.clients = {}
+        self.clients = ClientRegistry()
+        self.dropped = {policy: 0 for policy in OVERFLOW_POLICIES}
+        self.dropped_lock = threading.Lock()
+        self.broker = broker or LocalBroker()
+        self.broker.subscribe(self._deliver)
+        self.coalescer = None
+        self.max_frame_size = 0
+        self.ping_interval = None
+        self.ping_timeout = None
+        self.idle_timeout = None
+        self.reap_interval = 5
+        self.reaper = None
+        self.reaped = 0
+        self.suppressed = 0
+        self.dedup_size = 256
+        self.fragments = FragmentCache()
+        self.prefetched = FragmentCache(ttl=10)
+        self.replay = None
+        self.resume_failures = 0
+        self.metrics = None
+        self.max_connections = 0
+        self.max_user_connections = 0
+        self.connection_limit_policy = 'reject'
+        self.connect_rate = 0
+        self.connect_burst = 0
+        self.connect_tokens = 0
+        self.connect_refill = None
+        self.connection_count = 0
+        self.reserved = {}
+        self.rejected = 0
+        self.admission_lock = threading.Lock()
+        self.send_timeout = None
+        self.drain_window = 10
+        self.draining = False
+        self.script = None
+        self.local = threading.local()
+        self.scheduler = Scheduler()
+        self.schedule_jitter = 0.1
+        self.hooks = {'connect': [], 'disconnect': [], 'push': [],
+                      'send_error': []}
         if app:
             self.init_app(app)
 
     def init_app(self, app):
         ws_route = app.config.setdefault('TURBO_WEBSOCKET_ROUTE',
                                          '/turbo-stream')
+        app.config.setdefault('TURBO_PUSH_QUEUE_SIZE', 0)
+        app.config.setdefault('TURBO_PUSH_QUEUE_OVERFLOW', 'drop_oldest')
+        app.config.setdefault('TURBO_WEBSOCKET_COMPRESSION', True)
+        app.config.setdefault('TURBO_COMPRESSION_MIN_SIZE', 1024)
+        app.config.setdefault('TURBO_COMPRESSION_LEVEL', -1)
+        coalesce_window = app.config.setdefault(
+            'TURBO_PUSH_COALESCE_WINDOW', 0)
+        if coalesce_window:
+            self.coalescer = Coalescer(coalesce_window, self._send)
+        self.max_frame_size = app.config.setdefault('TURBO_MAX_FRAME_SIZE', 0)
+        self.ping_interval = app.config.setdefault('TURBO_PING_INTERVAL', None)
+        self.ping_timeout = app.config.setdefault('TURBO_PING_TIMEOUT', None)
+        self.idle_timeout = app.config.setdefault('TURBO_IDLE_TIMEOUT', None)
+        if self.idle_timeout and not self.ping_interval:
+            # turbo.js does not send data on the connection, so clients are
+            # only seen to be active when they answer pings
+            raise ValueError('TURBO_IDLE_TIMEOUT requires '
+                             'TURBO_PING_INTERVAL')
+        self.reap_interval = app.config.setdefault('TURBO_REAP_INTERVAL', 5)
+        self.dedup_size = app.config.setdefault('TURBO_DEDUP_SIZE', 256)
+        self.send_timeout = app.config.setdefault('TURBO_SEND_TIMEOUT', None)
+        self.drain_window = app.config.setdefault('TURBO_DRAIN_WINDOW', 10)
+        self.fragments.max_size = app.config.setdefault(
+            'TURBO_FRAGMENT_CACHE_SIZE', 256)
+        self.fragments.ttl = app.config.setdefault(
+            'TURBO_FRAGMENT_CACHE_TTL', None)
+        app.config.setdefault('TURBO_PREFETCH', True)
+        self.prefetched.max_size = app.config.setdefault(
+            'TURBO_PREFETCH_CACHE_SIZE', 256)
+        self.prefetched.ttl = app.config.setdefault(
+            'TURBO_PREFETCH_CACHE_TTL', 10)
+        sse_route = app.config.setdefault('TURBO_SSE_ROUTE', None)
+        app.config.setdefault('TURBO_SSE_KEEPALIVE', 15)
+        replay_size = app.config.setdefault('TURBO_REPLAY_SIZE', 0)
+        replay_max_age = app.config.setdefault('TURBO_REPLAY_MAX_AGE', None)
+        if replay_size:
+            self.replay = ReplayBuffer(replay_size, max_age=replay_max_age)
+        self.max_connections = app.config.setdefault(
+            'TURBO_MAX_CONNECTIONS', 0)
+        self.max_user_connections = app.config.setdefault(
+            'TURBO_MAX_USER_CONNECTIONS', 0)
+        self.connection_limit_policy = app.config.setdefault(
+            'TURBO_CONNECTION_LIMIT_POLICY', 'reject')
+        if self.connection_limit_policy not in CONNECTION_LIMIT_POLICIES:
+            raise ValueError('Invalid connection limit policy: '
+                             f'{self.connection_limit_policy}')
+        self.connect_rate = app.config.setdefault('TURBO_CONNECT_RATE', 0)
+        self.connect_burst = app.config.setdefault(
+            'TURBO_CONNECT_BURST', None) or max(self.connect_rate, 1)
+        self.connect_tokens = self.connect_burst
+        self.schedule_jitter = app.config.setdefault(
+            'TURBO_SCHEDULE_JITTER', 0.1)
+        script_file = app.config.setdefault('TURBO_JS_FILE', None)
+        script_route = app.config.setdefault('TURBO_JS_ROUTE', '/turbo-js')
+        app.config.setdefault('TURBO_JS_PRELOAD', False)
+        metrics_route = app.config.setdefault('TURBO_METRICS_ROUTE', None)
+        if app.config.setdefault('TURBO_METRICS', False) or metrics_route:
+            self._init_metrics(app, metrics_route)
         if ws_route:
-            self.sock = Sock()
-
-            @self.sock.route(ws_route)
-            def turbo_stream(ws):
-                user_id = self.user_id_callback()
-                if user_id not in self.clients:
-                    self.clients[user_id] = []
-                self.clients[user_id].append(ws)
-                try:
-                    while True:
-                        ws.receive(timeout=10)
-                except (BrokenPipeError, ConnectionClosed):
-                    self.clients[user_id].remove(ws)
-                    if not self.clients[user_id]:
-                        del self.clients[user_id]
-
-            self.sock.init_app(app)
+            self._init_websocket(app, ws_route)
+        if sse_route:
+            self._init_sse(app, sse_route)
+        if script_file:
+            self._init_script(app, script_file, script_route)
         app.context_processor(self.context_processor)
+        app.teardown_request(self._flush_batches)
+        app.before_request(self._start_scheduler)
+        self.scheduler.app = app
+        self._start_scheduler()
+
+    def _init_websocket(self, app, ws_route):
+        self.sock = Sock()
+
+        @self.sock.route(ws_route)
+        def turbo_stream(ws):
+            user_id = self.user_id_callback()
+            config = current_app.config
+            conn = Connection(
+                ws, queue_size=config['TURBO_PUSH_QUEUE_SIZE'],
+                overflow=config['TURBO_PUSH_QUEUE_OVERFLOW'],
+                on_drop=self._count_dropped,
+                compression=config['TURBO_WEBSOCKET_COMPRESSION'],
+                compression_min_size=config['TURBO_COMPRESSION_MIN_SIZE'],
+                compression_level=config['TURBO_COMPRESSION_LEVEL'],
+                user_id=user_id, dedup_size=self.dedup_size)
+            last_event_id = request.args.get('last_event_id')
+            if last_event_id and self.replay is not None:
+                conn.hold()
+            close_code = self._admit(user_id)
+            if close_code:
+                ws.close(reason=close_code)
+                return
+            try:
+                self._register(user_id, conn,
+                               request.args.getlist('channel'),
+                               reserved=True)
+                if last_event_id and self.replay is not None:
+                    self._resume(conn, last_event_id)
+                while not conn.closed:
+                    if conn.queue is None:
+                        data = ws.receive(timeout=10)
+                    elif conn.flush(timeout=10):
+                        data = ws.receive(timeout=0)
+                    else:
+                        break
+                    if data is not None:
+                        conn.touch()
+            except (OSError, ConnectionClosed):
+                pass
+            finally:
+                conn.close()
+                self._unregister(user_id, conn)
+
+        self.sock.init_app(app)
+
+    def _init_sse(self, app, sse_route):
+        def turbo_sse():
+            user_id = self.user_id_callback()
+            config = current_app.config
+            conn = SSEConnection(
+                queue_size=config['TURBO_PUSH_QUEUE_SIZE'],
+                overflow=config['TURBO_PUSH_QUEUE_OVERFLOW'],
+                on_drop=self._count_dropped, user_id=user_id,
+                dedup_size=self.dedup_size)
+            if self._admit(user_id):
+                # ask the client to try again later, since EventSource does
+                # not reconnect after an error response
+                return current_app.response_class(
+                    'retry: 5000\n\n', mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
+            channels = request.args.getlist('channel')
+            last_event_id = request.headers.get('Last-Event-ID')
+            keepalive = config['TURBO_SSE_KEEPALIVE']
+
+            def release():
+                conn.close()
+                self._unregister(user_id, conn)
+
+            try:
+                self._register(user_id, conn, channels, reserved=True)
+                if last_event_id and self.replay is not None:
+                    self._resume(conn, last_event_id)
+            except Exception:
+                release()
+                raise
+
+            def events():
+                # send the response headers right away
+                yield ': connected\n\n'
+                while True:
+                    events = conn.events(timeout=keepalive)
+                    if events is None:
+                        if conn.close_code == 1012:
+                            # the server is restarting, so spread the
+                            # reconnections of the clients
+                            yield f'retry: {random.randint(500, 5000)}\n\n'
+                        break
+                    # a comment is sent when there are no events, to detect
+                    # clients that went away
+                    yield events or ': keepalive\n\n'
+
+            response = current_app.response_class(
+                events(), mimetype='text/event-stream',
+                headers={'Cache-Control': 'no-cache',
+                         'X-Accel-Buffering': 'no'})
+            # the body is not iterated for HEAD requests, so the connection
+            # is released when the server closes the response
+            response.call_on_close(release)
+            return response
+
+        app.add_url_rule(sse_route, 'turbo_sse', turbo_sse)
+
+    def _init_script(self, app, script_file, script_route):
+        self.script = ScriptAsset(os.path.join(app.root_path, script_file))
+
+        def turbo_js(filename):
+            response = self.script.response(filename)
+            if response is None:
+                abort(404)
+            return response
+
+        app.add_url_rule(f'{script_route}/<filename>', 'turbo_js', turbo_js)
+
+    def _init_metrics(self, app, metrics_route):
+        if self.metrics is None:
+            self.metrics = Metrics()
+            collect = self.metrics.collect
+            collect('turbo_connections', 'gauge',
+                    lambda: len(self.clients.connections()))
+            collect('turbo_users', 'gauge', lambda: len(self.clients))
+            for policy in OVERFLOW_POLICIES:
+                collect(f'turbo_dropped_total{{policy="{policy}"}}',
+                        'counter', lambda policy=policy: self.dropped[policy])
+            collect('turbo_suppressed_total', 'counter',
+                    lambda: self.suppressed)
+            collect('turbo_reaped_total', 'counter', lambda: self.reaped)
+            collect('turbo_resume_failures_total', 'counter',
+                    lambda: self.resume_failures)
+            collect('turbo_rejected_total', 'counter', lambda: self.rejected)
+        if metrics_route:
+            def turbo_metrics():
+                return current_app.response_class(
+                    self.metrics.render(),
+                    mimetype='text/plain; version=0.0.4')
+
+            app.add_url_rule(metrics_route, 'turbo_metrics', turbo_metrics)
+
+    def _resume(self, conn, last_event_id):
+        missed = self.replay.since(last_event_id, conn.user_id,
+                                   self.clients.subscriptions(conn))
+        if missed is None:
+            # some updates are lost, so the page must be loaded again
+            self.resume_failures += 1
+            missed = [Message(make_stream('refresh'))]
+        conn.replay(missed)
+
+    def _admit(self, user_id):
+        # decide if a new connection for the given user can be accepted,
+        # returning None, or the WebSocket close code to reject it with. An
+        # accepted connection is counted right away, so that concurrent
+        # connections cannot exceed the limits, and must be registered with
+        # reserved=True or released with _release()
+        evicted = []
+        with self.admission_lock:
+            if self.draining:
+                return 1012
+            if self.connect_rate:
+                now = time.monotonic()
+                if self.connect_refill is not None:
+                    self.connect_tokens = min(
+                        self.connect_burst, self.connect_tokens +
+                        (now - self.connect_refill) * self.connect_rate)
+                self.connect_refill = now
+                if self.connect_tokens < 1:
+                    self.rejected += 1
+                    return 1013
+                self.connect_tokens -= 1
+            evict = self.connection_limit_policy == 'evict_oldest'
+            if self.max_user_connections:
+                connections = self.clients.get(user_id)
+                excess = len(connections) + self.reserved.get(user_id, 0) - \
+                    self.max_user_connections + 1
+                if excess > 0:
+                    if not evict:
+                        self.rejected += 1
+                        return 1008
+                    evicted += self._oldest(connections, excess)
+            if self.max_connections:
+                excess = self.connection_count - len(evicted) - \
+                    self.max_connections + 1
+                if excess > 0:
+                    if not evict:
+                        self.rejected += 1
+                        return 1008
+                    evicted += self._oldest(
+                        [conn for conn in self.clients.connections()
+                         if conn not in evicted], excess)
+            self.connection_count += 1
+            self.reserved[user_id] = self.reserved.get(user_id, 0) + 1
+        for conn in evicted:
+            conn.evict(1008)
+            self._unregister(conn.user_id, conn)
+        return None
+
+    @staticmethod
+    def _oldest(connections, count):
+        connections = [conn for conn in connections
+                       if isinstance(conn, Connection)]
+        return sorted(connections, key=lambda conn: conn.created)[:count]
 
-    def turbo(self, version=_VER, url=None):
+    def _release(self, user_id, count=True):
+        # give back a connection slot reserved by _admit()
+        with self.admission_lock:
+            self.reserved[user_id] -= 1
+            if not self.reserved[user_id]:
+                del self.reserved[user_id]
+            if count:
+                self.connection_count -= 1
+
+    def _register(self, user_id, conn, channels=(), reserved=False):
+        if reserved:
+            # the connection takes the slot that was reserved for it
+            self._release(user_id, count=False)
+        else:
+            with self.admission_lock:
+                self.connection_count += 1
+        if isinstance(conn, Connection):
+            conn.user_id = user_id
+            conn.registered = True
+        if self.reaper is None and (self.ping_interval or self.idle_timeout):
+            self.reaper = threading.Thread(target=self._reaper_thread)
+            self.reaper.daemon = True
+            self.reaper.start()
+        if self.clients.add(user_id, conn):
+            self.broker.connected(user_id)
+        if self.metrics is not None:
+            self.metrics.inc('turbo_connections_total')
+        for hook in self.hooks['connect']:
+            hook(user_id, conn)
+        for channel in channels:
+            # channels requested by the client are only allowed when the
+            # application can authorize them
+            if self.authorize_channel_callback is not None and \
+                    self.authorize_channel_callback(channel):
+                if self.clients.subscribe(channel, conn):
+                    self.broker.subscribed(channel)
+
+    def _unregister(self, user_id, conn):
+        if isinstance(conn, Connection):
+            with conn.cv:
+                if not conn.registered:
+                    return
+                conn.registered = False
+        for channel in self.clients.subscriptions(conn):
+            if self.clients.unsubscribe(channel, conn):
+                self.broker.unsubscribed(channel)
+        with self.admission_lock:
+            self.connection_count -= 1
+        if self.clients.remove(user_id, conn):
+            self.broker.disconnected(user_id)
+        if self.metrics is not None:
+            self.metrics.inc('turbo_disconnections_total')
+            if isinstance(conn, Connection):
+                self.metrics.observe('turbo_connection_duration_seconds',
+                                     time.monotonic() - conn.created)
+        for hook in self.hooks['disconnect']:
+            hook(user_id, conn)
+
+    def _reaper_thread(self):
+        while True:
+            time.sleep(self.reap_interval)
+            self.reap()
+
+    def reap(self):
+        """Evict connections that are closed, that did not answer a ping in
+        time, or that were idle for longer than allowed.
+
+        This method runs periodically in a background thread when the
+        ``TURBO_PING_INTERVAL`` or ``TURBO_IDLE_TIMEOUT`` configuration
+        variables are set, but it can also be invoked directly.
+
+        Returns the number of connections that were evicted. The total number
+        of evicted connections is available in the ``reaped`` attribute.
+        """
+        now = time.monotonic()
+        count = 0
+        for conn in self.clients.connections():
+            if not isinstance(conn, Connection):
+                continue
+            alive = conn.is_alive()
+            if alive and self.ping_interval:
+                alive = conn.heartbeat(self.ping_interval,
+                                       self.ping_timeout or self.ping_interval,
+                                       now=now)
+            if alive and self.idle_timeout and conn.pingable:
+                alive = now - conn.last_seen <= self.idle_timeout
+            if not alive:
+                conn.evict()
+                self._unregister(conn.user_id, conn)
+                count += 1
+        with self.dropped_lock:
+            self.reaped += count
+        return count
+
+    def drain(self, window=None):
+        """Close all the connections of this process before a restart.
+
+        :param window: the time, in seconds, over which the connections are
+                       closed. The default is the ``TURBO_DRAIN_WINDOW``
+                       configuration variable.
+
+        New connections are rejected from the moment this method is called.
+        Each existing connection is then closed at a random time within the
+        window, with the WebSocket close code 1012, which asks the client to
+        reconnect. Spreading the closures prevents all the clients from
+        reconnecting to the remaining server processes at the same time.
+        Server-Sent Events clients are told to reconnect after a short random
+        delay.
+
+        This method blocks until all the connections are closed, and returns
+        the number of connections that were closed.
+        """
+        if window is None:
+            window = self.drain_window
+        with self.admission_lock:
+            self.draining = True
+        connections = [conn for conn in self.clients.connections()
+                       if isinstance(conn, Connection)]
+        schedule = sorted(((random.uniform(0, window), conn)
+                           for conn in connections), key=lambda item: item[0])
+        start = time.monotonic()
+        for delay, conn in schedule:
+            time.sleep(max(start + delay - time.monotonic(), 0))
+            conn.evict(1012)
+            self._unregister(conn.user_id, conn)
+        return len(connections)
+
+    def turbo(self, version=_VER, url=None, channels=None):
         """Add turbo.js to the page.
 
         This method is accessible in template files as ``turbo``. You must add
@@ -49,21 +505,79 @@ class Turbo:
 
         :param version: the version of turbo.js to load.
         :param url: The URL for the turbo.js library, or ``None`` to use the
-                    default version and CDN.
+                    file set in the ``TURBO_JS_FILE`` configuration variable,
+                    or if that is not set, the default version and CDN.
+        :param channels: a list of channels to subscribe to when the
+                         WebSocket or Server-Sent Events connection is
+                         established.
         """
-        if url is None:
+        if url is None and self.script is not None:
+            url = url_for('turbo_js', filename=self.script.hashed_name)
+        elif url is None:
             v = ''
             if version is not None:
                 v = f'@{version}'
             url = f'{_CDN}/npm/{_PKG}{v}/dist/turbo.es2017-umd.js'
+        sse_route = current_app.config.get('TURBO_SSE_ROUTE')
         ws_route = current_app.config.get('TURBO_WEBSOCKET_ROUTE',
                                           '/turbo-stream')
-        if ws_route:
-            return Markup(f'''<script src="{url}"></script>
-<script>Turbo.connectStreamSource(new WebSocket(`ws${{location.protocol.substring(4)}}//${{location.host}}{ws_route}`));</script>
+        hint = ''
+        if not current_app.config.get('TURBO_PREFETCH', True):
+            hint = '<meta name="turbo-prefetch" content="false">\n'
+        if current_app.config.get('TURBO_JS_PRELOAD'):
+            if sse_route or ws_route:
+                hint += f'<link rel="preload" href="{url}" as="script">\n'
+            else:
+                hint += f'<link rel="modulepreload" href="{url}">\n'
+        if sse_route:
+            if channels:
+                sse_route += '?' + urlencode([('channel', channel)
+                                              for channel in channels])
+            return Markup(f'''{hint}<script src="{url}"></script>
+<script>Turbo.connectStreamSource(new EventSource("{sse_route}"));</script>
+''')
+        elif ws_route:
+            if channels:
+                ws_route += '?' + urlencode([('channel', channel)
+                                             for channel in channels])
+            # reconnect when the connection ends, unless it was rejected,
+            # after a random delay that grows with each failed attempt, so
+            # that clients do not all reconnect at once
+            resume = ''
+            if self.replay is not None:
+                # report the id of the last update received so that missed
+                # updates are sent
+                separator = '&' if channels else '?'
+                resume = f'''
+    if (lastEventId) url += `{separator}last_event_id=${{encodeURIComponent(lastEventId)}}`;'''  # noqa: E501
+            return Markup(f'''{hint}<script src="{url}"></script>
+<script>(() => {{
+  const source = new EventTarget();
+  let lastEventId = null;
+  let attempt = 0;
+  const connect = () => {{
+    const started = Date.now();
+    let url = `ws${{location.protocol.substring(4)}}//${{location.host}}{ws_route}`;{resume}
+    const ws = new WebSocket(url);
+    ws.addEventListener('message', (event) => {{
+      const match = /^<!--turbo-id:([^>]*)-->/.exec(event.data);
+      if (match) lastEventId = match[1];
+      source.dispatchEvent(new MessageEvent('message', {{data: event.data}}));
+    }});
+    ws.addEventListener('close', (event) => {{
+      // 1008 means that the server does not accept more connections
+      if (event.code === 1008) return;
+      if (Date.now() - started > 30000) attempt = 0;
+      const delay = Math.min({_RECONNECT_MAX_DELAY}, {_RECONNECT_DELAY} * 2 ** attempt++);
+      setTimeout(connect, delay / 2 + Math.random() * delay / 2);
+    }});
+  }};
+  Turbo.connectStreamSource(source);
+  connect();
+}})();</script>
 ''')  # noqa: E501
         else:
-            return Markup(f'<script type="module" src="{url}"></script>')
+            return Markup(f'{hint}<script type="module" src="{url}"></script>')
 
     def user_id(self, f):
         """Configure an application-specific user id generator, to allow the
@@ -78,41 +592,234 @@ class Turbo:
         self.user_id_callback = f
         return f
 
+    def authorize_channel(self, f):
+        """Configure a function that decides if the client can subscribe
+        to a channel requested when the WebSocket connection is established.
+        The function receives the channel name as an argument and must return
+        ``True`` to allow the subscription. If this function is not
+        configured, all the channels requested by clients are denied, and
+        clients can only be subscribed by the application with
+        :func:`subscribe`.
+
+        Example::
+
+            @turbo.authorize_channel
+            def authorize_channel(channel):
+                return channel in current_user.channels
+        """
+        self.authorize_channel_callback = f
+        return f
+
+    def on_connect(self, f):
+        """Register a function that is called when a client connects. The
+        function receives the user id and the connection object.
+
+        Example::
+
+            @turbo.on_connect
+            def connected(user_id, conn):
+                app.logger.info('%s connected', user_id)
+        """
+        self.hooks['connect'].append(f)
+        return f
+
+    def on_disconnect(self, f):
+        """Register a function that is called when a client disconnects. The
+        function receives the user id and the connection object."""
+        self.hooks['disconnect'].append(f)
+        return f
+
+    def on_push(self, f):
+        """Register a function that is called when an update is pushed. The
+        function receives the list of streams, and the list of recipients and
+        the list of channels given to :func:`push`, which are ``None`` when
+        not given."""
+        self.hooks['push'].append(f)
+        return f
+
+    def on_send_error(self, f):
+        """Register a function that is called when an update cannot be sent
+        to a client. The function receives the connection object and the
+        exception."""
+        self.hooks['send_error'].append(f)
+        return f
+
     def default_user_id(self):
         """Default user id generator. An application-specific function can be
         configured with the ``@user_id`` decorator."""
         return uuid.uuid4().hex
 
+    @property
+    def clients(self):
+        """The registry of connected clients, indexed by user id."""
+        return self._clients
+
+    @clients.setter
+    def clients(self, clients):
+        if not isinstance(clients, ClientRegistry):
+            clients = ClientRegistry(clients)
+        self._clients = clients
+
+    def _count_dropped(self, policy, count):
+        with self.dropped_lock:
+            self.dropped[policy] += count
+
     def context_processor(self):
+        if has_request_context():
+            return {'turbo': self.turbo, 'turbo_request': self.current_request}
         return {'turbo': self.turbo}
 
+    @property
+    def current_request(self):
+        """The :class:`~turbo_flask.context.TurboRequest` object of the
+        current request, which is created on first use."""
+        turbo_request = request.environ.get('turbo_flask.request')
+        if turbo_request is None:
+            turbo_request = request.environ['turbo_flask.request'] = \
+                TurboRequest(request)
+        return turbo_request
+
     def requested_frame(self):
         """Returns the target frame the client expects, or ``None``."""
-        return request.headers.get('Turbo-Frame')
+        return self.current_request.frame
+
+    def render_frame(self, template_name, frames=None, **context):
+        """Render a page template, or only the part of it that renders the
+        requested frame.
+
+        :param template_name: the name of the template to render.
+        :param frames: a dictionary that maps frame ids to the names of the
+                       blocks that render them. For frames that are not in
+                       this dictionary, the block name is the frame id with
+                       dashes replaced by underscores.
+        :param context: the variables to pass to the template.
+
+        When the request was made by a ``<turbo-frame>`` element and the
+        template defines a block for it, only this block is rendered. The
+        block must include the ``<turbo-frame>`` element. In all other cases
+        the complete template is rendered. This method returns a response
+        with a ``Vary: Turbo-Frame`` header, so that caches keep the page and
+        the frame responses separate.
+
+        Example template::
+
+            {% extends "base.html" %}
+            {% block content %}
+              <h1>{{ title }}</h1>
+              {% block todo_list %}
+                <turbo-frame id="todo-list">...</turbo-frame>
+              {% endblock %}
+            {% endblock %}
+        """
+        frame = self.requested_frame()
+        html = None
+        if frame:
+            block = (frames or {}).get(frame, frame.replace('-', '_'))
+            app = current_app._get_current_object()
+            template = app.jinja_env.get_or_select_template(template_name)
+            render_block = template.blocks.get(block)
+            if render_block is not None:
+                app.update_template_context(context)
+                html = ''.join(render_block(template.new_context(context)))
+        if html is None:
+            html = render_template(template_name, **context)
+        response = current_app.make_response(html)
+        response.vary.add('Turbo-Frame')
+        return response
 
     def can_stream(self):
         """Returns ``True`` if the client accepts turbo stream reponses."""
-        stream_mimetype = 'text/vnd.turbo-stream.html'
-        best = request.accept_mimetypes.best_match([
-            stream_mimetype, 'text/html'])
-        return best == stream_mimetype
+        return self.current_request.can_stream
+
+    def prefetch_cache(self, f):
+        """Cache the responses of a view to prefetch requests.
+
+        turbo.js 8 prefetches links when the user hovers over them, so a
+        page can be requested many times without being visited. Responses
+        to prefetch requests of views decorated with this decorator are
+        cached for each URL, user and frame, for the number of seconds set
+        in the ``TURBO_PREFETCH_CACHE_TTL`` configuration variable. Users
+        are identified by their cookies, and also by the ``@user_id``
+        function if one is configured. Responses that modify the session or
+        set cookies are not cached. Other requests are not affected.
+
+        Example::
+
+            @app.route('/todos/<id>')
+            @turbo.prefetch_cache
+            def todo(id):
+                return render_template('todo.html', todo=get_todo(id))
+        """
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if not self.current_request.is_prefetch:
+                return f(*args, **kwargs)
+            user = None
+            if self.user_id_callback != self.default_user_id:
+                user = self.user_id_callback()
+            # the cookies are always part of the key, because the user id
+            # function can return the same id for all anonymous visitors
+            key = (request.full_path, user, request.headers.get('Cookie'),
+                   self.current_request.frame)
+            cached = self.prefetched.get(request.endpoint, key)
+            if cached is not None:
+                data, status, headers = cached
+                return current_app.response_class(data, status, headers)
+            response = current_app.make_response(f(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed \
+                    and not session.modified \
+                    and 'Set-Cookie' not in response.headers:
+                self.prefetched.set(request.endpoint, key, (
+                    response.get_data(), response.status,
+                    list(response.headers.items())))
+            return response
+
+        return decorated
+
+    def subscribe(self, channel, to):
+        """Subscribe the connections of a client to a channel.
+
+        :param channel: the name of the channel.
+        :param to: the id of the client.
+
+        Only connections to the current server process are subscribed.
+        """
+        for conn in self.clients.get(to):
+            if self.clients.subscribe(channel, conn):
+                self.broker.subscribed(channel)
+
+    def unsubscribe(self, channel, to):
+        """Unsubscribe the connections of a client from a channel.
+
+        :param channel: the name of the channel.
+        :param to: the id of the client.
+        """
+        for conn in self.clients.get(to):
+            if self.clients.unsubscribe(channel, conn):
+                self.broker.unsubscribed(channel)
 
-    def can_push(self, to=None):
+    def can_push(self, to=None, channel=None):
         """Returns ``True`` if the client accepts turbo stream updates over
         WebSocket.
 
         :param to: the id of the client. If not given then the answer
                    is ``True`` if there is at least one client listening to
                    updates over WebSocket.
+        :param channel: the name of a channel. If given, the answer is
+                        ``True`` if the channel has at least one subscriber.
+
+        Clients connected to other server processes are also considered when
+        a broker that supports multiple processes is used.
         """
+        if channel is not None:
+            return self.clients.has_subscribers(channel) or \
+                self.broker.can_push(channel=channel)
         if to is None:
-            return self.clients != {}
-        return to in self.clients
+            return bool(self.clients) or self.broker.can_push()
+        return to in self.clients or self.broker.can_push(to)
 
-    def _make_stream(self, action, content, target, multiple):
-        return (f'<turbo-stream action="{action}" '
-                f'{"targets" if multiple else "target"}="{target}">'
-                f'<template>{content}</template></turbo-stream>')
+    def _make_stream(self, action, content, target, multiple, method=None):
+        return _make_target_stream(action, content, target, multiple, method)
 
     def append(self, content, target, multiple=False):
         """Create an append stream.
@@ -134,25 +841,31 @@ class Turbo:
         """
         return self._make_stream('prepend', content, target, multiple)
 
-    def replace(self, content, target, multiple=False):
+    def replace(self, content, target, multiple=False, method=None):
         """Create a replace stream.
 
         :param content: the HTML content to include in the stream.
         :param target: the target ID or CSS query selector for this change.
         :param multiple: set to ``True`` when ``target`` references multiple
                          elements.
+        :param method: set to ``'morph'`` to ask turbo.js 8 to morph the
+                       target instead of replacing it.
         """
-        return self._make_stream('replace', content, target, multiple)
+        return self._make_stream('replace', content, target, multiple,
+                                 method=method)
 
-    def update(self, content, target, multiple=False):
+    def update(self, content, target, multiple=False, method=None):
         """Create an update stream.
 
         :param content: the HTML content to include in the stream.
         :param target: the target ID or CSS query selector for this change.
         :param multiple: set to ``True`` when ``target`` references multiple
                          elements.
+        :param method: set to ``'morph'`` to ask turbo.js 8 to morph the
+                       contents of the target instead of replacing them.
         """
-        return self._make_stream('update', content, target, multiple)
+        return self._make_stream('update', content, target, multiple,
+                                 method=method)
 
     def remove(self, target, multiple=False):
         """Create a remove stream.
@@ -183,17 +896,188 @@ class Turbo:
         """
         return self._make_stream('before', content, target, multiple)
 
-    def stream(self, stream):
+    def refresh(self, request_id=None):
+        """Create a refresh stream, which asks turbo.js 8 to reload the page.
+
+        :param request_id: the id of the request that caused the refresh.
+                           Clients ignore refreshes that carry the id of a
+                           request they made.
+        """
+        return make_stream('refresh', request_id=request_id)
+
+    def builder(self):
+        """Create a :class:`StreamBuilder` object, which collects many
+        streams and joins them once."""
+        return StreamBuilder()
+
+    def render_fragment(self, template_name, cache_key=None, tags=None,
+                        **context):
+        """Render a template fragment, using the fragment cache.
+
+        :param template_name: the name of the template to render.
+        :param cache_key: a key that identifies the rendered fragment among
+                          all the renderings of this template. If not given,
+                          the fragment is rendered and not cached.
+        :param tags: a tag or list of tags for the cached fragment, which can
+                     be given to the ``invalidate()`` method of the
+                     ``fragments`` attribute to remove related fragments from
+                     the cache.
+        :param context: the variables to pass to the template.
+
+        Example::
+
+            html = turbo.render_fragment('_todo.html', cache_key=todo.id,
+                                         tags=['todos'], todo=todo)
+
+            # when the todo changes
+            turbo.fragments.invalidate(key=todo.id)
+        """
+        if cache_key is None:
+            return render_template(template_name, **context)
+        return self.fragments.render(
+            template_name, cache_key,
+            lambda: render_template(template_name, **context), tags=tags)
+
+    def _make_template_stream(self, action, template_name, target, multiple,
+                              cache_key, tags, context):
+        return self._make_stream(action, self.render_fragment(
+            template_name, cache_key=cache_key, tags=tags, **context),
+            target, multiple)
+
+    def append_template(self, template_name, target, multiple=False,
+                        cache_key=None, tags=None, **context):
+        """Create an append stream from a template fragment.
+
+        :param template_name: the name of the template to render.
+        :param target: the target ID or CSS query selector for this change.
+        :param multiple: set to ``True`` when ``target`` references multiple
+                         elements.
+        :param cache_key: the cache key for the rendered fragment, as accepted
+                          by :func:`render_fragment`.
+        :param tags: the tags for the rendered fragment.
+        :param context: the variables to pass to the template.
+        """
+        return self._make_template_stream('append', template_name, target,
+                                          multiple, cache_key, tags, context)
+
+    def prepend_template(self, template_name, target, multiple=False,
+                         cache_key=None, tags=None, **context):
+        """Create a prepend stream from a template fragment.
+
+        The arguments are the same as in :func:`append_template`.
+        """
+        return self._make_template_stream('prepend', template_name, target,
+                                          multiple, cache_key, tags, context)
+
+    def replace_template(self, template_name, target, multiple=False,
+                         cache_key=None, tags=None, **context):
+        """Create a replace stream from a template fragment.
+
+        The arguments are the same as in :func:`append_template`.
+        """
+        return self._make_template_stream('replace', template_name, target,
+                                          multiple, cache_key, tags, context)
+
+    def update_template(self, template_name, target, multiple=False,
+                        cache_key=None, tags=None, **context):
+        """Create an update stream from a template fragment.
+
+        The arguments are the same as in :func:`append_template`.
+        """
+        return self._make_template_stream('update', template_name, target,
+                                          multiple, cache_key, tags, context)
+
+    def after_template(self, template_name, target, multiple=False,
+                       cache_key=None, tags=None, **context):
+        """Create an after stream from a template fragment.
+
+        The arguments are the same as in :func:`append_template`.
+        """
+        return self._make_template_stream('after', template_name, target,
+                                          multiple, cache_key, tags, context)
+
+    def before_template(self, template_name, target, multiple=False,
+                        cache_key=None, tags=None, **context):
+        """Create a before stream from a template fragment.
+
+        The arguments are the same as in :func:`append_template`.
+        """
+        return self._make_template_stream('before', template_name, target,
+                                          multiple, cache_key, tags, context)
+
+    def stream(self, stream, buffer_size=0):
         """Create a turbo stream response.
 
         :param stream: one or a list of streamed responses generated by the
                        ``append()``, ``prepend()``, ``replace()``, ``update()``
-                       and ``remove()`` methods.
+                       and ``remove()`` methods, or a :class:`StreamBuilder`
+                       object. This argument can also be a generator or
+                       iterator that produces streams, in which case the
+                       response is sent in chunks as the streams are
+                       produced.
+        :param buffer_size: when ``stream`` is a generator, the number of
+                            bytes to collect before a chunk is sent. The
+                            default is ``0``, which sends each stream as soon
+                            as it is produced. The generator can produce
+                            ``None`` to send the collected streams
+                            immediately.
+
+        Example::
+
+            @app.route('/rows')
+            def rows():
+                def generate():
+                    for row in query_rows():
+                        yield turbo.append(
+                            render_template('_row.html', row=row), 'rows')
+
+                return turbo.stream(stream_with_context(generate()))
         """
+        if isinstance(stream, StreamBuilder):
+            stream = bytes(stream)
+        elif not isinstance(stream, (str, bytes, list, tuple)):
+            response = current_app.response_class(
+                self._stream_chunks(stream, buffer_size),
+                mimetype='text/vnd.turbo-stream.html')
+            # ask reverse proxies such as nginx not to buffer the response
+            response.headers['X-Accel-Buffering'] = 'no'
+            return response
         return current_app.response_class(
             stream, mimetype='text/vnd.turbo-stream.html')
 
-    def push(self, stream, to=None):
+    @staticmethod
+    def _stream_chunks(streams, buffer_size=0):
+        buffer = []
+        size = 0
+        try:
+            for stream in streams:
+                if stream is not None:
+                    if isinstance(stream, StreamBuilder):
+                        data = bytes(stream)
+                    elif isinstance(stream, str):
+                        data = stream.encode()
+                    else:
+                        data = stream
+                    if not buffer_size:
+                        yield data
+                        continue
+                    buffer.append(data)
+                    size += len(data)
+                    if size < buffer_size:
+                        continue
+                if buffer:
+                    yield b''.join(buffer)
+                    buffer = []
+                    size = 0
+            if buffer:
+                yield b''.join(buffer)
+        finally:
+            close = getattr(streams, 'close', None)
+            if close is not None:
+                close()
+
+    def push(self, stream, to=None, channel=None, coalesce=True,
+             dedup=False, timeout=None, report=False):
         """Push a turbo stream update over WebSocket to one or more clients.
 
         :param stream: one or a list of stream updates generated by the
@@ -202,16 +1086,302 @@ class Turbo:
         :param to: the id of the target client. Set to ``None`` to send to all
                    connected clients, or to a list of ids to target multiple
                    clients.
+        :param channel: the name of a channel, or a list of channel names, to
+                        send the update to the clients subscribed to them.
+                        This argument cannot be combined with ``to``.
+        :param coalesce: set to ``False`` to send the update immediately when
+                         the ``TURBO_PUSH_COALESCE_WINDOW`` configuration
+                         variable is set.
+        :param dedup: set to ``True`` to skip ``replace``, ``update`` and
+                      ``remove`` streams that are identical to the last
+                      stream sent to the same target on each connection.
+                      Each stream is sent in its own WebSocket message. The
+                      number of skipped streams is available in the
+                      ``turbo.suppressed`` attribute.
+        :param timeout: the maximum time to wait for the update to be written
+                        to each connection, in seconds. Connections that do
+                        not accept the update in time are closed. The default
+                        is the ``TURBO_SEND_TIMEOUT`` configuration variable.
+        :param report: set to ``True`` to return a
+                       :class:`~turbo_flask.report.DeliveryReport` with the
+                       results of sending the update to each connection of
+                       the current process. The update is sent immediately,
+                       even when coalescing is enabled.
+
+        When the ``TURBO_PUSH_QUEUE_SIZE`` configuration variable is set, the
+        update is added to the outbound queue of each connection and this
+        method returns without waiting for the update to be sent.
+
+        Connections that fail while the update is sent to them are closed and
+        removed right away.
         """
-        if to is None:
-            to = self.clients.keys()
-        elif not hasattr(to, '__len__') or isinstance(to, str):
-            to = [to]
-        if hasattr(stream, '__len__') and not isinstance(stream, str):
-            stream = ''.join(stream)
-        for recipient in to:
-            for ws in self.clients[recipient]:
-                try:
-                    ws.send(stream)
-                except (BrokenPipeError, ConnectionClosed):  # pragma: no cover
-                    pass
+        delivery_report = DeliveryReport() if report else None
+        self._publish(stream, to, channel, coalesce=coalesce, dedup=dedup,
+                      timeout=timeout, report=delivery_report)
+        return delivery_report
+
+    def _publish(self, stream, to=None, channel=None, coalesce=True,
+                 dedup=False, timeout=None, report=None, local=False):
+        if to is not None and channel is not None:
+            raise ValueError('Cannot push to clients and channels at once')
+        if to is not None:
+            if not hasattr(to, '__len__') or isinstance(to, str):
+                to = [to]
+            to = list(to)
+        if channel is not None:
+            if isinstance(channel, str):
+                channel = [channel]
+            channel = list(channel)
+        stream = [stream] if isinstance(stream, str) else list(stream)
+        for hook in self.hooks['push']:
+            hook(stream, to, channel)
+        options = {'dedup': True} if dedup else {}
+        if timeout is not None:
+            options['timeout'] = timeout
+        if local:
+            options['local'] = True
+        if report is not None:
+            # the local broker delivery runs in this thread, and adds its
+            # results to the report
+            start = time.perf_counter()
+            self.local.report = report
+            try:
+                self._send(stream, to, channel, **options)
+            finally:
+                self.local.report = None
+            report.elapsed = time.perf_counter() - start
+        elif self.coalescer is not None and coalesce:
+            self.coalescer.add(stream, to, channel, **options)
+        else:
+            self._send(stream, to, channel, **options)
+        return to, channel
+
+    def _send(self, streams, to, channel, **options):
+        if options.pop('local', False):
+            # each process delivers to its own clients
+            publish = self._deliver
+        else:
+            publish = self.broker.publish
+        if options.get('dedup'):
+            # streams are compared one by one on each connection
+            messages = streams
+        else:
+            messages = chunk_streams(streams, self.max_frame_size)
+        for message in messages:
+            publish(message, to, channel, **options)
+
+    def batch(self, to=None, channel=None):
+        """Create a batch of streams that are pushed together.
+
+        :param to: the recipients of the streams, as accepted by
+                   :func:`push`.
+        :param channel: the channel or channels for the streams, as accepted
+                        by :func:`push`.
+
+        The batch is pushed when its ``flush()`` method is called or when the
+        ``with`` block in which it is used ends. If the batch is created
+        while handling a request, any streams left in it are pushed when the
+        request ends, unless the request ends with an unhandled exception.
+        When the ``TURBO_MAX_FRAME_SIZE`` configuration variable is set, the
+        streams are split into WebSocket messages that do not exceed this
+        size.
+
+        Example::
+
+            with turbo.batch(to=user_id) as batch:
+                for todo in todos:
+                    batch.add(turbo.append(
+                        render_template('_todo.html', todo=todo), 'todos'))
+        """
+        batch = Batch(self, to=to, channel=channel)
+        if has_request_context():
+            g.setdefault('_turbo_batches', []).append(batch)
+        return batch
+
+    def every(self, interval, to=None, channel=None, jitter=None,
+              dedup=False):
+        """Decorator that pushes the stream returned by a function
+        periodically.
+
+        :param interval: the interval between updates, in seconds.
+        :param to: the recipients of the updates, as accepted by
+                   :func:`push`.
+        :param channel: the channel or channels for the updates, as accepted
+                        by :func:`push`.
+        :param jitter: the fraction of the interval by which each update can
+                       be randomly advanced or delayed, so that many periodic
+                       updates do not all run at the same time. The default
+                       is the ``TURBO_SCHEDULE_JITTER`` configuration
+                       variable.
+        :param dedup: set to ``True`` to skip updates that are identical to
+                      the last one sent to each connection.
+
+        The function runs in an application context, and is not called at
+        all when there are no clients to receive the update. If it returns
+        ``None``, nothing is pushed. Each server process runs the function
+        and sends the update to the clients connected to it.
+
+        Example::
+
+            @turbo.every(5, channel='stats')
+            def update_stats():
+                return turbo.replace(render_template('_stats.html'),
+                                     'stats')
+        """
+        if jitter is None:
+            jitter = self.schedule_jitter
+
+        def decorator(f):
+            def job():
+                if not self._has_recipients(to, channel, local=True):
+                    return
+                stream = f()
+                if stream is not None:
+                    self._publish(stream, to, channel, dedup=dedup,
+                                  local=True)
+
+            f.job = self.scheduler.every(interval, job, jitter=jitter)
+            return f
+
+        return decorator
+
+    def push_later(self, stream, delay, to=None, channel=None, coalesce=True,
+                   dedup=False, timeout=None):
+        """Push a turbo stream update to one or more clients after a delay.
+
+        :param stream: the stream update, or a function that returns it. A
+                       function is called in an application context when the
+                       update is due, and only if there are clients to
+                       receive it.
+        :param delay: the delay, in seconds.
+        :param to: the recipients of the update, as accepted by
+                   :func:`push`.
+        :param channel: the channel or channels for the update, as accepted
+                        by :func:`push`.
+        :param coalesce: see :func:`push`.
+        :param dedup: see :func:`push`.
+        :param timeout: see :func:`push`.
+
+        Returns a :class:`~turbo_flask.scheduler.Job` object, which has a
+        ``cancel()`` method.
+        """
+        def job():
+            if not self._has_recipients(to, channel):
+                return
+            data = stream() if callable(stream) else stream
+            if data is not None:
+                self._publish(data, to, channel, coalesce=coalesce,
+                              dedup=dedup, timeout=timeout)
+
+        return self.scheduler.call_later(delay, job)
+
+    def _start_scheduler(self):
+        # this also runs before each request, to start the scheduler in
+        # worker processes that were forked after it was started
+        if self.scheduler.heap:
+            self.scheduler.start()
+
+    def _has_recipients(self, to=None, channel=None, local=False):
+        if local:
+            def check(to=None, channel=None):
+                if channel is not None:
+                    return self.clients.has_subscribers(channel)
+                return bool(self.clients) if to is None else to in self.clients
+        else:
+            check = self.can_push
+        if channel is not None:
+            if isinstance(channel, str):
+                channel = [channel]
+            return any(check(channel=name) for name in channel)
+        if to is None or isinstance(to, str) or not hasattr(to, '__len__'):
+            return check(to)
+        return any(check(recipient) for recipient in to)
+
+    def _flush_batches(self, exc):
+        batches = g.pop('_turbo_batches', [])
+        if exc is None:
+            for batch in batches:
+                batch.flush()
+
+    def _connections(self, to=None, channel=None):
+        if channel is not None:
+            return list({conn: None for name in channel
+                         for conn in self.clients.subscribers(name)})
+        elif to is None:
+            return self.clients.connections()
+        return [conn for recipient in to
+                for conn in self.clients.get(recipient)]
+
+    def _deliver(self, stream, to, channel=None, dedup=False, timeout=None):
+        if self.metrics is not None:
+            start = time.perf_counter()
+        report = getattr(self.local, 'report', None)
+        if timeout is None:
+            timeout = self.send_timeout
+        connections = self._connections(to, channel)
+        stream = Message(stream)
+        if self.replay is not None:
+            self.replay.add(stream, to, channel)
+        key = False
+        suppressed = 0
+        sent = 0
+        failed = []
+        for conn in connections:
+            if isinstance(conn, Connection) and (dedup or conn.digests):
+                if key is False:
+                    key = stream_key(stream)
+                if self._is_duplicate(conn, stream, key, dedup):
+                    suppressed += 1
+                    if report is not None:
+                        report.add(conn, 'suppressed')
+                    continue
+            if report is not None:
+                sent_at = time.perf_counter()
+            try:
+                if timeout is None:
+                    status = conn.send(stream)
+                else:
+                    status = conn.send(stream, timeout=timeout)
+            except (OSError, ConnectionClosed) as exc:
+                failed.append(conn)
+                for hook in self.hooks['send_error']:
+                    hook(conn, exc)
+                if report is not None:
+                    report.add(conn, 'failed',
+                               time.perf_counter() - sent_at, exc)
+                continue
+            if not isinstance(status, str):
+                status = 'sent'
+            if status in ('sent', 'queued'):
+                sent += 1
+            if report is not None:
+                report.add(conn, status, time.perf_counter() - sent_at)
+        for conn in failed:
+            # remove broken connections without waiting for their handlers
+            # to notice
+            if isinstance(conn, Connection):
+                conn.abort()
+                self._unregister(conn.user_id, conn)
+        if suppressed:
+            with self.dropped_lock:
+                self.suppressed += suppressed
+        if self.metrics is not None:
+            errors = len(failed)
+            self.metrics.inc('turbo_pushes_total')
+            self.metrics.inc('turbo_messages_sent_total', sent)
+            self.metrics.inc('turbo_bytes_sent_total',
+                             sent * len(stream.payload))
+            if errors:
+                self.metrics.inc('turbo_send_errors_total', errors)
+            self.metrics.observe('turbo_push_duration_seconds',
+                                 time.perf_counter() - start)
+
+    @staticmethod
+    def _is_duplicate(conn, stream, key, dedup):
+        if key is None:
+            # the stream cannot be identified, so none of the recorded
+            # targets can be assumed to be unchanged
+            return conn.is_duplicate(None, None)
+        if dedup and key[0] in IDEMPOTENT_ACTIONS:
+            return conn.is_duplicate(key[1], stream.digest)
+        return conn.is_duplicate(key[1], None)
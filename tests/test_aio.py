@@ -0,0 +1,191 @@
+import asyncio
+import threading
+import unittest
+from unittest import mock
+from flask import Flask, request
+import turbo_flask
+
+
+class ASGIClient:
+    def __init__(self, asgi_app, path='/turbo-stream', query_string=b'',
+                 headers=None):
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+        self.scope = {
+            'type': 'websocket',
+            'path': path,
+            'query_string': query_string,
+            'headers': headers or [],
+            'server': ('localhost', 5000),
+            'client': ('127.0.0.1', 12345),
+            'scheme': 'ws',
+        }
+        self.task = asyncio.ensure_future(
+            asgi_app(self.scope, self.incoming.get, self.outgoing.put))
+
+    async def connect(self):
+        await self.incoming.put({'type': 'websocket.connect'})
+        return await self.outgoing.get()
+
+    async def receive(self):
+        return await asyncio.wait_for(self.outgoing.get(), 5)
+
+    async def disconnect(self):
+        await self.incoming.put({'type': 'websocket.disconnect'})
+        await asyncio.wait_for(self.task, 5)
+
+
+def run(coro):
+    return asyncio.get_event_loop_policy().new_event_loop().run_until_complete(
+        coro)
+
+
+class TestAsyncTurbo(unittest.TestCase):
+    def test_create(self):
+        app = Flask(__name__)
+        turbo = turbo_flask.AsyncTurbo(app)
+        assert turbo.sock is None
+        with app.test_request_context('/'):
+            assert 'Turbo.connectStreamSource' in turbo.turbo()
+
+    def test_http(self):
+        app = Flask(__name__)
+        turbo = turbo_flask.AsyncTurbo(app)
+        http_app = mock.AsyncMock()
+        asgi_app = turbo.asgi(app, http_app=http_app)
+        scope = {'type': 'http', 'path': '/'}
+        run(asgi_app(scope, 'receive', 'send'))
+        http_app.assert_awaited_once_with(scope, 'receive', 'send')
+
+    def test_push(self):
+        app = Flask(__name__)
+        turbo = turbo_flask.AsyncTurbo(app)
+
+        @turbo.user_id
+        def get_user_id():
+            return request.headers['X-User']
+
+        @turbo.authorize_channel
+        def authorize_channel(channel):
+            return True
+
+        async def main():
+            asgi_app = turbo.asgi(app, http_app=mock.AsyncMock())
+            client1 = ASGIClient(asgi_app, headers=[(b'x-user', b'123')])
+            client2 = ASGIClient(asgi_app, headers=[(b'x-user', b'456')],
+                                 query_string=b'channel=orders')
+            assert await client1.connect() == {'type': 'websocket.accept'}
+            assert await client2.connect() == {'type': 'websocket.accept'}
+            assert turbo.can_push('123')
+            assert turbo.can_push(channel='orders')
+
+            await turbo.push(turbo.append('foo', 'bar'))
+            assert await client1.receive() == {
+                'type': 'websocket.send', 'text': turbo.append('foo', 'bar')}
+            assert await client2.receive() == {
+                'type': 'websocket.send', 'text': turbo.append('foo', 'bar')}
+
+            turbo.push_nowait('baz', to='123')
+            assert await client1.receive() == {
+                'type': 'websocket.send', 'text': 'baz'}
+
+            thread = threading.Thread(
+                target=turbo.push_nowait, args=('qux',),
+                kwargs={'channel': 'orders'})
+            thread.start()
+            thread.join()
+            assert await client2.receive() == {
+                'type': 'websocket.send', 'text': 'qux'}
+            assert client1.outgoing.empty()
+
+            await client1.disconnect()
+            assert not turbo.can_push('123')
+            await client2.disconnect()
+            assert not turbo.can_push()
+
+        run(main())
+
+    def test_disconnect_slow_client(self):
+        app = Flask(__name__)
+        app.config['TURBO_PUSH_QUEUE_SIZE'] = 1
+        app.config['TURBO_PUSH_QUEUE_OVERFLOW'] = 'disconnect'
+        turbo = turbo_flask.AsyncTurbo(app)
+
+        async def main():
+            asgi_app = turbo.asgi(app, http_app=mock.AsyncMock())
+            client = ASGIClient(asgi_app)
+            await client.connect()
+            turbo.push_nowait('foo')
+            turbo.push_nowait('bar')
+            assert turbo.dropped['disconnect'] == 2
+            assert await client.receive() == {'type': 'websocket.close',
+                                              'code': 1008}
+            await client.disconnect()
+            assert not turbo.can_push()
+
+        run(main())
+
+    def test_send_error(self):
+        app = Flask(__name__)
+        turbo = turbo_flask.AsyncTurbo(app)
+
+        async def main():
+            asgi_app = turbo.asgi(app, http_app=mock.AsyncMock())
+
+            async def failing_app(scope, receive, send):
+                async def failing_send(message):
+                    if message['type'] == 'websocket.send':
+                        raise OSError('client went away')
+                    await send(message)
+
+                await asgi_app(scope, receive, failing_send)
+
+            client = ASGIClient(failing_app)
+            await client.connect()
+            await asyncio.wait_for(turbo.push('foo'), 2)
+            assert not turbo.can_push()
+            assert turbo.connection_count == 0
+            await client.disconnect()
+
+            # a connection that is closed before its writer starts
+            conn = turbo_flask.aio.AsyncConnection(
+                client.outgoing.put, asyncio.get_running_loop())
+            conn.send('foo')
+            conn.close()
+            await conn.run()
+            await asyncio.wait_for(conn.join(), 2)
+
+        run(main())
+
+    def test_environ(self):
+        environ = turbo_flask.AsyncTurbo._environ({
+            'path': '/ws', 'query_string': b'a=b', 'scheme': 'wss',
+            'headers': [(b'cookie', b'a=1'), (b'cookie', b'b=2'),
+                        (b'accept', b'text/html'), (b'accept', b'*/*')]})
+        assert environ['PATH_INFO'] == '/ws'
+        assert environ['QUERY_STRING'] == 'a=b'
+        assert environ['wsgi.url_scheme'] == 'https'
+        assert environ['HTTP_COOKIE'] == 'a=1; b=2'
+        assert environ['HTTP_ACCEPT'] == 'text/html,*/*'
+        assert environ['SERVER_NAME'] == 'localhost'
+
+    def test_resume(self):
+        app = Flask(__name__)
+        app.config['TURBO_REPLAY_SIZE'] = 10
+        turbo = turbo_flask.AsyncTurbo(app)
+        turbo.push_nowait(turbo.append('foo', 'bar'))
+        turbo.push_nowait(turbo.append('baz', 'bar'))
+        epoch = turbo.replay.epoch
+
+        async def main():
+            asgi_app = turbo.asgi(app, http_app=mock.AsyncMock())
+            client = ASGIClient(
+                asgi_app, query_string=f'last_event_id={epoch}-1'.encode())
+            assert await client.connect() == {'type': 'websocket.accept'}
+            assert await client.receive() == {
+                'type': 'websocket.send',
+                'text': f'<!--turbo-id:{epoch}-2-->' +
+                        turbo.append('baz', 'bar')}
+            await client.disconnect()
+
+        run(main())
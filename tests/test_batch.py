@@ -0,0 +1,81 @@
+import unittest
+from unittest import mock
+from flask import Flask
+import turbo_flask
+from turbo_flask.batch import chunk_streams, stream_size
+
+
+class TestBatch(unittest.TestCase):
+    def test_stream_size(self):
+        assert stream_size('foo') == 3
+        assert stream_size('fóo') == 4
+
+    def test_chunk_streams(self):
+        assert chunk_streams([]) == []
+        assert chunk_streams(['a', 'b', 'c']) == ['abc']
+        assert chunk_streams(['a', 'b', 'c'], max_size=2) == ['ab', 'c']
+        assert chunk_streams(['aaa', 'b', 'cc', 'd'], max_size=2) == \
+            ['aaa', 'b', 'cc', 'd']
+        assert chunk_streams(['a', 'bbb', 'c', 'd'], max_size=2) == \
+            ['a', 'bbb', 'cd']
+        assert chunk_streams(['ó', 'ó', 'ó'], max_size=4) == ['óó', 'ó']
+
+    def test_push_max_frame_size(self):
+        stream = turbo_flask.Turbo().append('foo', 'bar')
+        app = Flask(__name__)
+        app.config['TURBO_MAX_FRAME_SIZE'] = len(stream) * 2
+        turbo = turbo_flask.Turbo(app)
+        ws = mock.MagicMock()
+        turbo.clients = {'123': [ws]}
+        turbo.push([stream] * 5)
+        assert ws.send.call_args_list == [
+            mock.call(stream * 2), mock.call(stream * 2), mock.call(stream)]
+
+    def test_batch(self):
+        app = Flask(__name__)
+        turbo = turbo_flask.Turbo(app)
+        ws1 = mock.MagicMock()
+        ws2 = mock.MagicMock()
+        turbo.clients = {'123': [ws1], '456': [ws2]}
+
+        with turbo.batch(to='123') as batch:
+            batch.add(turbo.append('foo', 'bar'))
+            batch.add([turbo.remove('baz'), turbo.remove('qux')])
+            assert len(batch) == 3
+            ws1.send.assert_not_called()
+        ws1.send.assert_called_once_with(
+            turbo.append('foo', 'bar') + turbo.remove('baz') +
+            turbo.remove('qux'))
+        ws2.send.assert_not_called()
+
+        batch = turbo.batch()
+        batch.flush()
+        assert ws2.send.call_count == 0
+        batch.add(turbo.remove('baz'))
+        batch.flush()
+        ws2.send.assert_called_once_with(turbo.remove('baz'))
+
+    def test_batch_request(self):
+        app = Flask(__name__)
+        turbo = turbo_flask.Turbo(app)
+        ws = mock.MagicMock()
+        turbo.clients = {'123': [ws]}
+
+        @app.route('/')
+        def index():
+            turbo.batch().add(turbo.remove('foo'))
+            turbo.batch(to='123').add(turbo.remove('bar'))
+            ws.send.assert_not_called()
+            return ''
+
+        @app.route('/error')
+        def error():
+            turbo.batch().add(turbo.remove('baz'))
+            raise RuntimeError()
+
+        app.test_client().get('/')
+        assert ws.send.call_args_list == [
+            mock.call(turbo.remove('foo')), mock.call(turbo.remove('bar'))]
+
+        app.test_client().get('/error')
+        assert ws.send.call_count == 2
@@ -0,0 +1,172 @@
+import os
+import socket
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+import pytest
+from flask import Flask
+import turbo_flask
+
+
+def wait_for(condition, timeout=5):
+    start = time.time()
+    while not condition():
+        if time.time() - start > timeout:  # pragma: no cover
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class TestLocalBroker(unittest.TestCase):
+    def test_publish(self):
+        broker = turbo_flask.LocalBroker()
+        callback = mock.MagicMock()
+        broker.subscribe(callback)
+        broker.publish('foo', ['123'])
+        callback.assert_called_once_with('foo', ['123'], None)
+        assert not broker.can_push()
+        assert not broker.can_push('123')
+
+    def test_turbo_push(self):
+        app = Flask(__name__)
+        broker = turbo_flask.LocalBroker()
+        turbo = turbo_flask.Turbo(app, broker=broker)
+        turbo.clients = {'123': [mock.MagicMock()]}
+        turbo.push('foo', to=['123', '456'])
+        turbo.clients['123'][0].send.assert_called_once_with('foo')
+
+
+@pytest.mark.skipif(sys.platform == 'win32' or not hasattr(socket, 'AF_UNIX'),
+                    reason='requires Unix datagram sockets')
+class TestUnixSocketBroker(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'turbo')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_publish(self):
+        broker1 = turbo_flask.UnixSocketBroker(self.path)
+        broker2 = turbo_flask.UnixSocketBroker(self.path)
+        callback1 = mock.MagicMock()
+        callback2 = mock.MagicMock()
+        broker1.subscribe(callback1)
+        broker2.subscribe(callback2)
+
+        broker1.publish('foo', ['123'])
+        callback1.assert_called_once_with('foo', ['123'], None)
+        assert wait_for(lambda: callback2.call_count == 1)
+        callback2.assert_called_once_with('foo', ['123'], None)
+
+        broker2.publish('bar')
+        assert wait_for(lambda: callback1.call_count == 2)
+        callback1.assert_called_with('bar', None, None)
+
+        broker2.publish('baz', channel=['orders'])
+        assert wait_for(lambda: callback1.call_count == 3)
+        callback1.assert_called_with('baz', None, ['orders'])
+
+        broker1.publish('foo', dedup=True)
+        assert wait_for(lambda: callback2.call_count == 4)
+        callback2.assert_called_with('foo', None, None, dedup=True)
+
+        broker1.close()
+        broker2.close()
+        assert os.listdir(self.path) == []
+
+    def test_presence(self):
+        broker1 = turbo_flask.UnixSocketBroker(self.path)
+        broker1.subscribe(mock.MagicMock())
+        broker1.connected('123')
+
+        broker2 = turbo_flask.UnixSocketBroker(self.path)
+        broker2.subscribe(mock.MagicMock())
+        assert wait_for(lambda: broker2.can_push('123'))
+        assert broker2.can_push()
+        assert not broker2.can_push('456')
+
+        broker2.connected('456')
+        assert wait_for(lambda: broker1.can_push('456'))
+        broker2.disconnected('456')
+        assert wait_for(lambda: not broker1.can_push('456'))
+        assert not broker1.can_push()
+
+        broker2.subscribed('orders')
+        assert wait_for(lambda: broker1.can_push(channel='orders'))
+        assert not broker1.can_push()
+        broker2.unsubscribed('orders')
+        assert wait_for(lambda: not broker1.can_push(channel='orders'))
+
+        broker1.close()
+        assert wait_for(lambda: not broker2.can_push('123'))
+        broker2.close()
+
+    def test_dead_peer(self):
+        broker1 = turbo_flask.UnixSocketBroker(self.path)
+        broker1.subscribe(mock.MagicMock())
+
+        # simulate a process that exited without cleaning up
+        dead = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        dead.bind(os.path.join(self.path, '1-dead.sock'))
+        dead.close()
+        broker1.remote_presence['1-dead.sock'] = {('user', '123')}
+        assert broker1.can_push('123')
+
+        broker1.publish('foo')
+        assert not broker1.can_push('123')
+        assert os.listdir(self.path) == [broker1.name]
+        broker1.close()
+
+    def test_errors(self):
+        broker1 = turbo_flask.UnixSocketBroker(self.path)
+        broker2 = turbo_flask.UnixSocketBroker(self.path)
+        callback1 = mock.MagicMock()
+        callback2 = mock.MagicMock(side_effect=[RuntimeError(), None])
+        broker1.subscribe(callback1)
+        broker2.subscribe(callback2)
+
+        # a failed delivery does not stop the listener
+        with mock.patch('turbo_flask.broker.logger') as logger:
+            broker1.publish('one')
+            broker1.publish('two')
+            assert wait_for(lambda: callback2.call_count == 2)
+            callback2.assert_called_with('two', None, None)
+            logger.exception.assert_called_once()
+            callback2.side_effect = None
+
+            # updates that are too large are only delivered locally
+            broker1.publish('x' * 10000000)
+            callback1.assert_called_with('x' * 10000000, None, None)
+            logger.error.assert_called_once()
+
+            # a peer that does not read does not block the publisher
+            stuck = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            stuck.bind(os.path.join(self.path, '1-stuck.sock'))
+            for _ in range(1000):
+                broker1.publish('x' * 1000)
+            assert logger.warning.called
+            stuck.close()
+
+        broker1.close()
+        broker2.close()
+
+    def test_turbo_push(self):
+        app1 = Flask(__name__)
+        turbo1 = turbo_flask.Turbo(
+            app1, broker=turbo_flask.UnixSocketBroker(self.path))
+        app2 = Flask(__name__)
+        turbo2 = turbo_flask.Turbo(
+            app2, broker=turbo_flask.UnixSocketBroker(self.path))
+        turbo2.clients = {'123': [mock.MagicMock()]}
+        turbo2.broker.connected('123')
+
+        assert wait_for(lambda: turbo1.can_push('123'))
+        turbo1.push(turbo1.append('foo', 'bar'), to='123')
+        ws = turbo2.clients['123'][0]
+        assert wait_for(lambda: ws.send.call_count == 1)
+        ws.send.assert_called_once_with(turbo1.append('foo', 'bar'))
+        turbo1.broker.close()
+        turbo2.broker.close()
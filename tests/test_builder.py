@@ -0,0 +1,84 @@
+import unittest
+from unittest import mock
+from flask import Flask
+from markupsafe import Markup
+import turbo_flask
+from turbo_flask.builder import escape_attribute, make_stream
+
+
+class TestBuilder(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.turbo = turbo_flask.Turbo(self.app)
+
+    def test_escape_attribute(self):
+        assert escape_attribute('foo') == 'foo'
+        assert escape_attribute('[data-id="1"] & <b>') == \
+            '[data-id=&#34;1&#34;] &amp; &lt;b&gt;'
+        assert escape_attribute("it's") == 'it&#39;s'
+        assert escape_attribute(Markup('&amp;')) == '&amp;'
+        assert escape_attribute(42) == '42'
+
+    def test_make_stream(self):
+        assert make_stream('refresh') == \
+            '<turbo-stream action="refresh"></turbo-stream>'
+        assert make_stream('foo', 'bar', '.baz', multiple=True,
+                           data_x='"', y=None) == (
+            '<turbo-stream action="foo" targets=".baz" data-x="&#34;">'
+            '<template>bar</template></turbo-stream>')
+
+    def test_turbo_streams(self):
+        turbo = self.turbo
+        assert turbo.replace('foo', 'a"b') == (
+            '<turbo-stream action="replace" target="a&#34;b">'
+            '<template>foo</template></turbo-stream>')
+        assert turbo.update('foo', 'bar', method='morph') == (
+            '<turbo-stream action="update" target="bar" method="morph">'
+            '<template>foo</template></turbo-stream>')
+        assert turbo.refresh(request_id='123') == (
+            '<turbo-stream action="refresh" request-id="123">'
+            '</turbo-stream>')
+
+    def test_builder(self):
+        turbo = self.turbo
+        builder = turbo.builder()
+        assert builder.append('1', 'a') is builder
+        builder.prepend('2', 'a').replace('3', 'b').update('4', 'c')
+        builder.remove('d').after('5', 'e').before('6', 'f', multiple=True)
+        builder.replace('7', 'g', method='morph').refresh()
+        assert len(builder) == 9
+        assert list(builder) == [
+            turbo.append('1', 'a'), turbo.prepend('2', 'a'),
+            turbo.replace('3', 'b'), turbo.update('4', 'c'),
+            turbo.remove('d'), turbo.after('5', 'e'),
+            turbo.before('6', 'f', multiple=True),
+            turbo.replace('7', 'g', method='morph'), turbo.refresh()]
+        assert str(builder) == ''.join(builder)
+        assert bytes(builder) == str(builder).encode()
+        assert bytes(builder) is bytes(builder)
+        builder.action('custom', target='h', data_value='x')
+        assert str(builder).endswith(
+            '<turbo-stream action="custom" target="h" data-value="x">'
+            '</turbo-stream>')
+        builder.clear()
+        assert str(builder) == ''
+
+    def test_stream_response(self):
+        turbo = self.turbo
+
+        @self.app.route('/test')
+        def test():
+            return turbo.stream(turbo.builder().append('é', 'a').remove('b'))
+
+        rv = self.app.test_client().get('/test')
+        assert rv.mimetype == 'text/vnd.turbo-stream.html'
+        assert rv.get_data(as_text=True) == \
+            turbo.append('é', 'a') + turbo.remove('b')
+
+    def test_push(self):
+        turbo = self.turbo
+        ws = mock.MagicMock()
+        turbo.clients = {'123': [ws]}
+        turbo.push(turbo.builder().append('1', 'a').append('2', 'a'))
+        ws.send.assert_called_once_with(turbo.append('1', 'a') +
+                                        turbo.append('2', 'a'))
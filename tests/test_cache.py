@@ -0,0 +1,99 @@
+import unittest
+from unittest import mock
+from flask import Flask
+import jinja2
+import turbo_flask
+from turbo_flask.cache import FragmentCache
+
+
+class TestFragmentCache(unittest.TestCase):
+    def test_get_set(self):
+        cache = FragmentCache()
+        assert cache.get('a.html', 1) is None
+        cache.set('a.html', 1, 'foo')
+        assert cache.get('a.html', 1) == 'foo'
+        assert cache.get('b.html', 1) is None
+        assert cache.stats() == {'hits': 1, 'misses': 2, 'evictions': 0,
+                                 'size': 1}
+
+    def test_lru(self):
+        cache = FragmentCache(max_size=2)
+        cache.set('a.html', 1, 'foo')
+        cache.set('a.html', 2, 'bar')
+        cache.get('a.html', 1)
+        cache.set('a.html', 3, 'baz')
+        assert cache.get('a.html', 2) is None
+        assert cache.get('a.html', 1) == 'foo'
+        assert cache.get('a.html', 3) == 'baz'
+        assert cache.stats()['evictions'] == 1
+        assert cache.invalidate(key=2) == 0
+
+    @mock.patch('turbo_flask.cache.time.monotonic')
+    def test_ttl(self, monotonic):
+        monotonic.return_value = 100
+        cache = FragmentCache(ttl=10)
+        cache.set('a.html', 1, 'foo')
+        monotonic.return_value = 110
+        assert cache.get('a.html', 1) == 'foo'
+        monotonic.return_value = 111
+        assert cache.get('a.html', 1) is None
+        assert cache.stats()['size'] == 0
+
+    def test_invalidate(self):
+        cache = FragmentCache()
+        cache.set('a.html', 1, 'foo', tags='todos')
+        cache.set('b.html', 1, 'bar', tags=['todos', 'users'])
+        cache.set('b.html', 2, 'baz', tags=['users'])
+        assert cache.invalidate(key=1) == 2
+        assert cache.get('b.html', 2) == 'baz'
+        assert cache.invalidate(tag='todos') == 0
+        cache.set('a.html', 1, 'foo', tags='todos')
+        assert cache.invalidate(tag='users') == 1
+        assert cache.index == {('key', 1): {('a.html', 1)},
+                               ('tag', 'todos'): {('a.html', 1)}}
+        cache.clear()
+        assert cache.get('a.html', 1) is None
+        assert cache.index == {}
+
+    def test_render(self):
+        cache = FragmentCache()
+        render = mock.MagicMock(return_value='foo')
+        assert cache.render('a.html', 1, render) == 'foo'
+        assert cache.render('a.html', 1, render) == 'foo'
+        render.assert_called_once_with()
+
+
+class TestTemplateStreams(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['TURBO_FRAGMENT_CACHE_SIZE'] = 10
+        self.app.jinja_env.loader = jinja2.DictLoader(
+            {'_todo.html': '<li>{{ todo }}</li>'})
+        self.turbo = turbo_flask.Turbo(self.app)
+
+    def test_template_streams(self):
+        turbo = self.turbo
+        assert turbo.fragments.max_size == 10
+        with self.app.app_context():
+            for action in ['append', 'prepend', 'replace', 'update', 'after',
+                           'before']:
+                stream = getattr(turbo, action + '_template')(
+                    '_todo.html', 'todo-1', todo='foo')
+                assert stream == getattr(turbo, action)('<li>foo</li>',
+                                                        'todo-1')
+            assert turbo.fragments.stats()['size'] == 0
+
+    def test_cached_template_streams(self):
+        turbo = self.turbo
+        with self.app.app_context():
+            assert turbo.replace_template(
+                '_todo.html', 'todo-1', cache_key=1, tags='todos',
+                todo='foo') == turbo.replace('<li>foo</li>', 'todo-1')
+            assert turbo.update_template(
+                '_todo.html', '.todo', multiple=True, cache_key=1,
+                todo='bar') == turbo.update('<li>foo</li>', '.todo',
+                                            multiple=True)
+            assert turbo.fragments.stats()['hits'] == 1
+            turbo.fragments.invalidate(tag='todos')
+            assert turbo.render_fragment(
+                '_todo.html', cache_key=1, todo='bar') == '<li>bar</li>'
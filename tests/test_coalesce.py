@@ -0,0 +1,67 @@
+import time
+import unittest
+from unittest import mock
+from flask import Flask
+import turbo_flask
+from turbo_flask.coalesce import Coalescer, stream_key
+
+
+class TestCoalesce(unittest.TestCase):
+    def setUp(self):
+        self.turbo = turbo_flask.Turbo()
+
+    def test_stream_key(self):
+        turbo = self.turbo
+        assert stream_key(turbo.replace('foo', 'bar')) == \
+            ('replace', ('target', 'bar'))
+        assert stream_key(turbo.update('foo', '.bar', multiple=True)) == \
+            ('update', ('targets', '.bar'))
+        assert stream_key(turbo.remove('bar')) == ('remove', ('target', 'bar'))
+        assert stream_key(turbo.replace('foo', 'bar', multiple=True)) != \
+            stream_key(turbo.replace('foo', 'bar'))
+        assert stream_key('foo') is None
+        assert stream_key(turbo.replace('foo', 'bar') +
+                          turbo.replace('foo', 'baz')) is None
+
+    def test_coalesce(self):
+        turbo = self.turbo
+        callback = mock.MagicMock()
+        coalescer = Coalescer(10, callback)
+        coalescer.add([turbo.replace('1', 'a'), turbo.append('2', 'b')])
+        coalescer.add([turbo.append('3', 'b'), turbo.update('4', 'a')])
+        coalescer.add([turbo.replace('5', 'a'), turbo.replace('x', 'a',
+                                                              multiple=True)])
+        coalescer.add([turbo.replace('6', 'a')], to=['123'])
+        coalescer.add([turbo.replace('7', 'a')], channel=['orders'])
+        coalescer.add([turbo.replace('8', 'a')], dedup=True)
+        callback.assert_not_called()
+        coalescer.flush()
+        assert coalescer.timer is None
+        assert callback.call_args_list == [
+            mock.call([turbo.append('2', 'b'), turbo.append('3', 'b'),
+                       turbo.update('4', 'a'), turbo.replace('5', 'a'),
+                       turbo.replace('x', 'a', multiple=True)],
+                      None, None),
+            mock.call([turbo.replace('6', 'a')], ['123'], None),
+            mock.call([turbo.replace('7', 'a')], None, ['orders']),
+            mock.call([turbo.replace('8', 'a')], None, None, dedup=True),
+        ]
+        coalescer.flush()
+        assert callback.call_count == 4
+
+    def test_turbo_push(self):
+        app = Flask(__name__)
+        app.config['TURBO_PUSH_COALESCE_WINDOW'] = 0.05
+        turbo = turbo_flask.Turbo(app)
+        ws = mock.MagicMock()
+        turbo.clients = {'123': [ws]}
+
+        for i in range(10):
+            turbo.push(turbo.replace(str(i), 'load'))
+        turbo.push(turbo.append('foo', 'bar'), to='123', coalesce=False)
+        ws.send.assert_called_once_with(turbo.append('foo', 'bar'))
+        start = time.time()
+        while ws.send.call_count < 2 and time.time() - start < 5:
+            time.sleep(0.01)
+        ws.send.assert_called_with(turbo.replace('9', 'load'))
+        assert ws.send.call_count == 2
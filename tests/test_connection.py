@@ -0,0 +1,297 @@
+import os
+import shutil
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import unittest
+import zlib
+from unittest import mock
+import pytest
+from simple_websocket.ws import Base as WebSocket
+from turbo_flask.connection import Connection, Message, encode_frame
+
+
+class TestConnection(unittest.TestCase):
+    def test_invalid_overflow(self):
+        with pytest.raises(ValueError):
+            Connection(mock.MagicMock(), queue_size=1, overflow='foo')
+
+    def test_send_sync(self):
+        ws = mock.MagicMock()
+        conn = Connection(ws)
+        conn.send('foo')
+        ws.send.assert_called_once_with('foo')
+        assert conn.queue is None
+
+    def test_send_queued(self):
+        ws = mock.MagicMock()
+        conn = Connection(ws, queue_size=3)
+        conn.send('foo')
+        conn.send('bar')
+        ws.send.assert_not_called()
+        assert conn.flush(timeout=0)
+        assert ws.send.call_args_list == [mock.call('foo'), mock.call('bar')]
+        assert len(conn.queue) == 0
+
+    def test_flush_timeout(self):
+        ws = mock.MagicMock()
+        conn = Connection(ws, queue_size=3)
+        assert conn.flush(timeout=0.01)
+        ws.send.assert_not_called()
+
+    def test_drop_oldest(self):
+        ws = mock.MagicMock()
+        on_drop = mock.MagicMock()
+        conn = Connection(ws, queue_size=2, overflow='drop_oldest',
+                          on_drop=on_drop)
+        for data in ['a', 'b', 'c']:
+            conn.send(data)
+        on_drop.assert_called_once_with('drop_oldest', 1)
+        assert conn.dropped == 1
+        conn.flush(timeout=0)
+        assert ws.send.call_args_list == [mock.call('b'), mock.call('c')]
+
+    def test_drop_newest(self):
+        ws = mock.MagicMock()
+        on_drop = mock.MagicMock()
+        conn = Connection(ws, queue_size=2, overflow='drop_newest',
+                          on_drop=on_drop)
+        for data in ['a', 'b', 'c']:
+            conn.send(data)
+        on_drop.assert_called_once_with('drop_newest', 1)
+        assert conn.dropped == 1
+        conn.flush(timeout=0)
+        assert ws.send.call_args_list == [mock.call('a'), mock.call('b')]
+
+    def test_disconnect(self):
+        ws = mock.MagicMock()
+        on_drop = mock.MagicMock()
+        conn = Connection(ws, queue_size=2, overflow='disconnect',
+                          on_drop=on_drop)
+        for data in ['a', 'b', 'c', 'd']:
+            conn.send(data)
+        on_drop.assert_called_once_with('disconnect', 3)
+        assert conn.dropped == 3
+        assert conn.closed
+        assert not conn.flush(timeout=0)
+        ws.send.assert_not_called()
+
+    def test_send_status(self):
+        conn = Connection(mock.MagicMock())
+        assert conn.send('a') == 'sent'
+        conn.hold()
+        assert conn.send('b') == 'queued'
+        conn = Connection(mock.MagicMock(), queue_size=1,
+                          overflow='drop_newest')
+        assert conn.send('a') == 'queued'
+        assert conn.send('b') == 'dropped'
+        conn = Connection(mock.MagicMock(), queue_size=1)
+        assert conn.send('a') == 'queued'
+        assert conn.send('b') == 'queued'
+
+    def test_write_timeout(self):
+        sock, peer = socket.socketpair()
+        try:
+            ws = mock.MagicMock(spec=WebSocket)
+            ws.ws = mock.MagicMock()
+            ws.sock = sock
+            ws.connected = True
+            conn = Connection(ws)
+            conn.send('foo', timeout=1)
+            assert peer.recv(100) == b'\x81\x03foo'
+
+            # the peer does not read, so the socket buffers fill up
+            with pytest.raises(TimeoutError):
+                conn.send('x' * 10000000, timeout=0.1)
+            conn.abort()
+            assert conn.closed
+            with pytest.raises(OSError):
+                sock.send(b'x')
+        finally:
+            sock.close()
+            peer.close()
+
+    @pytest.mark.skipif(shutil.which('openssl') is None,
+                        reason='requires openssl')
+    def test_write_timeout_tls(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cert = os.path.join(tmp, 'cert.pem')
+            key = os.path.join(tmp, 'key.pem')
+            subprocess.run(
+                ['openssl', 'req', '-x509', '-newkey', 'ec', '-pkeyopt',
+                 'ec_paramgen_curve:prime256v1', '-nodes', '-keyout', key,
+                 '-out', cert, '-days', '1', '-subj', '/CN=localhost'],
+                check=True, capture_output=True)
+            server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            server_context.load_cert_chain(cert, key)
+        client_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        client_context.check_hostname = False
+        client_context.verify_mode = ssl.CERT_NONE
+        sock, peer = socket.socketpair()
+        peer = client_context.wrap_socket(peer, do_handshake_on_connect=False)
+        thread = threading.Thread(target=peer.do_handshake)
+        thread.start()
+        sock = server_context.wrap_socket(sock, server_side=True)
+        thread.join()
+        try:
+            ws = mock.MagicMock(spec=WebSocket)
+            ws.ws = mock.MagicMock()
+            ws.sock = sock
+            ws.connected = True
+            conn = Connection(ws)
+            conn.send('foo', timeout=1)
+            assert peer.recv(100) == b'\x81\x03foo'
+
+            with pytest.raises(TimeoutError):
+                conn.send('x' * 10000000, timeout=0.1)
+        finally:
+            sock.close()
+            peer.close()
+
+    def test_close(self):
+        ws = mock.MagicMock()
+        conn = Connection(ws, queue_size=2)
+        conn.send('a')
+        conn.close()
+        assert not conn.flush(timeout=0)
+        conn.send('b')
+        ws.send.assert_not_called()
+
+    def test_encode_frame(self):
+        assert encode_frame(b'foo') == b'\x81\x03foo'
+        assert encode_frame(b'x' * 200) == b'\x81\x7e\x00\xc8' + b'x' * 200
+        assert encode_frame(b'x' * 70000) == (
+            b'\x81\x7f\x00\x00\x00\x00\x00\x01\x11\x70' + b'x' * 70000)
+        assert encode_frame(b'foo', opcode=0x2) == b'\x82\x03foo'
+
+    def test_message(self):
+        message = Message('foo')
+        assert message == 'foo'
+        assert message.frame == b'\x81\x03foo'
+        assert message.frame is message.frame
+
+    def test_compressed_frame(self):
+        message = Message('x' * 1000)
+        frame = message.compressed_frame()
+        assert frame[0] == 0xc1
+        assert frame is message.compressed_frame()
+        assert frame is not message.compressed_frame(level=1)
+        data = zlib.decompressobj(-15).decompress(
+            frame[2:] + b'\x00\x00\xff\xff')
+        assert data == b'x' * 1000
+
+    def test_heartbeat(self):
+        ws = mock.MagicMock(spec=WebSocket)
+        ws.ws = mock.MagicMock()
+        ws.ws.send.return_value = b'ping'
+        ws.sock = mock.MagicMock()
+        conn = Connection(ws)
+        now = conn.last_ping
+        assert conn.heartbeat(10, 5, now=now + 1)
+        ws.sock.sendall.assert_not_called()
+        assert conn.heartbeat(10, 5, now=now + 10)
+        ws.sock.sendall.assert_called_once_with(b'ping')
+        assert not ws.pong_received
+        assert conn.heartbeat(10, 5, now=now + 15)
+        assert not conn.heartbeat(10, 5, now=now + 16)
+        ws.pong_received = True
+        assert conn.heartbeat(10, 5, now=now + 16)
+        assert conn.last_seen == now + 16
+        assert conn.ping_sent is None
+        assert conn.heartbeat(10, 5, now=now + 20)
+        assert ws.sock.sendall.call_count == 2
+
+        # pings are not written in the middle of another frame
+        ws.pong_received = True
+        with conn.write_lock:
+            thread = threading.Thread(target=conn.heartbeat,
+                                      args=(10, 5), kwargs={'now': now + 40})
+            thread.start()
+            thread.join(0.05)
+            assert ws.sock.sendall.call_count == 2
+        thread.join(5)
+        assert ws.sock.sendall.call_count == 3
+
+    def test_heartbeat_not_supported(self):
+        conn = Connection(mock.MagicMock())
+        assert conn.heartbeat(10, 5, now=conn.last_ping + 100)
+        assert conn.ping_sent is None
+
+    def test_unknown_websocket_internals(self):
+        # a WebSocket object without the expected internals is only used
+        # through its public interface
+        ws = mock.MagicMock(spec=WebSocket)
+        ws.sock = mock.MagicMock()
+        conn = Connection(ws, compression=True)
+        assert conn.sock is None and conn.raw_sock is None
+        conn.send('foo', timeout=1)
+        ws.send.assert_called_once_with('foo')
+        assert conn.heartbeat(10, 5, now=conn.last_ping + 100)
+        ws.sock.sendall.assert_not_called()
+
+    def test_evict(self):
+        ws = mock.MagicMock()
+        conn = Connection(ws, queue_size=2)
+        assert conn.is_alive()
+        conn.evict()
+        assert not conn.is_alive()
+        assert conn.close_code == 1001
+        ws.close.assert_called_once_with(reason=1001)
+
+    def test_tagged_message(self):
+        message = Message('foo')
+        assert message.tagged is message
+        message.event_id = 'abc-1'
+        assert message.tagged == '<!--turbo-id:abc-1-->foo'
+        assert message.tagged is message.tagged
+
+    def test_replay(self):
+        ws = mock.MagicMock()
+        conn = Connection(ws)
+        messages = [Message(str(i)) for i in range(4)]
+        for seq, message in enumerate(messages, start=1):
+            message.seq = seq
+            message.event_id = f'abc-{seq}'
+        conn.hold()
+        conn.send(messages[2])
+        conn.send(messages[3])
+        ws.send.assert_not_called()
+        conn.replay(messages[:3])
+        assert ws.send.call_args_list == [
+            mock.call(f'<!--turbo-id:abc-{i + 1}-->{i}') for i in range(4)]
+        assert conn.holding is None
+        # replayed, but also pushed after resuming
+        assert conn.send(messages[1]) == 'suppressed'
+        conn.send(messages[0])
+        assert ws.send.call_count == 4
+        conn.send('foo')
+        conn.send(messages[0])
+        assert ws.send.call_count == 6
+        ws.send.assert_called_with('<!--turbo-id:abc-1-->0')
+
+    def test_send_out_of_order(self):
+        ws = mock.MagicMock()
+        conn = Connection(ws)
+        messages = [Message(str(i)) for i in range(2)]
+        for seq, message in enumerate(messages, start=1):
+            message.seq = seq
+        conn.send(messages[1])
+        conn.send(messages[0])
+        assert ws.send.call_args_list == [mock.call('1'), mock.call('0')]
+
+    def test_replay_queued(self):
+        ws = mock.MagicMock()
+        conn = Connection(ws, queue_size=10)
+        messages = [Message(str(i)) for i in range(3)]
+        for seq, message in enumerate(messages, start=1):
+            message.seq = seq
+        conn.hold()
+        assert conn.holding is None
+        conn.send(messages[1])
+        conn.send(messages[2])
+        conn.replay(messages[:2])
+        assert conn.flush(timeout=0)
+        assert ws.send.call_args_list == [mock.call('0'), mock.call('1'),
+                                          mock.call('2')]
@@ -0,0 +1,107 @@
+import unittest
+from unittest import mock
+from flask import Flask
+from simple_websocket import ConnectionClosed
+import turbo_flask
+from turbo_flask.connection import Connection
+from turbo_flask.metrics import Histogram, Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram(self):
+        histogram = Histogram([1, 2])
+        for value in [0.5, 1, 1.5, 3]:
+            histogram.observe(value)
+        assert histogram.count == 4
+        assert histogram.sum == 6
+        assert histogram.cumulative() == [(1, 2), (2, 3), (float('inf'), 4)]
+
+    def test_metrics(self):
+        metrics = Metrics()
+        metrics.inc('foo_total')
+        metrics.inc('foo_total', 2)
+        metrics.observe('bar_seconds', 0.5, buckets=[1])
+        metrics.collect('baz', 'gauge', lambda: 42)
+        assert metrics.snapshot() == {
+            'foo_total': 3, 'baz': 42,
+            'bar_seconds': {'count': 1, 'sum': 0.5,
+                            'buckets': [(1, 1), (float('inf'), 1)]}}
+        assert metrics.render() == (
+            '# TYPE baz gauge\n'
+            'baz 42\n'
+            '# TYPE foo_total counter\n'
+            'foo_total 3\n'
+            '# TYPE bar_seconds histogram\n'
+            'bar_seconds_bucket{le="1"} 1\n'
+            'bar_seconds_bucket{le="+Inf"} 1\n'
+            'bar_seconds_sum 0.5\n'
+            'bar_seconds_count 1\n')
+
+    def test_disabled(self):
+        app = Flask(__name__)
+        turbo = turbo_flask.Turbo(app)
+        assert turbo.metrics is None
+        turbo.clients = {'123': [mock.MagicMock()]}
+        turbo.push('foo')
+
+    def test_turbo_metrics(self):
+        app = Flask(__name__)
+        app.config['TURBO_METRICS_ROUTE'] = '/metrics'
+        turbo = turbo_flask.Turbo(app)
+        ws1 = mock.MagicMock()
+        ws2 = mock.MagicMock()
+        ws2.send.side_effect = ConnectionClosed()
+        conn1 = Connection(ws1, user_id='123')
+        conn2 = Connection(ws2, user_id='456')
+        conn3 = Connection(mock.MagicMock(), user_id='789', queue_size=1,
+                           overflow='drop_newest')
+        conn3.send('bar')
+        turbo._register('123', conn1)
+        turbo._register('456', conn2)
+        turbo._register('789', conn3)
+        turbo.push('foo')
+        turbo._unregister('456', conn2)
+        turbo._unregister('456', conn2)
+        turbo._unregister('789', conn3)
+
+        values = turbo.metrics.snapshot()
+        assert values['turbo_connections'] == 1
+        assert values['turbo_users'] == 1
+        assert values['turbo_connections_total'] == 3
+        assert values['turbo_disconnections_total'] == 2
+        assert values['turbo_connection_duration_seconds']['count'] == 2
+        assert values['turbo_pushes_total'] == 1
+        assert values['turbo_messages_sent_total'] == 1
+        assert values['turbo_bytes_sent_total'] == 3
+        assert values['turbo_send_errors_total'] == 1
+        assert values['turbo_push_duration_seconds']['count'] == 1
+        assert values['turbo_dropped_total{policy="disconnect"}'] == 0
+
+        rv = app.test_client().get('/metrics')
+        assert rv.mimetype == 'text/plain'
+        text = rv.get_data(as_text=True)
+        assert '# TYPE turbo_connections gauge\nturbo_connections 1\n' in text
+        assert 'turbo_dropped_total{policy="drop_oldest"} 0\n' in text
+        assert 'turbo_push_duration_seconds_count 1\n' in text
+
+    def test_hooks(self):
+        app = Flask(__name__)
+        turbo = turbo_flask.Turbo(app)
+        events = []
+        turbo.on_connect(lambda user_id, conn: events.append(
+            ('connect', user_id)))
+        turbo.on_disconnect(lambda user_id, conn: events.append(
+            ('disconnect', user_id)))
+        turbo.on_push(lambda streams, to, channel: events.append(
+            ('push', streams, to, channel)))
+        error = ConnectionClosed()
+        turbo.on_send_error(lambda conn, exc: events.append(
+            ('send_error', exc)))
+        ws = mock.MagicMock()
+        ws.send.side_effect = error
+        conn = Connection(ws)
+        turbo._register('123', conn)
+        turbo.push('foo', to='123')
+        turbo._unregister('123', conn)
+        assert events == [('connect', '123'), ('push', ['foo'], ['123'], None),
+                          ('send_error', error), ('disconnect', '123')]
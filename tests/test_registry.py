@@ -0,0 +1,105 @@
+import random
+import threading
+import unittest
+from unittest import mock
+from flask import Flask
+import turbo_flask
+from turbo_flask.registry import ClientRegistry
+
+
+class TestClientRegistry(unittest.TestCase):
+    def test_add_remove(self):
+        registry = ClientRegistry()
+        assert not registry
+        assert registry.add('123', 'a')
+        assert not registry.add('123', 'b')
+        assert registry.add('456', 'c')
+        assert registry
+        assert len(registry) == 2
+        assert '123' in registry
+        assert '789' not in registry
+        assert registry['123'] == ('a', 'b')
+        assert registry.get('789') == ()
+        assert sorted(registry) == ['123', '456']
+        assert sorted(registry.keys()) == ['123', '456']
+        assert sorted(registry.items()) == [('123', ('a', 'b')),
+                                            ('456', ('c',))]
+        assert sorted(registry.connections()) == ['a', 'b', 'c']
+        with self.assertRaises(KeyError):
+            registry['789']
+
+        assert not registry.remove('123', 'a')
+        assert not registry.remove('123', 'x')
+        assert not registry.remove('789', 'x')
+        assert registry.remove('123', 'b')
+        assert '123' not in registry
+        assert registry.remove('456', 'c')
+        assert not registry
+        assert len(registry) == 0
+
+    def test_initial_clients(self):
+        registry = ClientRegistry({'123': ['a', 'b'], '456': ['c']},
+                                  stripes=2)
+        assert registry['123'] == ('a', 'b')
+        assert registry['456'] == ('c',)
+
+    def test_stress(self):
+        app = Flask(__name__)
+        turbo = turbo_flask.Turbo(app)
+        errors = []
+        stop = threading.Event()
+
+        def connect_disconnect():
+            try:
+                for i in range(1000):
+                    user_id = str(random.randint(0, 20))
+                    conn = mock.Mock()
+                    turbo.clients.add(user_id, conn)
+                    turbo.clients.remove(user_id, conn)
+            except Exception as exc:  # pragma: no cover
+                errors.append(exc)
+
+        def push():
+            try:
+                while not stop.is_set():
+                    turbo.push('foo')
+                    turbo.push('bar', to=[str(i) for i in range(10)])
+                    turbo.can_push()
+            except Exception as exc:  # pragma: no cover
+                errors.append(exc)
+
+        workers = [threading.Thread(target=connect_disconnect)
+                   for _ in range(8)]
+        pushers = [threading.Thread(target=push) for _ in range(4)]
+        for thread in workers + pushers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        stop.set()
+        for thread in pushers:
+            thread.join()
+        assert errors == []
+        assert not turbo.clients
+        assert all(clients == {} for clients, _ in turbo.clients.stripes)
+
+    def test_channels(self):
+        registry = ClientRegistry()
+        registry.add('123', 'a')
+        registry.add('123', 'b')
+        assert registry.subscribe('orders', 'a')
+        assert not registry.subscribe('orders', 'b')
+        assert registry.subscribe('users', 'a')
+        assert registry.has_subscribers('orders')
+        assert not registry.has_subscribers('foo')
+        assert registry.subscribers('orders') == ['a', 'b']
+        assert registry.subscribers('foo') == []
+        assert registry.subscriptions('a') == {'orders', 'users'}
+        assert registry.subscriptions('c') == set()
+
+        assert not registry.unsubscribe('orders', 'a')
+        assert not registry.unsubscribe('orders', 'c')
+        assert not registry.unsubscribe('foo', 'a')
+        assert registry.subscriptions('a') == {'users'}
+        assert registry.unsubscribe('orders', 'b')
+        assert not registry.has_subscribers('orders')
+        assert registry.subscriptions('b') == set()
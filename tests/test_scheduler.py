@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+import pytest
+from flask import Flask, current_app
+from turbo_flask.scheduler import Job, Scheduler
+
+
+class TestScheduler(unittest.TestCase):
+    def test_call_later(self):
+        app = Flask(__name__)
+        scheduler = Scheduler(app)
+        done = threading.Event()
+        calls = []
+
+        def func():
+            calls.append(current_app.name)
+            done.set()
+
+        start = time.monotonic()
+        scheduler.call_later(0.05, func)
+        assert done.wait(5)
+        assert time.monotonic() - start >= 0.05
+        assert calls == [app.name]
+        scheduler.stop()
+        assert scheduler.thread is None
+
+    def test_order_and_cancel(self):
+        scheduler = Scheduler()
+        calls = []
+        scheduler.call_later(0.03, lambda: calls.append('b'))
+        job = scheduler.call_later(0.02, lambda: calls.append('x'))
+        scheduler.call_later(0.01, lambda: calls.append('a'))
+        job.cancel()
+        assert scheduler.thread is None  # not started without an app
+        scheduler.start()
+        scheduler.call_later(0.04, scheduler.stop)
+        scheduler.thread.join(5)
+        assert calls == ['a', 'b']
+
+    def test_every(self):
+        scheduler = Scheduler(Flask(__name__))
+        calls = []
+        job = scheduler.every(0.01, lambda: calls.append(1), jitter=0)
+        time.sleep(0.2)
+        job.cancel()
+        count = len(calls)
+        assert count > 3
+        time.sleep(0.05)
+        assert len(calls) == count
+        assert scheduler.heap == []
+        scheduler.stop()
+
+    def test_errors(self):
+        app = Flask(__name__)
+        scheduler = Scheduler(app)
+        done = threading.Event()
+
+        def fail():
+            raise RuntimeError('foo')
+
+        with mock.patch.object(app.logger, 'exception') as exception:
+            scheduler.call_later(0, fail)
+            scheduler.call_later(0.01, done.set)
+            assert done.wait(5)
+        exception.assert_called_once_with('Scheduled job failed')
+        scheduler.stop()
+
+    @mock.patch('turbo_flask.scheduler.random.uniform')
+    def test_jitter(self, uniform):
+        uniform.side_effect = lambda a, b: b
+        job = Job(None, interval=10, jitter=0.2)
+        assert job.next_delay() == 12
+        uniform.side_effect = lambda a, b: a
+        assert job.next_delay() == 8
+
+        scheduler = Scheduler()
+        uniform.side_effect = lambda a, b: 3
+        scheduler.every(10, None)
+        assert scheduler.heap[0][0] - time.monotonic() <= 3
+        scheduler.every(10, None, jitter=0)
+        assert scheduler.heap[1][0] - time.monotonic() > 9
+
+    @pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires fork')
+    def test_fork(self):
+        scheduler = Scheduler(Flask(__name__))
+        scheduler.call_later(60, lambda: None)
+        thread = scheduler.thread
+        assert thread.is_alive()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            # the thread of the parent does not exist in the child
+            scheduler.start()
+            ok = scheduler.thread is not thread and scheduler.thread.is_alive()
+            scheduler.call_later(0, lambda: os.write(write_fd, b'1' if ok
+                                                     else b'0'))
+            time.sleep(1)
+            os._exit(0)
+        os.close(write_fd)
+        try:
+            assert os.read(read_fd, 1) == b'1'
+        finally:
+            os.close(read_fd)
+            os.waitpid(pid, 0)
+        scheduler.start()
+        assert scheduler.thread is thread
+        scheduler.stop()
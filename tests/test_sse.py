@@ -0,0 +1,167 @@
+import unittest
+from unittest import mock
+from flask import Flask, render_template_string
+import turbo_flask
+from turbo_flask.connection import Message
+from turbo_flask.replay import ReplayBuffer
+from turbo_flask.sse import SSEConnection
+
+
+class TestReplayBuffer(unittest.TestCase):
+    def test_since(self):
+        buffer = ReplayBuffer(max_size=3)
+        assert buffer.since('foo') is None
+        assert buffer.since(f'{buffer.epoch}-0') == []
+        ids = [buffer.add(Message(str(i))) for i in range(4)]
+        assert ids[0] == f'{buffer.epoch}-1'
+        assert buffer.since(f'{buffer.epoch}-0') is None
+        assert buffer.since(ids[0]) == ['1', '2', '3']
+        assert buffer.since(ids[1]) == ['2', '3']
+        assert buffer.since(ids[3]) == []
+        assert buffer.since(f'{buffer.epoch}-5') is None
+        assert buffer.since('00000000-1') is None
+        assert buffer.since(f'{buffer.epoch}-x') is None
+
+    def test_recipients(self):
+        buffer = ReplayBuffer()
+        start = f'{buffer.epoch}-0'
+        buffer.add(Message('a'))
+        buffer.add(Message('b'), to=['123'])
+        buffer.add(Message('c'), to=['456'])
+        buffer.add(Message('d'), channel=['orders', 'users'])
+        assert buffer.since(start) == ['a']
+        assert buffer.since(start, user_id='123') == ['a', 'b']
+        assert buffer.since(start, user_id='456', channels={'users'}) == \
+            ['a', 'c', 'd']
+
+    @mock.patch('turbo_flask.replay.time.monotonic')
+    def test_max_age(self, monotonic):
+        monotonic.return_value = 100
+        buffer = ReplayBuffer(max_age=10)
+        first = buffer.add(Message('a'))
+        second = buffer.add(Message('b'))
+        monotonic.return_value = 111
+        assert buffer.since(first) is None
+        assert buffer.since(second) == []
+        buffer.add(Message('c'))
+        assert len(buffer.entries) == 1
+
+
+class TestSSE(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config['TURBO_SSE_ROUTE'] = '/turbo-sse'
+        self.app.config['TURBO_SSE_KEEPALIVE'] = 0.01
+        self.app.config['TURBO_REPLAY_SIZE'] = 100
+        self.turbo = turbo_flask.Turbo(self.app)
+        self.turbo.user_id(lambda: '123')
+        self.turbo.authorize_channel(lambda channel: True)
+
+    def test_event(self):
+        message = Message('foo\nbar\r\nbaz')
+        assert message.event == 'data: foo\ndata: bar\ndata: baz\n\n'
+        message = Message('foo')
+        message.event_id = 'abc-1'
+        assert message.event == 'id: abc-1\ndata: foo\n\n'
+
+    def test_connection(self):
+        conn = SSEConnection(queue_size=0)
+        assert conn.queue_size == 100
+        assert conn.events(timeout=0) == ''
+        conn.send('foo')
+        message = Message('bar')
+        message.seq = 2
+        conn.send(message)
+        conn.replay([message])
+        assert conn.events(timeout=0) == 'data: bar\n\ndata: foo\n\n'
+        conn.close()
+        assert conn.events(timeout=0) is None
+
+    def test_turbo(self):
+        @self.app.route('/test')
+        def test():
+            return render_template_string(
+                '{{ turbo(channels=["orders"]) }}')
+
+        rv = self.app.test_client().get('/test')
+        assert b'new EventSource("/turbo-sse?channel=orders")' in rv.data
+        assert b'WebSocket' not in rv.data
+
+    def test_stream(self):
+        turbo = self.turbo
+        rv = self.app.test_client().get('/turbo-sse?channel=orders',
+                                        buffered=False)
+        assert rv.mimetype == 'text/event-stream'
+        assert rv.headers['Cache-Control'] == 'no-cache'
+        events = iter(rv.response)
+        assert next(events) == b': connected\n\n'
+        assert turbo.can_push(to='123')
+        assert turbo.can_push(channel='orders')
+        assert next(events) == b': keepalive\n\n'
+
+        turbo.push(turbo.append('foo', 'bar'))
+        turbo.push(turbo.append('baz', 'bar'), to='456')
+        turbo.push(turbo.append('baz', 'bar'), channel='orders')
+        epoch = turbo.replay.epoch
+        assert next(events) == (
+            f'id: {epoch}-1\ndata: {turbo.append("foo", "bar")}\n\n'
+            f'id: {epoch}-3\ndata: {turbo.append("baz", "bar")}\n\n'
+        ).encode()
+        rv.close()
+        assert not turbo.can_push()
+
+    def test_resume(self):
+        turbo = self.turbo
+        client = self.app.test_client()
+        first = turbo.replay.add(Message('a'))
+        turbo.push(turbo.append('foo', 'bar'))
+        turbo.push(turbo.append('baz', 'bar'), to='456')
+        turbo.push(turbo.append('baz', 'bar'), to='123')
+
+        rv = client.get('/turbo-sse', headers={'Last-Event-ID': first},
+                        buffered=False)
+        events = iter(rv.response)
+        assert next(events) == b': connected\n\n'
+        epoch = turbo.replay.epoch
+        assert next(events) == (
+            f'id: {epoch}-2\ndata: {turbo.append("foo", "bar")}\n\n'
+            f'id: {epoch}-4\ndata: {turbo.append("baz", "bar")}\n\n'
+        ).encode()
+        rv.close()
+
+        # updates that cannot be recovered make the client refresh
+        rv = client.get('/turbo-sse', headers={'Last-Event-ID': 'foo'},
+                        buffered=False)
+        events = iter(rv.response)
+        assert next(events) == b': connected\n\n'
+        assert next(events) == f'data: {turbo.refresh()}\n\n'.encode()
+        assert turbo.resume_failures == 1
+        rv.close()
+
+    def test_drain(self):
+        turbo = self.turbo
+        client = self.app.test_client()
+        rv = client.get('/turbo-sse', buffered=False)
+        events = iter(rv.response)
+        assert next(events) == b': connected\n\n'
+        assert turbo.drain(window=0) == 1
+        retry = next(events).decode()
+        assert retry.startswith('retry: ') and retry.endswith('\n\n')
+        assert 500 <= int(retry[7:]) <= 5000
+        rv.close()
+
+        rv = client.get('/turbo-sse')
+        assert rv.data == b'retry: 5000\n\n'
+        assert not turbo.can_push()
+
+    def test_head(self):
+        self.turbo.max_connections = 3
+        client = self.app.test_client()
+        for _ in range(5):
+            rv = client.head('/turbo-sse')
+            assert rv.status_code == 200
+            assert rv.mimetype == 'text/event-stream'
+            rv.close()
+        assert self.turbo.connection_count == 0
+        assert self.turbo.rejected == 0
+        assert not self.turbo.can_push()
@@ -1,9 +1,78 @@
+import gzip
+import os
+import socket
+import tempfile
+import threading
+import time
 import unittest
 from unittest import mock
 import pytest
-from flask import Flask, render_template_string
+from flask import Flask, current_app, render_template_string, request, \
+    session, stream_with_context
+import jinja2
+import simple_websocket
 from werkzeug.exceptions import NotFound
+from werkzeug.serving import make_server
+from wsproto import ConnectionType, WSConnection
+from wsproto.events import AcceptConnection, Request, TextMessage
+from wsproto.extensions import PerMessageDeflate
 import turbo_flask
+from turbo_flask.connection import Connection
+from turbo_flask.sse import SSEConnection
+
+
+def wait_for(condition, timeout=5):
+    start = time.time()
+    while not condition():
+        if time.time() - start > timeout:  # pragma: no cover
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class LiveServer:
+    def __init__(self, app):
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def url(self, path, scheme='ws'):
+        return f'{scheme}://127.0.0.1:{self.server.server_port}{path}'
+
+    def stop(self):
+        self.server.shutdown()
+
+
+class DeflateClient:
+    def __init__(self, server, path):
+        self.sock = socket.create_connection(
+            ('127.0.0.1', server.server.server_port))
+        self.ws = WSConnection(ConnectionType.CLIENT)
+        self.bytes_received = 0
+        self.sock.sendall(self.ws.send(Request(
+            host='127.0.0.1', target=path, extensions=[PerMessageDeflate()])))
+        assert isinstance(self._next_event(), AcceptConnection)
+
+    def _next_event(self):
+        while True:
+            for event in self.ws.events():
+                return event
+            data = self.sock.recv(65536)
+            self.bytes_received += len(data)
+            self.ws.receive_data(data)
+
+    def receive(self):
+        text = ''
+        while True:
+            event = self._next_event()
+            assert isinstance(event, TextMessage)
+            text += event.data
+            if event.message_finished:
+                return text
+
+    def close(self):
+        self.sock.close()
 
 
 class TestTurbo(unittest.TestCase):
@@ -124,6 +193,86 @@ class TestTurbo(unittest.TestCase):
         assert b'/js/turbo.js' in rv.data
         assert b'Turbo.connectStreamSource' in rv.data
 
+    def test_self_hosted_script(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'turbo.js')
+            with open(path, 'w') as f:
+                f.write('console.log("turbo");' * 100)
+            with open(path + '.br', 'wb') as f:
+                f.write(b'brotli')
+            app = Flask(__name__)
+            app.config['TURBO_JS_FILE'] = path
+            app.config['TURBO_JS_PRELOAD'] = True
+            turbo = turbo_flask.Turbo(app)
+
+            @app.route('/test')
+            def test():
+                return render_template_string('{{ turbo() }}')
+
+        name = turbo.script.hashed_name
+        assert name.startswith('turbo.') and name.endswith('.js')
+        client = app.test_client()
+        rv = client.get('/test')
+        assert f'<link rel="preload" href="/turbo-js/{name}" as="script">\n' \
+            f'<script src="/turbo-js/{name}"></script>' in rv.text
+        assert 'cdn.jsdelivr.net' not in rv.text
+
+        rv = client.get(f'/turbo-js/{name}')
+        assert rv.status_code == 200
+        assert rv.mimetype == 'text/javascript'
+        assert rv.headers['Cache-Control'] == \
+            'public, max-age=31536000, immutable'
+        assert rv.headers['Vary'] == 'Accept-Encoding'
+        assert 'Content-Encoding' not in rv.headers
+        assert rv.data == turbo.script.data
+        etag = rv.headers['ETag']
+
+        rv = client.get(f'/turbo-js/{name}',
+                        headers={'Accept-Encoding': 'gzip'})
+        assert rv.headers['Content-Encoding'] == 'gzip'
+        assert gzip.decompress(rv.data) == turbo.script.data
+        rv = client.get(f'/turbo-js/{name}',
+                        headers={'Accept-Encoding': 'gzip, br'})
+        assert rv.headers['Content-Encoding'] == 'br'
+        assert rv.data == b'brotli'
+        assert rv.headers['ETag'] == etag[:-1] + '-br"'
+
+        rv = client.get(f'/turbo-js/{name}', headers={'If-None-Match': etag})
+        assert rv.status_code == 304
+        assert rv.data == b''
+        rv = client.get(f'/turbo-js/{name}',
+                        headers={'If-None-Match': 'W/' + etag})
+        assert rv.status_code == 304
+        rv = client.get(f'/turbo-js/{name}',
+                        headers={'If-None-Match': etag,
+                                 'Accept-Encoding': 'gzip'})
+        assert rv.status_code == 200
+        gzip_etag = rv.headers['ETag']
+        assert gzip_etag == etag[:-1] + '-gzip"'
+        rv = client.get(f'/turbo-js/{name}',
+                        headers={'If-None-Match': 'W/' + gzip_etag,
+                                 'Accept-Encoding': 'gzip'})
+        assert rv.status_code == 304
+        assert rv.headers['ETag'] == gzip_etag
+        rv = client.get('/turbo-js/turbo.js')
+        assert rv.status_code == 200
+        assert rv.headers['Cache-Control'] == 'no-cache'
+        assert client.get('/turbo-js/turbo.123.js').status_code == 404
+
+    def test_module_preload(self):
+        app = Flask(__name__)
+        app.config['TURBO_WEBSOCKET_ROUTE'] = None
+        app.config['TURBO_JS_PRELOAD'] = True
+        turbo_flask.Turbo(app)
+
+        @app.route('/test')
+        def test():
+            return render_template_string('{{ turbo(url="/turbo.js") }}')
+
+        rv = app.test_client().get('/test')
+        assert rv.text == '<link rel="modulepreload" href="/turbo.js">\n' \
+            '<script type="module" src="/turbo.js"></script>'
+
     def test_requested_frame(self):
         app = Flask(__name__)
         turbo = turbo_flask.Turbo(app)
@@ -131,6 +280,40 @@ class TestTurbo(unittest.TestCase):
         with app.test_request_context('/', headers={'Turbo-Frame': 'foo'}):
             assert turbo.requested_frame() == 'foo'
 
+    def test_render_frame(self):
+        app = Flask(__name__)
+        app.jinja_env.loader = jinja2.DictLoader({
+            'base.html': '<title>{{ site }}</title>'
+                         '{% block content %}{% endblock %}',
+            'page.html': '{% extends "base.html" %}{% block content %}'
+                         '<h1>{{ title }}</h1>{% block todo_list %}'
+                         '<turbo-frame id="todo-list">{{ site }}: '
+                         '{{ todos|join(",") }}</turbo-frame>'
+                         '{% endblock %}{% endblock %}'})
+        app.context_processor(lambda: {'site': 'Todos'})
+        turbo = turbo_flask.Turbo(app)
+        context = {'title': 'Home', 'todos': ['a', 'b']}
+
+        with app.test_request_context('/'):
+            rv = turbo.render_frame('page.html', **context)
+            assert rv.get_data(as_text=True) == (
+                '<title>Todos</title><h1>Home</h1>'
+                '<turbo-frame id="todo-list">Todos: a,b</turbo-frame>')
+            assert rv.headers['Vary'] == 'Turbo-Frame'
+        with app.test_request_context(
+                '/', headers={'Turbo-Frame': 'todo-list'}):
+            rv = turbo.render_frame('page.html', **context)
+            assert rv.get_data(as_text=True) == \
+                '<turbo-frame id="todo-list">Todos: a,b</turbo-frame>'
+            assert rv.headers['Vary'] == 'Turbo-Frame'
+        with app.test_request_context('/', headers={'Turbo-Frame': 'list'}):
+            rv = turbo.render_frame('page.html', frames={'list': 'todo_list'},
+                                    **context)
+            assert rv.get_data(as_text=True).startswith('<turbo-frame')
+        with app.test_request_context('/', headers={'Turbo-Frame': 'foo'}):
+            rv = turbo.render_frame('page.html', **context)
+            assert rv.get_data(as_text=True).startswith('<title>')
+
     def test_can_stream(self):
         app = Flask(__name__)
         turbo = turbo_flask.Turbo(app)
@@ -141,6 +324,100 @@ class TestTurbo(unittest.TestCase):
                 '/', headers={'Accept': 'text/vnd.turbo-stream.html'}):
             assert turbo.can_stream()
 
+    def test_current_request(self):
+        app = Flask(__name__)
+        turbo = turbo_flask.Turbo(app)
+
+        with app.test_request_context('/', headers={
+                'Accept': 'text/vnd.turbo-stream.html', 'Turbo-Frame': 'foo',
+                'X-Sec-Purpose': 'prefetch', 'X-Turbo-Request-Id': '123'}):
+            turbo_request = turbo.current_request
+            assert turbo.current_request is turbo_request
+            assert turbo_request.frame == 'foo'
+            assert turbo_request.request_id == '123'
+            assert turbo_request.is_prefetch
+            with mock.patch.object(
+                    turbo_request.request.accept_mimetypes,
+                    'best_match',
+                    return_value='text/vnd.turbo-stream.html') as best_match:
+                assert turbo.can_stream()
+                assert turbo.can_stream()
+                best_match.assert_called_once()
+            assert render_template_string(
+                '{{ turbo_request.frame }}') == 'foo'
+        with app.test_request_context('/'):
+            assert turbo.current_request is not turbo_request
+            assert turbo.current_request.frame is None
+            assert not turbo.current_request.is_prefetch
+
+    def test_prefetch_cache(self):
+        app = Flask(__name__)
+        turbo = turbo_flask.Turbo(app)
+        renders = []
+
+        @app.route('/page')
+        @turbo.prefetch_cache
+        def page():
+            renders.append(request.headers.get('Cookie'))
+            return f'page {len(renders)}', {'X-Foo': 'bar'}
+
+        client = app.test_client()
+        prefetch = {'X-Sec-Purpose': 'prefetch'}
+        assert client.get('/page', headers=prefetch).text == 'page 1'
+        rv = client.get('/page', headers=prefetch)
+        assert rv.text == 'page 1'
+        assert rv.headers['X-Foo'] == 'bar'
+        assert client.get('/page').text == 'page 2'
+        assert client.get('/page?x=1', headers=prefetch).text == 'page 3'
+        client.set_cookie('session', 'abc')
+        assert client.get('/page', headers=prefetch).text == 'page 4'
+        assert turbo.prefetched.stats()['hits'] == 1
+        turbo.prefetched.clear()
+        assert client.get('/page', headers=prefetch).text == 'page 5'
+
+    def test_prefetch_cache_anonymous(self):
+        app = Flask(__name__)
+        app.secret_key = 'secret'
+        turbo = turbo_flask.Turbo(app)
+        turbo.user_id(lambda: None)
+
+        @app.route('/page')
+        @turbo.prefetch_cache
+        def page():
+            return f'token={request.cookies.get("token")}'
+
+        @app.route('/visit')
+        @turbo.prefetch_cache
+        def visit():
+            session['visits'] = session.get('visits', 0) + 1
+            return str(session['visits'])
+
+        prefetch = {'X-Sec-Purpose': 'prefetch'}
+        alice = app.test_client()
+        alice.set_cookie('token', 'alice')
+        bob = app.test_client()
+        bob.set_cookie('token', 'bob')
+        assert alice.get('/page', headers=prefetch).text == 'token=alice'
+        assert bob.get('/page', headers=prefetch).text == 'token=bob'
+        assert alice.get('/visit', headers=prefetch).text == '1'
+        assert app.test_client().get('/visit', headers=prefetch).text == '1'
+        assert alice.get('/visit', headers=prefetch).text == '2'
+        assert turbo.prefetched.stats()['hits'] == 0
+
+    def test_disable_prefetch(self):
+        app = Flask(__name__)
+        app.config['TURBO_PREFETCH'] = False
+        app.config['TURBO_WEBSOCKET_ROUTE'] = None
+        turbo_flask.Turbo(app)
+
+        @app.route('/test')
+        def test():
+            return render_template_string('{{ turbo(url="/turbo.js") }}')
+
+        rv = app.test_client().get('/test')
+        assert rv.text == '<meta name="turbo-prefetch" content="false">\n' \
+            '<script type="module" src="/turbo.js"></script>'
+
     def test_can_push(self):
         app = Flask(__name__)
         turbo = turbo_flask.Turbo(app)
@@ -234,3 +511,720 @@ class TestTurbo(unittest.TestCase):
                 )
                 got = turbo._make_stream("foo", "baz", name, multiple)
                 self.assertEqual(expected, got)
+
+    def test_push_queued(self):
+        app = Flask(__name__)
+        turbo = turbo_flask.Turbo(app)
+        ws1 = mock.MagicMock()
+        ws2 = mock.MagicMock()
+        conn1 = Connection(ws1, queue_size=1, overflow='drop_newest',
+                           on_drop=turbo._count_dropped)
+        conn2 = Connection(ws2, queue_size=1, overflow='disconnect',
+                           on_drop=turbo._count_dropped)
+        turbo.clients = {'123': [conn1], '456': [conn2]}
+
+        turbo.push(turbo.append('foo', 'bar'))
+        ws1.send.assert_not_called()
+        ws2.send.assert_not_called()
+        turbo.push(turbo.remove('baz'))
+        assert turbo.dropped == {'drop_oldest': 0, 'drop_newest': 1,
+                                 'disconnect': 2}
+        assert conn1.flush(timeout=0)
+        ws1.send.assert_called_once_with(turbo.append('foo', 'bar'))
+        assert not conn2.flush(timeout=0)
+        ws2.send.assert_not_called()
+
+    def test_channels(self):
+        app = Flask(__name__)
+        turbo = turbo_flask.Turbo(app)
+        ws1 = mock.MagicMock()
+        ws2 = mock.MagicMock()
+        ws3 = mock.MagicMock()
+
+        @turbo.authorize_channel
+        def authorize_channel(channel):
+            return channel != 'secret'
+
+        turbo._register('123', ws1, ['orders:42', 'secret'])
+        turbo._register('456', ws2, ['orders:42', 'users'])
+        turbo._register('789', ws3)
+        assert turbo.can_push(channel='orders:42')
+        assert not turbo.can_push(channel='secret')
+        assert turbo.clients.subscriptions(ws1) == {'orders:42'}
+
+        turbo.push('foo', channel='orders:42')
+        ws1.send.assert_called_once_with('foo')
+        ws2.send.assert_called_once_with('foo')
+        ws3.send.assert_not_called()
+        turbo.push('bar', channel=['orders:42', 'users'])
+        ws1.send.assert_called_with('bar')
+        assert ws2.send.call_args_list == [mock.call('foo'), mock.call('bar')]
+
+        turbo.subscribe('users', to='789')
+        turbo.unsubscribe('users', to='456')
+        turbo.push('baz', channel='users')
+        ws2.send.assert_called_with('bar')
+        ws3.send.assert_called_once_with('baz')
+
+        with pytest.raises(ValueError):
+            turbo.push('foo', to='123', channel='users')
+
+        turbo._unregister('123', ws1)
+        turbo._unregister('456', ws2)
+        assert not turbo.can_push(channel='orders:42')
+        assert '123' not in turbo.clients
+        turbo._unregister('789', ws3)
+        assert not turbo.can_push(channel='users')
+        assert not turbo.can_push()
+
+    def test_channels_not_authorized(self):
+        app = Flask(__name__)
+        turbo = turbo_flask.Turbo(app)
+        ws = mock.MagicMock()
+        turbo._register('123', ws, ['orders:42'])
+        assert not turbo.can_push(channel='orders:42')
+        turbo.subscribe('orders:42', to='123')
+        assert turbo.can_push(channel='orders:42')
+
+    def test_turbo_channels(self):
+        app = Flask(__name__)
+        turbo_flask.Turbo(app)
+
+        @app.route('/test')
+        def test():
+            return render_template_string(
+                '{{ turbo(channels=["orders:42", "users"]) }}')
+
+        rv = app.test_client().get('/test')
+        assert b'/turbo-stream?channel=orders%3A42&channel=users`' in rv.data
+
+    def test_live_push(self):
+        for queue_size in [0, 10]:
+            with self.subTest(queue_size=queue_size):
+                app = Flask(__name__)
+                app.config['TURBO_PUSH_QUEUE_SIZE'] = queue_size
+                turbo = turbo_flask.Turbo(app)
+                turbo.user_id(lambda: 'user')
+                server = LiveServer(app)
+                client = simple_websocket.Client.connect(
+                    server.url('/turbo-stream'))
+                assert wait_for(lambda: turbo.can_push(to='user'))
+                conn = turbo.clients['user'][0]
+                assert conn.sock is not None
+
+                turbo.push(turbo.append('foo', 'bar'))
+                turbo.push(turbo.append('x' * 70000, 'bar'), to='user')
+                assert client.receive(timeout=5) == turbo.append('foo', 'bar')
+                assert client.receive(timeout=5) == turbo.append(
+                    'x' * 70000, 'bar')
+
+                client.close()
+                if queue_size == 0:
+                    assert wait_for(lambda: not turbo.can_push())
+                server.stop()
+
+    def test_live_compression(self):
+        for compression in ['default', None, True, False]:
+            with self.subTest(compression=compression):
+                app = Flask(__name__)
+                if compression == 'default':
+                    compression = True
+                else:
+                    app.config['TURBO_WEBSOCKET_COMPRESSION'] = compression
+                app.config['TURBO_COMPRESSION_MIN_SIZE'] = 100
+                turbo = turbo_flask.Turbo(app)
+                turbo.user_id(lambda: 'user')
+                server = LiveServer(app)
+                client = DeflateClient(server, '/turbo-stream')
+                assert wait_for(lambda: turbo.can_push(to='user'))
+                conn = turbo.clients['user'][0]
+                if compression is None:
+                    assert conn.sock is None
+                else:
+                    assert conn.sock is not None
+                    assert conn.deflate_bits == (15 if compression else None)
+
+                large = turbo.append('x' * 50000, 'bar')
+                for _ in range(2):
+                    turbo.push(turbo.append('foo', 'bar'))
+                    turbo.push(large)
+                    assert client.receive() == turbo.append('foo', 'bar')
+                    assert client.receive() == large
+                if compression is False:
+                    assert client.bytes_received > 100000
+                else:
+                    assert client.bytes_received < 10000
+
+                client.close()
+                server.stop()
+
+    def test_live_push_timeout(self):
+        app = Flask(__name__)
+        app.config['TURBO_WEBSOCKET_COMPRESSION'] = None
+        turbo = turbo_flask.Turbo(app)
+        turbo.user_id(lambda: 'user')
+        server = LiveServer(app)
+        # the client negotiates compression and never reads
+        client = DeflateClient(server, '/turbo-stream')
+        assert wait_for(lambda: turbo.can_push(to='user'))
+        assert turbo.clients['user'][0].sock is None
+        large = turbo.append(os.urandom(2000000).hex(), 'bar')
+        start = time.monotonic()
+        for _ in range(20):
+            report = turbo.push(large, timeout=0.5, report=True)
+            if report.failed:
+                break
+        assert report.failed == 1
+        assert isinstance(report.results[0].error, TimeoutError)
+        assert time.monotonic() - start < 15
+        assert not turbo.can_push()
+        client.close()
+        server.stop()
+
+    def test_reap(self):
+        app = Flask(__name__)
+        app.config['TURBO_IDLE_TIMEOUT'] = 60
+        with pytest.raises(ValueError):
+            turbo_flask.Turbo(app)
+        app = Flask(__name__)
+        app.config['TURBO_PING_INTERVAL'] = 30
+        app.config['TURBO_IDLE_TIMEOUT'] = 60
+        turbo = turbo_flask.Turbo(app)
+        turbo.authorize_channel(lambda channel: True)
+        ws1 = mock.MagicMock()
+        ws2 = mock.MagicMock()
+        ws3 = mock.MagicMock()
+        conn1 = Connection(ws1, user_id='123')
+        conn2 = Connection(ws2, user_id='456')
+        conn3 = Connection(ws3, user_id='789')
+        turbo.reaper = mock.MagicMock()
+        turbo._register('123', conn1, ['users'])
+        turbo._register('456', conn2, ['users'])
+        turbo._register('789', conn3)
+        conn2.close()
+        conn3.last_seen -= 61
+
+        assert turbo.reap() == 2
+        assert turbo.reaped == 2
+        assert list(turbo.clients) == ['123']
+        assert turbo.clients.subscribers('users') == [conn1]
+        ws1.close.assert_not_called()
+        ws2.close.assert_called_once_with(reason=1001)
+        ws3.close.assert_called_once_with(reason=1001)
+        assert turbo.reap() == 0
+
+        # clients that cannot be pinged are not idle
+        conn4 = SSEConnection()
+        turbo._register('abc', conn4)
+        conn4.last_seen -= 61
+        assert turbo.reap() == 0
+        assert 'abc' in turbo.clients
+
+    def test_connection_limits(self):
+        app = Flask(__name__)
+        app.config['TURBO_MAX_CONNECTIONS'] = 3
+        app.config['TURBO_MAX_USER_CONNECTIONS'] = 2
+        turbo = turbo_flask.Turbo(app)
+        conn1 = Connection(mock.MagicMock(), user_id='123')
+        conn2 = Connection(mock.MagicMock(), user_id='123')
+        conn3 = Connection(mock.MagicMock(), user_id='456')
+        for conn in [conn1, conn2, conn3]:
+            assert turbo._admit(conn.user_id) is None
+            turbo._register(conn.user_id, conn, reserved=True)
+
+        assert turbo._admit('123') == 1008
+        assert turbo._admit('789') == 1008
+        assert turbo.rejected == 2
+        assert turbo.connection_count == 3
+        turbo._unregister('456', conn3)
+        assert turbo.connection_count == 2
+        assert turbo._admit('789') is None
+        assert turbo._admit('123') == 1008
+
+        # accepted connections are counted before they are registered
+        assert turbo.connection_count == 3
+        assert turbo._admit('456') == 1008
+        turbo._release('789')
+        assert turbo.connection_count == 2
+        assert turbo.reserved == {}
+
+        app = Flask(__name__)
+        app.config['TURBO_MAX_USER_CONNECTIONS'] = 2
+        turbo = turbo_flask.Turbo(app)
+        assert turbo._admit('123') is None
+        assert turbo._admit('123') is None
+        assert turbo._admit('123') == 1008
+        assert turbo.reserved == {'123': 2}
+
+    def test_connection_limits_evict_oldest(self):
+        app = Flask(__name__)
+        app.config['TURBO_MAX_CONNECTIONS'] = 3
+        app.config['TURBO_MAX_USER_CONNECTIONS'] = 2
+        app.config['TURBO_CONNECTION_LIMIT_POLICY'] = 'evict_oldest'
+        turbo = turbo_flask.Turbo(app)
+        turbo.authorize_channel(lambda channel: True)
+        ws1 = mock.MagicMock()
+        ws2 = mock.MagicMock()
+        ws3 = mock.MagicMock()
+        conn1 = Connection(ws1, user_id='123')
+        conn2 = Connection(ws2, user_id='123')
+        conn3 = Connection(ws3, user_id='456')
+        conn1.created -= 2
+        conn3.created -= 1
+        for conn in [conn1, conn2, conn3]:
+            turbo._register(conn.user_id, conn, ['users'])
+
+        # the oldest connection of the user is evicted
+        assert turbo._admit('123') is None
+        ws1.close.assert_called_once_with(reason=1008)
+        assert turbo.clients['123'] == (conn2,)
+        assert turbo.clients.subscribers('users') == [conn2, conn3]
+        turbo._register('123', Connection(mock.MagicMock(), user_id='123'),
+                        reserved=True)
+
+        # the oldest connection of all users is evicted
+        assert turbo._admit('789') is None
+        ws3.close.assert_called_once_with(reason=1008)
+        ws2.close.assert_not_called()
+        assert '456' not in turbo.clients
+        assert turbo.connection_count == 3
+        turbo._release('789')
+        assert turbo.connection_count == 2
+        assert turbo.rejected == 0
+
+    def test_connection_limit_policy_invalid(self):
+        app = Flask(__name__)
+        app.config['TURBO_CONNECTION_LIMIT_POLICY'] = 'foo'
+        with pytest.raises(ValueError):
+            turbo_flask.Turbo(app)
+
+    @mock.patch('turbo_flask.turbo.time.monotonic')
+    def test_connect_rate(self, monotonic):
+        monotonic.return_value = 100
+        app = Flask(__name__)
+        app.config['TURBO_CONNECT_RATE'] = 2
+        app.config['TURBO_CONNECT_BURST'] = 3
+        turbo = turbo_flask.Turbo(app)
+        assert [turbo._admit('123') for _ in range(4)] == \
+            [None, None, None, 1013]
+        monotonic.return_value = 100.5
+        assert [turbo._admit('123') for _ in range(2)] == [None, 1013]
+        monotonic.return_value = 110
+        assert [turbo._admit('123') for _ in range(4)] == \
+            [None, None, None, 1013]
+        assert turbo.rejected == 3
+
+    def test_live_cleanup(self):
+        app = Flask(__name__)
+        app.config['TURBO_PUSH_QUEUE_SIZE'] = 10
+        turbo = turbo_flask.Turbo(app)
+        turbo.user_id(lambda: 'user')
+        server = LiveServer(app)
+        simple_websocket.Client.connect(server.url('/turbo-stream'))
+        assert wait_for(lambda: turbo.can_push(to='user'))
+        conn = turbo.clients['user'][0]
+        conn.sock = mock.MagicMock()
+        conn.sock.sendall.side_effect = ConnectionResetError()
+        turbo.push('foo')
+        assert wait_for(lambda: turbo.connection_count == 0)
+        assert conn.closed and not turbo.can_push()
+
+        # the connection is also removed when a hook fails
+        connected = []
+
+        @turbo.on_connect
+        def on_connect(user_id, conn):
+            connected.append(conn)
+            raise RuntimeError('foo')
+
+        simple_websocket.Client.connect(server.url('/turbo-stream'))
+        assert wait_for(lambda: connected and connected[0].closed)
+        assert wait_for(lambda: turbo.connection_count == 0)
+        assert not turbo.can_push()
+        server.stop()
+
+    def test_live_connection_limit(self):
+        app = Flask(__name__)
+        app.config['TURBO_MAX_USER_CONNECTIONS'] = 1
+        turbo = turbo_flask.Turbo(app)
+        turbo.user_id(lambda: 'user')
+        server = LiveServer(app)
+        client1 = simple_websocket.Client.connect(
+            server.url('/turbo-stream'))
+        try:
+            assert wait_for(lambda: turbo.can_push(to='user'))
+            client2 = simple_websocket.Client.connect(
+                server.url('/turbo-stream'))
+            with pytest.raises(simple_websocket.ConnectionClosed) as exc:
+                client2.receive(timeout=5)
+            assert exc.value.reason == 1008
+            assert len(turbo.clients['user']) == 1
+        finally:
+            client1.close()
+            server.stop()
+
+    def test_live_heartbeat(self):
+        app = Flask(__name__)
+        app.config['TURBO_PING_INTERVAL'] = 0.05
+        app.config['TURBO_IDLE_TIMEOUT'] = 0.5
+        app.config['TURBO_REAP_INTERVAL'] = 0.05
+        turbo = turbo_flask.Turbo(app)
+        turbo.user_id(lambda: 'user')
+        server = LiveServer(app)
+        client = simple_websocket.Client.connect(server.url('/turbo-stream'))
+        assert wait_for(lambda: turbo.can_push(to='user'))
+        conn = turbo.clients['user'][0]
+
+        # the client answers pings, so it is not considered idle
+        time.sleep(0.7)
+        assert turbo.can_push(to='user')
+        assert conn.last_seen > conn.last_ping - 0.5
+
+        # a client that stops answering pings is evicted
+        with mock.patch.object(client, '_handle_events'):
+            assert wait_for(lambda: not turbo.can_push(to='user'))
+        assert turbo.reaped == 1
+        client.close()
+        server.stop()
+
+    def test_drain(self):
+        app = Flask(__name__)
+        app.config['TURBO_DRAIN_WINDOW'] = 0.1
+        turbo = turbo_flask.Turbo(app)
+        sockets = [mock.MagicMock() for _ in range(3)]
+        for i, ws in enumerate(sockets):
+            turbo._register(str(i), Connection(ws, user_id=str(i)))
+        turbo._register('mock', mock.MagicMock())
+
+        start = time.monotonic()
+        assert turbo.drain() == 3
+        assert time.monotonic() - start <= 0.5
+        for ws in sockets:
+            ws.close.assert_called_once_with(reason=1012)
+        assert list(turbo.clients) == ['mock']
+        assert turbo.connection_count == 1
+        assert turbo._admit('123') == 1012
+        assert turbo.rejected == 0
+
+    def test_live_drain(self):
+        app = Flask(__name__)
+        turbo = turbo_flask.Turbo(app)
+        turbo.user_id(lambda: 'user')
+        server = LiveServer(app)
+
+        @app.route('/test')
+        def test():
+            return render_template_string('{{ turbo() }}')
+
+        # the client reconnects with a random, growing delay
+        rv = app.test_client().get('/test')
+        assert b"addEventListener('close'" in rv.data
+        assert b'Math.random()' in rv.data
+        assert b'last_event_id' not in rv.data
+
+        client = simple_websocket.Client.connect(server.url('/turbo-stream'))
+        assert wait_for(lambda: turbo.can_push(to='user'))
+        assert turbo.drain(window=0.05) == 1
+        with pytest.raises(simple_websocket.ConnectionClosed) as exc:
+            client.receive(timeout=5)
+        assert exc.value.reason == 1012
+
+        # new connections are rejected while draining (the client does not
+        # always see the close code when it arrives with the handshake)
+        with pytest.raises(simple_websocket.ConnectionClosed):
+            client = simple_websocket.Client.connect(
+                server.url('/turbo-stream'))
+            client.receive(timeout=5)
+        assert not turbo.can_push()
+        server.stop()
+
+    def test_push_report(self):
+        app = Flask(__name__)
+        app.config['TURBO_PUSH_COALESCE_WINDOW'] = 10
+        turbo = turbo_flask.Turbo(app)
+        ws1 = mock.MagicMock()
+        ws2 = mock.MagicMock()
+        ws2.send.side_effect = BrokenPipeError()
+        conn1 = Connection(ws1, user_id='123')
+        conn2 = Connection(ws2, user_id='456')
+        conn3 = Connection(mock.MagicMock(), queue_size=1,
+                           overflow='drop_newest')
+        conn3.send('foo')
+        turbo._register('123', conn1)
+        turbo._register('456', conn2)
+        turbo._register('789', conn3)
+
+        report = turbo.push(turbo.replace('foo', 'a'), report=True)
+        assert (report.sent, report.queued, report.dropped,
+                report.failed) == (1, 0, 1, 1)
+        assert len(report) == 3
+        assert report.elapsed > 0
+        failed = [r for r in report.results if r.status == 'failed'][0]
+        assert failed.user_id == '456'
+        assert isinstance(failed.error, BrokenPipeError)
+
+        # the broken connection is removed right away
+        assert conn2.closed
+        assert sorted(turbo.clients) == ['123', '789']
+        assert turbo.connection_count == 2
+
+        report = turbo.push(turbo.replace('foo', 'a'), to='123',
+                            dedup=True, report=True)
+        assert report.sent == 1
+        report = turbo.push(turbo.replace('foo', 'a'), to='123',
+                            dedup=True, report=True)
+        assert report.suppressed == 1
+        assert turbo.push('foo') is None
+        assert ws1.send.call_count == 2
+
+    def test_scheduled_push(self):
+        app = Flask(__name__)
+        turbo = turbo_flask.Turbo(app)
+        turbo.authorize_channel(lambda channel: True)
+        calls = []
+
+        @turbo.every(0.01, channel='stats', jitter=0)
+        def update():
+            calls.append(current_app.name)
+            return turbo.update('foo', 'stats')
+
+        time.sleep(0.05)
+        assert calls == []  # no subscribers, so nothing is rendered
+
+        ws = mock.MagicMock()
+        turbo._register('123', Connection(ws), ['stats'])
+        with mock.patch.object(turbo.broker, 'publish') as publish:
+            assert wait_for(lambda: ws.send.call_count >= 2)
+            publish.assert_not_called()  # delivered to local clients only
+        assert calls[0] == app.name
+        ws.send.assert_called_with(turbo.update('foo', 'stats'))
+        update.job.cancel()
+
+        late = []
+        job = turbo.push_later(lambda: late.append(1), 0.01, to='456')
+        turbo.push_later(turbo.append('bar', 'a'), 0.01, to='123')
+        turbo.push_later(lambda: turbo.remove('a'), 0.02, to=['123'],
+                         coalesce=False)
+        assert wait_for(
+            lambda: ws.send.call_args[0][0] == turbo.remove('a'))
+        assert mock.call(turbo.append('bar', 'a')) in ws.send.call_args_list
+        assert late == [] and job.interval is None
+        with pytest.raises(TypeError):
+            turbo.push_later('foo', 1, report=True)
+        turbo.scheduler.stop()
+
+    def test_push_dedup_dropped(self):
+        app = Flask(__name__)
+        turbo = turbo_flask.Turbo(app)
+        conn = Connection(mock.MagicMock(), queue_size=1,
+                          overflow='drop_newest')
+        turbo._register('123', conn)
+        turbo.push(turbo.replace('a', 'x'), dedup=True)
+        report = turbo.push(turbo.replace('b', 'x'), dedup=True, report=True)
+        assert report.dropped == 1
+        conn.flush(timeout=0)
+        report = turbo.push(turbo.replace('b', 'x'), dedup=True, report=True)
+        assert report.queued == 1 and report.suppressed == 0
+
+        # an update that is evicted from the queue is not recorded either
+        ws = mock.MagicMock()
+        conn = Connection(ws, queue_size=1)
+        turbo._register('456', conn)
+        turbo.push(turbo.replace('v1', 'a'), to='456', dedup=True)
+        turbo.push(turbo.replace('x', 'b'), to='456', dedup=True)
+        report = turbo.push(turbo.replace('v1', 'a'), to='456', dedup=True,
+                            report=True)
+        assert report.queued == 1 and report.suppressed == 0
+        conn.flush(timeout=0)
+        ws.send.assert_called_once_with(turbo.replace('v1', 'a'))
+
+    def test_concurrent_push_replay(self):
+        app = Flask(__name__)
+        app.config['TURBO_REPLAY_SIZE'] = 10
+        turbo = turbo_flask.Turbo(app)
+        ws = mock.MagicMock()
+        turbo._register('123', Connection(ws))
+        add = turbo.replay.add
+        added = threading.Event()
+        resume = threading.Event()
+
+        def slow_add(message, to=None, channel=None):
+            # the first push is paused after it gets its sequence number
+            event_id = add(message, to, channel)
+            if message == 'a':
+                added.set()
+                resume.wait(5)
+            return event_id
+
+        with mock.patch.object(turbo.replay, 'add', side_effect=slow_add):
+            thread = threading.Thread(target=turbo.push, args=('a',))
+            thread.start()
+            assert added.wait(5)
+            turbo.push('b')
+            resume.set()
+            thread.join(5)
+        epoch = turbo.replay.epoch
+        assert ws.send.call_args_list == [
+            mock.call(f'<!--turbo-id:{epoch}-2-->b'),
+            mock.call(f'<!--turbo-id:{epoch}-1-->a')]
+
+        threads = [threading.Thread(target=turbo.push, args=(str(i),))
+                   for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+        assert ws.send.call_count == 22
+
+    def test_push_timeout(self):
+        app = Flask(__name__)
+        app.config['TURBO_SEND_TIMEOUT'] = 5
+        turbo = turbo_flask.Turbo(app)
+        conn = mock.MagicMock()
+        turbo.clients = {'123': [conn]}
+        turbo.push('foo')
+        conn.send.assert_called_once_with('foo', timeout=5)
+        turbo.push('bar', timeout=1)
+        conn.send.assert_called_with('bar', timeout=1)
+
+    def test_push_dedup(self):
+        app = Flask(__name__)
+        app.config['TURBO_DEDUP_SIZE'] = 2
+        turbo = turbo_flask.Turbo(app)
+        ws1 = mock.MagicMock()
+        ws2 = mock.MagicMock()
+        conn1 = Connection(ws1, dedup_size=turbo.dedup_size)
+        conn2 = Connection(ws2, dedup_size=turbo.dedup_size)
+        turbo.clients = {'123': [conn1], '456': [conn2]}
+
+        turbo.push(turbo.replace('foo', 'a'), dedup=True)
+        turbo.push(turbo.replace('foo', 'a'), dedup=True)
+        turbo.push(turbo.replace('foo', 'a'), to='123', dedup=True)
+        assert ws1.send.call_count == 1
+        assert ws2.send.call_count == 1
+        assert turbo.suppressed == 3
+
+        # changed content, and appends, are always sent
+        turbo.push([turbo.replace('bar', 'a'), turbo.append('x', 'b'),
+                    turbo.append('x', 'b')], to='123', dedup=True)
+        assert ws1.send.call_count == 4
+
+        # a stream that changes the target resets its state
+        turbo.push(turbo.append('baz', 'a'), to='123')
+        turbo.push(turbo.replace('bar', 'a'), to='123', dedup=True)
+        assert ws1.send.call_count == 6
+
+        # the state is bounded
+        turbo.push([turbo.update('1', 'c'), turbo.update('2', 'd')],
+                   to='123', dedup=True)
+        assert list(conn1.digests) == [('target', 'c'), ('target', 'd')]
+        turbo.push(turbo.replace('bar', 'a'), to='123', dedup=True)
+        assert ws1.send.call_count == 9
+
+        # an unidentified message resets all the state
+        turbo.push(turbo.update('1', 'c') + turbo.update('2', 'd'), to='123')
+        assert len(conn1.digests) == 0
+        assert turbo.suppressed == 3
+
+        # an element id and a selector with the same text are different
+        turbo.push(turbo.replace('x', 'e'), to='123', dedup=True)
+        turbo.push(turbo.replace('x', 'e', multiple=True), to='123',
+                   dedup=True)
+        assert ws1.send.call_count == 12
+
+    def test_stream_generator(self):
+        app = Flask(__name__)
+        turbo = turbo_flask.Turbo(app)
+        produced = []
+
+        @app.route('/test')
+        def test():
+            buffer_size = int(request.args.get('buffer_size', 0))
+
+            def generate():
+                for i in range(4):
+                    produced.append(i)
+                    if i == 3:
+                        yield None
+                    yield turbo.append(request.args.get('x', '') + str(i),
+                                       'rows')
+
+            return turbo.stream(stream_with_context(generate()),
+                                buffer_size=buffer_size)
+
+        client = app.test_client()
+        rv = client.get('/test?x=a', buffered=False)
+        assert rv.mimetype == 'text/vnd.turbo-stream.html'
+        assert rv.headers['X-Accel-Buffering'] == 'no'
+        # stream_with_context runs the generator up to its first stream
+        assert produced == [0]
+        chunks = iter(rv.response)
+        assert next(chunks) == turbo.append('a0', 'rows').encode()
+        assert produced == [0]
+        assert next(chunks) == turbo.append('a1', 'rows').encode()
+        assert produced == [0, 1]
+        rv.close()
+
+        produced.clear()
+        size = len(turbo.append('0', 'rows'))
+        rv = client.get(f'/test?buffer_size={size * 2}', buffered=False)
+        chunks = iter(rv.response)
+        assert next(chunks) == (turbo.append('0', 'rows') +
+                                turbo.append('1', 'rows')).encode()
+        assert produced == [0, 1]
+        assert next(chunks) == turbo.append('2', 'rows').encode()
+        assert produced == [0, 1, 2, 3]
+        assert next(chunks) == turbo.append('3', 'rows').encode()
+        with pytest.raises(StopIteration):
+            next(chunks)
+        rv.close()
+
+        rv = client.get('/test')
+        assert rv.get_data(as_text=True) == ''.join(
+            turbo.append(str(i), 'rows') for i in range(4))
+
+    def test_live_resume(self):
+        app = Flask(__name__)
+        app.config['TURBO_REPLAY_SIZE'] = 10
+        turbo = turbo_flask.Turbo(app)
+        turbo.user_id(lambda: 'user')
+        server = LiveServer(app)
+
+        @app.route('/test')
+        def test():
+            return render_template_string('{{ turbo() }}')
+
+        assert b'last_event_id' in app.test_client().get('/test').data
+
+        client = simple_websocket.Client.connect(server.url('/turbo-stream'))
+        assert wait_for(lambda: turbo.can_push(to='user'))
+        turbo.push(turbo.append('foo', 'bar'))
+        epoch = turbo.replay.epoch
+        assert client.receive(timeout=5) == \
+            f'<!--turbo-id:{epoch}-1-->' + turbo.append('foo', 'bar')
+        client.close()
+        assert wait_for(lambda: not turbo.can_push())
+
+        turbo.push(turbo.append('baz', 'bar'))
+        turbo.push(turbo.append('baz', 'bar'), to='other')
+        # the client only processes data that arrives with the handshake
+        # response when more data arrives, so a push follows each resume
+        client = simple_websocket.Client.connect(
+            server.url(f'/turbo-stream?last_event_id={epoch}-1'))
+        assert wait_for(lambda: turbo.can_push(to='user'))
+        turbo.push(turbo.append('qux', 'bar'))
+        assert client.receive(timeout=5) == \
+            f'<!--turbo-id:{epoch}-2-->' + turbo.append('baz', 'bar')
+        assert client.receive(timeout=5) == \
+            f'<!--turbo-id:{epoch}-4-->' + turbo.append('qux', 'bar')
+        client.close()
+        assert wait_for(lambda: not turbo.can_push())
+
+        client = simple_websocket.Client.connect(
+            server.url('/turbo-stream?last_event_id=foo-1'))
+        assert wait_for(lambda: turbo.can_push(to='user'))
+        turbo.push(turbo.append('qux', 'bar'))
+        assert client.receive(timeout=5) == turbo.refresh()
+        assert turbo.resume_failures == 1
+        client.close()
+        server.stop()